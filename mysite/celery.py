@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.schedules import crontab
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
@@ -25,4 +26,32 @@ app.conf.beat_schedule = {
         'task': 'wallet.tasks.cleanup_old_transactions',
         'schedule': 86400.0,  # Daily
     },
+    'maintain-transaction-partitions': {
+        'task': 'wallet.tasks.maintain_transaction_partitions',
+        'schedule': 86400.0,  # Daily
+    },
+    'archive-transactions': {
+        'task': 'wallet.tasks.archive_transactions',
+        'schedule': 86400.0,  # Daily
+    },
+    'purge-expired-idempotency-keys': {
+        'task': 'wallet.tasks.purge_expired_idempotency_keys',
+        'schedule': 3600.0,  # Hourly
+    },
+    'consolidate-hot-wallets': {
+        'task': 'wallet.tasks.consolidate_hot_wallets',
+        'schedule': 60.0,  # Every minute
+    },
+    'relay-outbox': {
+        'task': 'wallet.tasks.relay_outbox',
+        'schedule': 5.0,  # Every 5 seconds
+    },
+    'refresh-daily-rollups': {
+        'task': 'wallet.tasks.refresh_daily_rollups',
+        'schedule': 10.0,  # Every 10 seconds
+    },
+    'monthly-statements': {
+        'task': 'wallet.tasks.start_statement_run',
+        'schedule': crontab(minute=30, hour=0, day_of_month=1),  # Last month's, on the 1st
+    },
 } 
\ No newline at end of file
@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -53,6 +53,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'wallet.middleware.LoadSheddingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -95,8 +96,81 @@ DATABASES = {
     }
 }
 
+# Database connections. By default every process keeps a psycopg pool of
+# connections that are health-checked when checked out. Processes behind
+# PgBouncer in transaction pooling mode (e.g. Celery workers) set
+# DB_PGBOUNCER and leave pooling to PgBouncer; Django already avoids
+# prepared statements, and the only server-side cursor (transaction
+# exports) lives inside a transaction, as transaction pooling requires.
+DB_PGBOUNCER = config('DB_PGBOUNCER', default=False, cast=bool)
+DB_POOL_ENABLED = config('DB_POOL_ENABLED', default=True, cast=bool)
+DB_POOL_MIN_SIZE = config('DB_POOL_MIN_SIZE', default=2, cast=int)  # connections kept open per process
+DB_POOL_MAX_SIZE = config('DB_POOL_MAX_SIZE', default=10, cast=int)  # connections per process at most
+DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', default=10.0, cast=float)  # seconds a checkout waits for a connection
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)  # seconds a connection to PgBouncer is reused
+
+if DB_PGBOUNCER:
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+    })
+elif DB_POOL_ENABLED:
+    DATABASES['default'].update({
+        # With a pool, health checks run on every checkout
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pool': {
+                'min_size': DB_POOL_MIN_SIZE,
+                'max_size': DB_POOL_MAX_SIZE,
+                'timeout': DB_POOL_TIMEOUT,
+            },
+        },
+    })
+
+# Read replica. The alias always exists (pointing at the primary unless
+# POSTGRES_REPLICA_HOST is set) so tests can run against a second database;
+# reads only go to it when it is listed in DATABASE_REPLICAS.
+POSTGRES_REPLICA_HOST = config('POSTGRES_REPLICA_HOST', default='')
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'HOST': POSTGRES_REPLICA_HOST or DATABASES['default']['HOST'],
+    'PORT': config('POSTGRES_REPLICA_PORT', default=DATABASES['default']['PORT']),
+    'TEST': {'NAME': 'test_wallet_db_replica'},
+}
+DATABASE_REPLICAS = ['replica'] if POSTGRES_REPLICA_HOST else []
+DATABASE_ROUTERS = ['wallet.sharding.ShardRouter', 'wallet.routing.PrimaryReplicaRouter']
+REPLICA_MAX_LAG = config('REPLICA_MAX_LAG', default=2.0, cast=float)  # seconds a replica may be behind and still serve reads
+REPLICA_LAG_CHECK_INTERVAL = config('REPLICA_LAG_CHECK_INTERVAL', default=2.0, cast=float)  # seconds between a process's lag checks
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=10, cast=int)  # seconds a user's reads stay on the primary after moving money
+
+# Shards (see wallet.sharding). SHARD_DATABASES lists the databases that
+# hold wallets besides the primary, as host:port/name; they become the
+# aliases shard_1, shard_2, ... and the primary stays the first shard and
+# the home of the shard map. shard_1 always exists (pointing at the primary
+# server unless configured) so tests can run against a second shard;
+# wallets only go to the shards listed in SHARDS.
+SHARD_DATABASES = config('SHARD_DATABASES', default='', cast=Csv())
+for number, location in enumerate(SHARD_DATABASES or [''], start=1):
+    address, _, name = location.rpartition('/')
+    host, _, port = address.partition(':')
+    DATABASES[f'shard_{number}'] = {
+        **DATABASES['default'],
+        'HOST': host or DATABASES['default']['HOST'],
+        'PORT': port or DATABASES['default']['PORT'],
+        'NAME': name or DATABASES['default']['NAME'],
+        'TEST': {'NAME': f'test_wallet_db_shard_{number}'},
+    }
+SHARDS = ['default'] + [f'shard_{number}' for number in range(1, len(SHARD_DATABASES) + 1)]
+SHARD_MAP_TTL = config('SHARD_MAP_TTL', default=5.0, cast=float)  # seconds a process uses its copy of the shard map
+
 # Redis Configuration
 REDIS_URL = config('REDIS_URL', default='redis://wallet.task.redis:6379/0')
+REDIS_SOCKET_TIMEOUT = config('REDIS_SOCKET_TIMEOUT', default=0.5, cast=float)
+REDIS_RETRY_AFTER = config('REDIS_RETRY_AFTER', default=10, cast=int)  # seconds to skip Redis after a failure
+
+# Idempotency-Key handling for money-moving endpoints
+IDEMPOTENCY_STORE = config('IDEMPOTENCY_STORE', default='redis')  # 'redis' caches stored responses, 'db' uses the table alone
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=86400, cast=int)  # seconds a stored response is replayed
 
 # Celery Configuration
 CELERY_BROKER_URL = REDIS_URL
@@ -106,23 +180,106 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+# Bulk payouts
+PAYOUT_CHUNK_SIZE = config('PAYOUT_CHUNK_SIZE', default=1000, cast=int)  # rows credited per Celery task
+PAYOUT_MAX_ITEMS = config('PAYOUT_MAX_ITEMS', default=100000, cast=int)  # rows accepted per job
+
+# Daily balance rollups
+ROLLUP_REFRESH_BATCH = config('ROLLUP_REFRESH_BATCH', default=5000, cast=int)  # queued wallet days recomputed per refresh
+STATEMENT_MAX_DAYS = config('STATEMENT_MAX_DAYS', default=366, cast=int)  # longest period one statement covers
+STATEMENT_CHUNK_SIZE = config('STATEMENT_CHUNK_SIZE', default=5000, cast=int)  # wallets per month-end statement task
+
+# Monthly partitions of the transactions table (see wallet.partitions)
+TRANSACTION_PARTITIONS_AHEAD = config('TRANSACTION_PARTITIONS_AHEAD', default=3, cast=int)  # future months kept ready
+TRANSACTION_RETENTION_MONTHS = config('TRANSACTION_RETENTION_MONTHS', default=0, cast=int)  # months of partitions kept; 0 keeps all
+TRANSACTION_PARTITION_EXPIRY = config('TRANSACTION_PARTITION_EXPIRY', default='detach')  # 'detach' or 'drop' expired partitions
+
+# Batched deletes of expired rows (see wallet.purge)
+PURGE_BATCH_SIZE = config('PURGE_BATCH_SIZE', default=5000, cast=int)  # rows deleted per statement and transaction
+PURGE_BATCH_PAUSE = config('PURGE_BATCH_PAUSE', default=0.1, cast=float)  # seconds slept between batches
+PURGE_MAX_SECONDS = config('PURGE_MAX_SECONDS', default=600, cast=float)  # seconds a run may take before it checkpoints and stops
+
+# Cold storage of old transactions (see wallet.archive)
+ARCHIVE_AFTER_DAYS = config('ARCHIVE_AFTER_DAYS', default=0, cast=int)  # settled transactions older than this (whole months) are archived; 0 disables
+ARCHIVE_BATCH_SIZE = config('ARCHIVE_BATCH_SIZE', default=500, cast=int)  # wallets per page of a run
+ARCHIVE_BATCH_ROWS = config('ARCHIVE_BATCH_ROWS', default=50000, cast=int)  # rows per segment file and transaction
+
+# Transactional outbox of transaction events (see wallet.outbox)
+OUTBOX_BATCH_SIZE = config('OUTBOX_BATCH_SIZE', default=500, cast=int)  # events taken off the outbox per statement and transaction
+OUTBOX_RELAY_MAX_SECONDS = config('OUTBOX_RELAY_MAX_SECONDS', default=5, cast=float)  # seconds one relay run drains before leaving the rest to the next
+
+# Transaction exports
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)  # rows fetched per server-side cursor round trip
+
+# Primary keys: dotted path to a callable returning a uuid.UUID
+ID_GENERATOR = config('ID_GENERATOR', default='wallet.ids.uuid7')
+
+# Hot wallets
+HOT_WALLET_SLOTS = config('HOT_WALLET_SLOTS', default=16, cast=int)  # balance slots per hot wallet
+
+# Read-through cache of wallet balances (Redis plus a per-process LRU)
+WALLET_CACHE_ENABLED = config('WALLET_CACHE_ENABLED', default=True, cast=bool)
+WALLET_CACHE_TTL = config('WALLET_CACHE_TTL', default=60, cast=int)  # seconds an entry lives in Redis
+WALLET_CACHE_LOCAL_TTL = config('WALLET_CACHE_LOCAL_TTL', default=1.0, cast=float)  # seconds an entry lives in-process
+WALLET_CACHE_LOCAL_SIZE = config('WALLET_CACHE_LOCAL_SIZE', default=10000, cast=int)  # entries kept in-process
+WALLET_CACHE_LOCK_TIMEOUT = config('WALLET_CACHE_LOCK_TIMEOUT', default=2.0, cast=float)  # seconds a miss waits for another loader
+
 # REST Framework Configuration - JWT Bearer Token Authentication Only
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'wallet.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'wallet.throttling.AnonRateThrottle',
+        'wallet.throttling.UserRateThrottle',
+        'wallet.throttling.ScopedRateThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': config('THROTTLE_ANON_RATE', default='300/min'),
+        'user': config('THROTTLE_USER_RATE', default='1200/min'),
+        'auth': config('THROTTLE_AUTH_RATE', default='20/min'),  # login/registration (password hashing), per IP
+        'money': config('THROTTLE_MONEY_RATE', default='120/min'),
+        'exports': config('THROTTLE_EXPORTS_RATE', default='30/min'),  # exports and statements
+    },
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'wallet.renderers.ORJSONRenderer',
+        'wallet.renderers.MessagePackRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'wallet.renderers.ORJSONParser',
+        'wallet.renderers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
 }
 
+# Rate limiting (rates are in REST_FRAMEWORK above)
+THROTTLE_LOCAL_TTL = config('THROTTLE_LOCAL_TTL', default=1.0, cast=float)  # seconds a process trusts a bucket level from Redis
+THROTTLE_LOCAL_HEADROOM = config('THROTTLE_LOCAL_HEADROOM', default=0.5, cast=float)  # share of a bucket left for requests to skip Redis
+THROTTLE_LOCAL_BATCH = config('THROTTLE_LOCAL_BATCH', default=0.1, cast=float)  # share of a bucket a process spends before reporting
+THROTTLE_LOCAL_SIZE = config('THROTTLE_LOCAL_SIZE', default=10000, cast=int)  # buckets remembered per process
+
+# Load shedding
+LOAD_SHED_ENABLED = config('LOAD_SHED_ENABLED', default=True, cast=bool)
+LOAD_SHED_P99_MS = config('LOAD_SHED_P99_MS', default=1000, cast=int)  # p99 latency that sheds low-priority views
+LOAD_SHED_WINDOW = config('LOAD_SHED_WINDOW', default=10, cast=int)  # seconds of requests the p99 covers
+LOAD_SHED_MIN_SAMPLES = config('LOAD_SHED_MIN_SAMPLES', default=100, cast=int)  # requests needed before shedding
+
+# Worker metrics (GET /api/v1/metrics/)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')  # bearer token scrapers send; metrics are off when empty
+METRICS_PUBLISH_INTERVAL = config('METRICS_PUBLISH_INTERVAL', default=10, cast=int)  # seconds between a worker's snapshots in Redis
+
 # JWT Configuration
 from datetime import timedelta
+JWT_STATELESS_READS = config('JWT_STATELESS_READS', default=False, cast=bool)  # id-only read endpoints trust the token alone
+TOKEN_REVOCATION_SYNC_INTERVAL = config('TOKEN_REVOCATION_SYNC_INTERVAL', default=1.0, cast=float)  # seconds between Bloom filter syncs
+TOKEN_REVOCATION_BLOOM_CAPACITY = config('TOKEN_REVOCATION_BLOOM_CAPACITY', default=100000, cast=int)  # revocations per filter before it is rebuilt
+TOKEN_REVOCATION_BLOOM_ERROR_RATE = config('TOKEN_REVOCATION_BLOOM_ERROR_RATE', default=0.001, cast=float)  # share of live tokens confirmed in Redis
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
@@ -194,6 +351,16 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    # Segment files of archived transactions; any Django storage backend, e.g. storages.backends.s3.S3Storage
+    'archive': {
+        'BACKEND': config('ARCHIVE_STORAGE_BACKEND', default='django.core.files.storage.FileSystemStorage'),
+        'OPTIONS': {'location': config('ARCHIVE_LOCATION', default=os.path.join(BASE_DIR, 'archive'))},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -1,10 +1,78 @@
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.exceptions import ValidationError
+from . import routing, sharding
 from .models import User, Wallet, Transaction
 
 
+class ReplicaChangeListMixin:
+    """Change lists are read from a replica; edits and actions keep their author on the primary"""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            routing.pin_to_primary(request.user.pk)
+            return super().changelist_view(request, extra_context)
+        with routing.replica_reads(request.user.pk):
+            response = super().changelist_view(request, extra_context)
+            # The page's rows are only fetched when the template renders
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+    def changeform_view(self, request, *args, **kwargs):
+        if request.method == 'POST':
+            routing.pin_to_primary(request.user.pk)
+        return super().changeform_view(request, *args, **kwargs)
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Lists the rows of one shard, ``default`` unless another is picked"""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        if not sharding.enabled():
+            return []
+        return [(shard, shard) for shard in sharding.each_shard()[1:]]
+
+    def choices(self, changelist):
+        choices = list(super().choices(changelist))
+        # Without a pick the list is of the first shard, not of all of them
+        choices[0]['display'] = sharding.each_shard()[0]
+        return choices
+
+    def queryset(self, request, queryset):
+        if self.value() in sharding.each_shard():
+            return queryset.using(self.value())
+        return queryset
+
+
+class ShardedAdminMixin:
+    """Change lists show one shard at a time; objects are found on whichever shard holds them"""
+
+    def get_list_filter(self, request):
+        return [ShardListFilter, *super().get_list_filter(request)]
+
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None or not sharding.enabled():
+            return obj
+        queryset = self.get_queryset(request)
+        field = queryset.model._meta.pk if from_field is None else queryset.model._meta.get_field(from_field)
+        try:
+            object_id = field.to_python(object_id)
+        except ValidationError:
+            return None
+        for shard in sharding.each_shard()[1:]:
+            obj = queryset.using(shard).filter(**{field.name: object_id}).first()
+            if obj is not None:
+                return obj
+        return None
+
+
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(ReplicaChangeListMixin, BaseUserAdmin):
     """Admin interface for User model"""
     list_display = ['email', 'username', 'first_name', 'last_name', 'is_active', 'created_at']
     list_filter = ['is_active', 'is_staff', 'is_superuser', 'created_at']
@@ -19,19 +87,27 @@ class UserAdmin(BaseUserAdmin):
         ('Additional Info', {'fields': ('phone_number', 'date_of_birth')}),
     )
 
+    def delete_queryset(self, request, queryset):
+        if not sharding.enabled():
+            return super().delete_queryset(request, queryset)
+        # One by one, so each user's wallet is deleted from its shard too
+        for user in queryset:
+            user.delete()
+
 
 @admin.register(Wallet)
-class WalletAdmin(admin.ModelAdmin):
+class WalletAdmin(ShardedAdminMixin, ReplicaChangeListMixin, admin.ModelAdmin):
     """Admin interface for Wallet model"""
-    list_display = ['user', 'balance', 'currency', 'is_active', 'created_at']
+    list_display = ['user', 'balance', 'currency', 'hot_slots', 'is_active', 'created_at']
     list_filter = ['currency', 'is_active', 'created_at']
     search_fields = ['user__email', 'user__username']
     ordering = ['-created_at']
-    readonly_fields = ['id', 'created_at', 'updated_at']
+    readonly_fields = ['id', 'hot_slots', 'created_at', 'updated_at']
+    actions = ['enable_hot_mode', 'disable_hot_mode']
     
     fieldsets = (
         ('Wallet Information', {
-            'fields': ('id', 'user', 'balance', 'currency', 'is_active')
+            'fields': ('id', 'user', 'balance', 'currency', 'is_active', 'hot_slots')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -40,8 +116,19 @@ class WalletAdmin(admin.ModelAdmin):
     )
 
 
+    @admin.action(description='Enable hot wallet mode')
+    def enable_hot_mode(self, request, queryset):
+        for wallet in queryset:
+            wallet.enable_hot_mode(settings.HOT_WALLET_SLOTS)
+
+    @admin.action(description='Disable hot wallet mode')
+    def disable_hot_mode(self, request, queryset):
+        for wallet in queryset.filter(hot_slots__gt=0):
+            wallet.disable_hot_mode()
+
+
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(ShardedAdminMixin, ReplicaChangeListMixin, admin.ModelAdmin):
     """Admin interface for Transaction model"""
     list_display = ['reference', 'wallet', 'transaction_type', 'amount', 'currency', 'status', 'created_at']
     list_filter = ['transaction_type', 'status', 'currency', 'created_at']
@@ -51,7 +138,7 @@ class TransactionAdmin(admin.ModelAdmin):
     
     fieldsets = (
         ('Transaction Information', {
-            'fields': ('id', 'reference', 'wallet', 'transaction_type', 'amount', 'currency', 'status', 'description')
+            'fields': ('id', 'reference', 'wallet', 'counterparty', 'transaction_type', 'amount', 'currency', 'status', 'description')
         }),
         ('Balance Information', {
             'fields': ('balance_before', 'balance_after'),
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class WalletConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'wallet'
+
+    def ready(self):
+        # Connects the receivers that publish worker metrics
+        from . import metrics  # noqa: F401
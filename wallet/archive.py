@@ -0,0 +1,336 @@
+"""
+Cold storage for old transactions.
+
+Most reads touch recent history, while years of settled rows weigh on the
+transactions table and its indexes. The ``archive_transactions`` task
+moves COMPLETED transactions from before the start of the month
+ARCHIVE_AFTER_DAYS ago (a month boundary, so a wallet usually gains one
+segment a month) out of the table into segment files in the ``archive``
+storage: ``STORAGES['archive']``, a local directory by default or any
+Django storage backend, such as an S3-compatible bucket.
+
+Wallets are paged through by id, ARCHIVE_BATCH_SIZE at a time. A segment
+file holds one batch: at most ARCHIVE_BATCH_ROWS rows of a page's wallets,
+each wallet's oldest first from where the page's previous batch left it,
+so no transaction moves an unbounded number of rows. Each wallet's rows
+are NDJSON in a gzip member of their own, so ``zcat`` reads the whole file
+and a wallet's rows are read by offset and length alone. An
+``ArchiveSegment`` on the wallet's shard indexes each of them. Rows are
+removed with DELETE ... RETURNING in the transaction that records their
+segments, and written to a temporary file as they are fetched: a row is
+either in the table or in an indexed segment, and a file whose
+transaction rolled back is deleted again.
+
+A wallet's cutoff is held back to the day of its oldest PENDING
+transaction, so every day before it is settled; the rollups of those days
+(and so statements) are final and kept as they are by rollup refreshes
+and rebuilds.
+
+``ArchivedTransactions`` reads the archive back for history pages and
+exports: only the segments whose time range a request reaches are read,
+and the history filters are applied to their rows by
+``wallet.filters.filter_archived``.
+"""
+import gzip
+import heapq
+import logging
+import os
+import tempfile
+import time
+import uuid
+from collections import deque, namedtuple
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from functools import lru_cache
+
+import orjson
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import storages
+from django.db import connections, transaction
+from django.db.models import Exists, Min, OuterRef
+from django.utils import timezone
+
+from . import sharding
+from .filters import filter_archived
+from .models import ArchiveSegment, Transaction, Wallet, WalletDailyRollup, rollup_day
+from .partitions import month_bound, month_start
+
+logger = logging.getLogger(__name__)
+
+# Every column of a transaction, by attribute name
+FIELDS = {field.attname: field for field in Transaction._meta.concrete_fields}
+
+ArchiveResult = namedtuple('ArchiveResult', ['rows', 'wallets', 'files', 'bytes', 'seconds'])
+
+# Rows taken off the DELETE ... RETURNING cursor at a time
+_FETCH_SIZE = 1000
+# Resume point of a wallet none of whose rows were archived yet
+_START = datetime.min.replace(tzinfo=dt_timezone.utc)
+_NIL_ID = uuid.UUID(int=0)
+
+
+def storage():
+    return storages['archive']
+
+
+def archive_cutoff(now=None, days=None):
+    """Start of the month ARCHIVE_AFTER_DAYS (``days``) ago, or None when archiving is off"""
+    days = settings.ARCHIVE_AFTER_DAYS if days is None else days
+    if not days:
+        return None
+    return month_bound(month_start((now or timezone.now()) - timedelta(days=days)))
+
+
+def row_key(row):
+    """Sort key of a history row, as pages and exports order them"""
+    return row.created_at, row.id
+
+
+def _day_start(moment):
+    return datetime.combine(rollup_day(moment), dt_time.min, tzinfo=dt_timezone.utc)
+
+
+def _encode(row):
+    return orjson.dumps(row, default=str) + b'\n'
+
+
+def _decode(line):
+    document = orjson.loads(line)
+    return {name: field.to_python(document.get(name)) for name, field in FIELDS.items()}
+
+
+def _batch_sql(connection, count):
+    """
+    DELETE ... RETURNING of the next rows of ``count`` wallets, each read
+    from the history index after its resume point, in archive order
+    """
+    qn = connection.ops.quote_name
+    table = qn(Transaction._meta.db_table)
+    columns = ', '.join(qn(field.column) for field in FIELDS.values())
+    returning = ', '.join(f't.{qn(field.column)}' for field in FIELDS.values())
+    values = ', '.join(['(%s::uuid, %s::timestamptz, %s::timestamptz, %s::uuid)'] * count)
+    # The overall bound prunes the partitions of later months
+    return f"""
+        WITH w (wallet_id, cutoff, after_created_at, after_id) AS (VALUES {values}),
+        picked AS (
+            SELECT w.wallet_id, p.id, p.created_at FROM w CROSS JOIN LATERAL (
+                SELECT t.id, t.created_at FROM {table} AS t
+                WHERE t.wallet_id = w.wallet_id AND t.created_at < w.cutoff AND t.created_at < %s
+                    AND t.status = 'COMPLETED' AND (t.created_at, t.id) > (w.after_created_at, w.after_id)
+                ORDER BY t.created_at, t.id
+                LIMIT %s
+            ) AS p
+            ORDER BY w.wallet_id, p.created_at, p.id
+            LIMIT %s
+        ), deleted AS (
+            DELETE FROM {table} AS t USING picked
+            WHERE t.id = picked.id AND t.created_at = picked.created_at
+            RETURNING {returning}
+        )
+        SELECT {columns} FROM deleted ORDER BY wallet_id, created_at, id
+    """
+
+
+def _close_member(member, segment, file):
+    member.close()
+    segment.length = file.tell() - segment.offset
+
+
+def archive_wallets(using, wallet_ids, cutoff, resume=None, batch_rows=None):
+    """
+    Move the next ``batch_rows`` (ARCHIVE_BATCH_ROWS) settled transactions
+    of ``wallet_ids`` on ``using`` from before ``cutoff``, oldest first,
+    into one segment file; returns ``(rows, bytes)``. ``resume`` maps
+    wallet ids to the ``(created_at, id)`` of their last archived row,
+    where this batch picks up, and is moved on past the rows it archives.
+    """
+    batch_rows = batch_rows or settings.ARCHIVE_BATCH_ROWS
+    resume = {} if resume is None else resume
+    connection = connections[using]
+    name = None
+    rows = 0
+    segments, reached = [], {}
+    with tempfile.TemporaryFile() as file:
+        try:
+            with transaction.atomic(using=using):
+                # Wallets moved to another shard are archived there
+                wallet_ids = sharding.held_wallets(using, wallet_ids)
+                if not wallet_ids:
+                    return 0, 0
+                # The days about to become final must have their latest rollups
+                rollups = WalletDailyRollup.objects.db_manager(using)
+                while rollups.refresh(wallet_ids=wallet_ids) >= settings.ROLLUP_REFRESH_BATCH:
+                    pass
+                pending = dict(
+                    Transaction._base_manager.using(using)
+                    .filter(wallet_id__in=wallet_ids, status='PENDING', created_at__lt=cutoff)
+                    .order_by().values('wallet_id').annotate(oldest=Min('created_at'))
+                    .values_list('wallet_id', 'oldest')
+                )
+                cutoffs = {
+                    wallet_id: _day_start(pending[wallet_id]) if wallet_id in pending else cutoff
+                    for wallet_id in wallet_ids
+                }
+                params = []
+                for wallet_id, before in cutoffs.items():
+                    after_created_at, after_id = resume.get(wallet_id, (_START, _NIL_ID))
+                    params += [str(wallet_id), before, after_created_at, str(after_id)]
+                params += [cutoff, batch_rows, batch_rows]
+
+                member = segment = None
+                with connection.cursor() as cursor:
+                    cursor.execute(_batch_sql(connection, len(cutoffs)), params)
+                    # Each wallet's rows go into its gzip member as they are read
+                    while batch := cursor.fetchmany(_FETCH_SIZE):
+                        for values in batch:
+                            row = dict(zip(FIELDS, values))
+                            if segment is None or segment.wallet_id != row['wallet_id']:
+                                if member is not None:
+                                    _close_member(member, segment, file)
+                                segment = ArchiveSegment(
+                                    wallet_id=row['wallet_id'], offset=file.tell(), rows=0,
+                                    first_created_at=row['created_at'], cutoff=cutoffs[row['wallet_id']],
+                                )
+                                segments.append(segment)
+                                member = gzip.GzipFile(filename='', mode='wb', fileobj=file, mtime=0)
+                            member.write(_encode(row))
+                            segment.rows += 1
+                            segment.last_created_at = row['created_at']
+                            reached[row['wallet_id']] = (row['created_at'], row['id'])
+                        rows += len(batch)
+                if member is not None:
+                    _close_member(member, segment, file)
+                if not rows:
+                    return 0, 0
+
+                file.seek(0)
+                name = storage().save(
+                    f'transactions/{using}/{cutoff:%Y-%m}/{uuid.uuid4().hex}.ndjson.gz', File(file)
+                )
+                for segment in segments:
+                    segment.path = name
+                ArchiveSegment.objects.using(using).bulk_create(segments)
+                Wallet.objects.db_manager(using).bump_history([segment.wallet_id for segment in segments])
+        except BaseException:
+            if name is not None:
+                storage().delete(name)
+            raise
+        resume.update(reached)
+        return rows, file.seek(0, os.SEEK_END)
+
+
+def _wallet_pages(using, cutoff, size):
+    """Ids of the wallets on ``using`` with rows from before ``cutoff`` to archive, ``size`` at a time"""
+    archivable = Transaction._base_manager.using(using).filter(
+        wallet_id=OuterRef('pk'), status='COMPLETED', created_at__lt=cutoff,
+    )
+    wallets = Wallet._base_manager.using(using).filter(Exists(archivable)).order_by('pk').values_list('pk', flat=True)
+    after = None
+    while page := list((wallets if after is None else wallets.filter(pk__gt=after))[:size]):
+        yield page
+        after = page[-1]
+
+
+def run(using, cutoff=None, batch_size=None, batch_rows=None):
+    """Archive the settled transactions on ``using`` from before ``cutoff``; returns an ArchiveResult"""
+    cutoff = cutoff or archive_cutoff()
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    batch_rows = batch_rows or settings.ARCHIVE_BATCH_ROWS
+    started = time.monotonic()
+    if cutoff is None:
+        return ArchiveResult(0, 0, 0, 0, 0.0)
+
+    rows = size = files = wallets = 0
+    for wallet_ids in _wallet_pages(using, cutoff, batch_size):
+        wallets += len(wallet_ids)
+        resume = {}
+        # A page whose batch came out full may have rows left
+        while True:
+            moved, written = archive_wallets(using, wallet_ids, cutoff, resume, batch_rows)
+            rows, size, files = rows + moved, size + written, files + bool(moved)
+            if moved < batch_rows:
+                break
+
+    result = ArchiveResult(rows, wallets, files, size, time.monotonic() - started)
+    logger.info(
+        "Archived %d transactions of %d wallets on %s from before %s into %d files (%d bytes) in %.1fs",
+        rows, wallets, using, cutoff.date(), files, size, result.seconds,
+    )
+    return result
+
+
+@lru_cache(maxsize=64)
+def _read(path, offset, length):
+    """A wallet's rows of a segment file, oldest first (paging through a segment reads it once)"""
+    with storage().open(path, 'rb') as file:
+        file.seek(offset)
+        data = file.read(length)
+    return tuple(_decode(line) for line in gzip.decompress(data).splitlines())
+
+
+class ArchivedTransactions:
+    """
+    The archived transactions of a history query, as the named rows of
+    ``values_list(*columns, named=True)``. A segment is only read once the
+    rows asked for reach its time range.
+    """
+
+    def __init__(self, segments, filters, columns):
+        if 'created_after' in filters:
+            segments = segments.filter(last_created_at__gte=filters['created_after'])
+        if 'created_before' in filters:
+            segments = segments.filter(first_created_at__lt=filters['created_before'])
+        self.using = segments.db
+        self.segments = list(segments)
+        self.filters = filters
+        self.row = namedtuple('Row', columns)
+
+    @classmethod
+    def for_user(cls, user, filters, columns):
+        """The user's archived transactions that ``filters`` may keep, or None if there are none"""
+        archived = cls(ArchiveSegment.objects.filter(wallet__user=user), filters, columns)
+        return archived if archived.segments else None
+
+    def _rows(self, segment):
+        rows = filter_archived(_read(segment.path, segment.offset, segment.length), self.filters,
+                               connections[self.using])
+        return [self.row(*[row[column] for column in self.row._fields]) for row in rows]
+
+    def rows(self, after=None, before=None, descending=True):
+        """Rows with keys between ``after`` and ``before`` (both exclusive), newest first if ``descending``"""
+        segments = [
+            segment for segment in self.segments
+            if (after is None or segment.last_created_at >= after[0])
+            and (before is None or segment.first_created_at <= before[0])
+        ]
+        segments.sort(key=lambda segment: segment.last_created_at if descending else segment.first_created_at,
+                      reverse=descending)
+        buffer, index = deque(), 0
+        while buffer or index < len(segments):
+            # Read every segment that may hold rows due before the buffered ones
+            while index < len(segments) and (not buffer or (
+                segments[index].last_created_at >= buffer[0].created_at if descending
+                else segments[index].first_created_at <= buffer[0].created_at
+            )):
+                rows = [
+                    row for row in self._rows(segments[index])
+                    if (after is None or row_key(row) > after) and (before is None or row_key(row) < before)
+                ]
+                if descending:
+                    rows.reverse()
+                buffer = deque(heapq.merge(buffer, rows, key=row_key, reverse=descending))
+                index += 1
+            if buffer:
+                yield buffer.popleft()
+
+    def count(self, since=None):
+        """Rows (created after ``since`` if given), from the segments' row counts where they are exact"""
+        total = 0
+        for segment in self.segments:
+            if since is not None and segment.last_created_at <= since:
+                continue
+            if not self.filters and (since is None or segment.first_created_at > since):
+                total += segment.rows
+            else:
+                total += sum(1 for row in self._rows(segment) if since is None or row.created_at > since)
+        return total
@@ -0,0 +1,84 @@
+"""
+JWT authentication without a ``users`` query per request.
+
+simplejwt's ``JWTAuthentication`` loads the user row on every request.
+``CachedJWTAuthentication`` verifies the token the same way but builds
+the user from a snapshot of its fields (everything except the password)
+read through the wallet cache tiers (``wallet.cache.user_snapshot``).
+``User.save()`` and ``User.delete()`` drop the snapshot, so deactivating
+a user or updating the profile takes effect on the next request.
+
+Views that only need the user's id can set ``stateless_authentication =
+True``. With ``JWT_STATELESS_READS`` on, their GET/HEAD requests get a
+user built from the token claims alone and skip both the cache and the
+``users`` table; a deactivated user keeps read access to their own data
+until the access token expires.
+
+Tokens revoked through ``wallet.revocation`` are rejected either way.
+
+Users built either way have their remaining fields (e.g. ``password``)
+deferred, so touching them loads from the database and ``save()`` only
+writes the fields that were loaded.
+"""
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from . import cache as wallet_cache, revocation
+from .models import User
+
+SNAPSHOT_FIELDS = [field.attname for field in User._meta.concrete_fields if field.attname != 'password']
+
+
+def _load_snapshot(user_id):
+    return User.objects.filter(pk=user_id).values(*SNAPSHOT_FIELDS).first()
+
+
+def user_from_snapshot(snapshot):
+    """User instance with the snapshot's fields loaded and the rest deferred"""
+    values = [User._meta.get_field(name).to_python(snapshot[name]) for name in SNAPSHOT_FIELDS]
+    return User.from_db(router.db_for_read(User), SNAPSHOT_FIELDS, values)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that resolves users from cached snapshots"""
+
+    def authenticate(self, request):
+        self.stateless = (
+            settings.JWT_STATELESS_READS
+            and request.method in ('GET', 'HEAD')
+            and getattr(request.parser_context.get('view'), 'stateless_authentication', False)
+        )
+        return super().authenticate(request)
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if revocation.is_revoked(token):
+            raise InvalidToken(_("Token has been revoked"))
+        return token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = User._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        except ValidationError:
+            raise InvalidToken(_("Token contained an invalid user identification"))
+
+        if self.stateless:
+            return User.from_db(router.db_for_read(User), ['id'], [user_id])
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Needs the password hash, which snapshots leave out
+            return super().get_user(validated_token)
+
+        snapshot = wallet_cache.user_snapshot(user_id, lambda: _load_snapshot(user_id))
+        if snapshot is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        user = user_from_snapshot(snapshot)
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
@@ -0,0 +1,351 @@
+"""
+Read-through cache for wallet state.
+
+``/wallet/balance/`` is polled constantly, so reads go through two tiers
+before the database:
+
+1. a per-process LRU holding entries for WALLET_CACHE_LOCAL_TTL seconds
+2. Redis, holding entries for WALLET_CACHE_TTL seconds
+
+Every balance statement in ``WalletManager`` calls ``invalidate()``, which
+drops the entry from both tiers right away and again after the
+surrounding transaction commits, so a reader that repopulated the cache
+with the pre-commit balance in between cannot leave it stale. Each drop
+is published on a Redis channel that every process follows from a
+background thread, dropping its own local copy as well, so a user's next
+read sees their write whichever process serves it. A process only uses
+its local tier while it is subscribed: one that may have missed an
+invalidation (Redis unavailable, connection lost) has an empty local
+tier and reads through Redis or the database.
+
+Misses are single-flight: within a process concurrent misses for a key
+wait for one database load, and across processes the loader holds a
+short Redis lease; others poll Redis briefly instead of stampeding the
+database. A load only populates Redis if its lease survived, i.e. no
+invalidation ran while it was reading. Like the idempotency store this
+fails open: without Redis, reads fall back to the database.
+
+The same tiers hold the user snapshots that ``wallet.authentication``
+resolves JWT users from; ``User.save()`` drops them like balance
+statements drop wallet state.
+"""
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from rest_framework.utils.encoders import JSONEncoder
+
+from .redis_client import get_redis, mark_redis_down
+
+# Store the value only if our lease is still held, then drop the lease
+_STORE_SCRIPT = """
+if redis.call('GET', KEYS[2]) == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    redis.call('DEL', KEYS[2])
+    return 1
+end
+return 0
+"""
+
+_POLL_INTERVAL = 0.01
+
+INVALIDATIONS_CHANNEL = 'wallet:cache:invalidations'
+
+
+class LocalLRU:
+    """Small thread-safe LRU with a per-entry expiry"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class _Flight:
+    """One in-progress load that other threads can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.failed = False
+        self.invalidated = False
+
+
+class _Invalidations:
+    """Follows the invalidations all processes publish, dropping this process's local copies"""
+
+    def __init__(self):
+        self.subscribed = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def ready(self):
+        """Whether the local tier may be used; starts following on first use"""
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self.run, name='wallet-cache-invalidations', daemon=True)
+                    self.thread.start()
+        return self.subscribed.is_set()
+
+    def run(self):
+        while True:
+            client = get_redis()
+            if client is None:
+                time.sleep(settings.REDIS_RETRY_AFTER)
+                continue
+            pubsub = client.pubsub()
+            try:
+                pubsub.subscribe(INVALIDATIONS_CHANNEL)
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    if message['type'] == 'subscribe':
+                        # Copies cached before now may have missed invalidations
+                        _local.clear()
+                        self.subscribed.set()
+                    elif message['type'] == 'message':
+                        _forget(json.loads(message['data']))
+            except redis.RedisError as exc:
+                _count('errors')
+                mark_redis_down(exc)
+            finally:
+                self.subscribed.clear()
+                _local.clear()
+                pubsub.close()
+
+
+_local = LocalLRU(settings.WALLET_CACHE_LOCAL_SIZE)
+_invalidations = _Invalidations()
+_flights = {}
+_lock = threading.Lock()
+_stats = dict.fromkeys(['local_hits', 'redis_hits', 'coalesced', 'loads', 'invalidations', 'errors'], 0)
+
+
+def _count(name, amount=1):
+    with _lock:
+        _stats[name] += amount
+
+
+def stats():
+    """Hit and load counters of this process, with the overall hit rate"""
+    with _lock:
+        counters = dict(_stats)
+    reads = counters['local_hits'] + counters['redis_hits'] + counters['coalesced'] + counters['loads']
+    hits = reads - counters['loads']
+    counters['hit_rate'] = round(hits / reads, 4) if reads else None
+    return counters
+
+
+def reset_stats():
+    with _lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def local_tier_ready(timeout=0):
+    """Whether this process uses its LRU tier, waiting up to ``timeout`` seconds for it"""
+    return _invalidations.ready() or _invalidations.subscribed.wait(timeout)
+
+
+def clear_local():
+    """Empty this process's LRU tier"""
+    _local.clear()
+
+
+def _state_key(wallet_id):
+    return f"wallet:state:{wallet_id}"
+
+
+def _owner_key(user_id):
+    return f"wallet:owner:{user_id}"
+
+
+def _user_key(user_id):
+    return f"user:snapshot:{user_id}"
+
+
+def _redis_call(operation, *args):
+    """Run a Redis operation, returning None (and backing off) if Redis fails"""
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        return operation(client, *args)
+    except redis.RedisError as exc:
+        _count('errors')
+        mark_redis_down(exc)
+        return None
+
+
+def _redis_get(key):
+    raw = _redis_call(lambda client: client.get(key))
+    return json.loads(raw) if raw is not None else None
+
+
+def _load_with_lease(key, load):
+    """Load from the database, sharing the result through Redis under a lease"""
+    token = secrets.token_hex(8)
+    lease_key = f"{key}:lease"
+    lease_ms = int(settings.WALLET_CACHE_LOCK_TIMEOUT * 1000)
+    leased = _redis_call(lambda client: client.set(lease_key, token, nx=True, px=lease_ms))
+
+    if leased is False:
+        # Another process is loading this key: wait for its result
+        deadline = time.monotonic() + settings.WALLET_CACHE_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(_POLL_INTERVAL)
+            value = _redis_get(key)
+            if value is not None:
+                _count('redis_hits')
+                return value
+
+    _count('loads')
+    value = load()
+    if leased and value is not None:
+        payload = json.dumps(value, cls=JSONEncoder)
+        _redis_call(lambda client: client.register_script(_STORE_SCRIPT)(
+            keys=[key, lease_key], args=[token, payload, settings.WALLET_CACHE_TTL]
+        ))
+    return value
+
+
+def read_through(key, load):
+    """Return the cached value for ``key``, calling ``load()`` once on a miss"""
+    if not settings.WALLET_CACHE_ENABLED:
+        return load()
+
+    use_local = _invalidations.ready()
+    value = _local.get(key) if use_local else None
+    if value is not None:
+        _count('local_hits')
+        return value
+
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        if not flight.done.wait(settings.WALLET_CACHE_LOCK_TIMEOUT) or flight.failed:
+            return load()
+        if flight.invalidated:
+            # The load may have read the database before a write we must see
+            return read_through(key, load)
+        _count('coalesced')
+        return flight.value
+
+    try:
+        value = _redis_get(key)
+        if value is not None:
+            _count('redis_hits')
+        else:
+            value = _load_with_lease(key, load)
+        flight.value = value
+    except Exception:
+        flight.failed = True
+        raise
+    finally:
+        with _lock:
+            if _flights.get(key) is flight:
+                del _flights[key]
+            # Skip the local copy if the key was invalidated while loading
+            if use_local and flight.value is not None and not flight.invalidated:
+                _local.set(key, flight.value, settings.WALLET_CACHE_LOCAL_TTL)
+        flight.done.set()
+    return value
+
+
+def _forget(keys):
+    """Drop ``keys`` from this process"""
+    with _lock:
+        for key in keys:
+            # Detach in-flight loads so later readers start a fresh one
+            flight = _flights.pop(key, None)
+            if flight is not None:
+                flight.invalidated = True
+            _local.delete(key)
+
+
+def _drop(keys):
+    """Drop ``keys`` from Redis and from every process"""
+    _forget(keys)
+    leases = [f"{key}:lease" for key in keys]
+    _redis_call(lambda client: client.pipeline().delete(*keys, *leases).publish(
+        INVALIDATIONS_CHANNEL, json.dumps(keys)
+    ).execute())
+
+
+def _invalidate(keys, using):
+    if not keys or not settings.WALLET_CACHE_ENABLED:
+        return
+    _count('invalidations', len(keys))
+    _drop(keys)
+    if transaction.get_connection(using).in_atomic_block:
+        transaction.on_commit(lambda: _drop(keys), using=using)
+
+
+def invalidate(*wallet_ids, using=None):
+    """Drop cached state of wallets now and again once the current transaction commits"""
+    _invalidate([_state_key(wallet_id) for wallet_id in wallet_ids], using)
+
+
+def forget_user(user_id, using=None):
+    """Drop a user's snapshot now and again once the current transaction commits"""
+    _invalidate([_user_key(user_id)], using)
+
+
+def forget_owner(user_id):
+    """Drop the cached user -> wallet mapping, e.g. when a wallet is deleted"""
+    if settings.WALLET_CACHE_ENABLED:
+        _drop([_owner_key(user_id)])
+
+
+def wallet_id_for(user_id, load):
+    """Cached id of a user's wallet; ``load()`` returns it (or None) on a miss"""
+    value = read_through(_owner_key(user_id), lambda: {'wallet_id': load()})
+    return value['wallet_id'] if value else None
+
+
+def wallet_state(wallet_id, load):
+    """Cached serialized state of a wallet; ``load()`` returns it (or None) on a miss"""
+    return read_through(_state_key(wallet_id), load)
+
+
+def user_snapshot(user_id, load):
+    """Cached snapshot of a user's fields; ``load()`` returns it (or None) on a miss"""
+    return read_through(_user_key(user_id), load)
@@ -0,0 +1,59 @@
+"""
+Conditional GET for polled read endpoints.
+
+A view's validator function cheaply describes the current version of the
+resource - from the wallet cache, the authenticated user or one indexed
+lookup - without building the response. Responses carry an ``ETag``
+(and ``Last-Modified`` where a timestamp covers every change) and
+requests whose ``If-None-Match`` / ``If-Modified-Since`` still match get
+``304 Not Modified`` before the view queries or serializes anything.
+
+The ETag also covers the path with its query string and the negotiated
+media type, so each page, filter and representation gets its own tag.
+Responses are marked ``private, no-cache``: clients keep them but
+revalidate every time.
+"""
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework.utils.encoders import JSONEncoder
+
+_encoder = JSONEncoder()
+
+
+def make_etag(request, version):
+    """Weak ETag for ``version`` of the resource at this URL and media type"""
+    source = f"{request.get_full_path()}|{request.accepted_media_type}|{_encoder.encode(version)}"
+    return 'W/' + quote_etag(hashlib.blake2b(source.encode(), digest_size=16).hexdigest())
+
+
+def conditional(validators):
+    """
+    Answer GET/HEAD on an APIView handler conditionally.
+
+    ``validators(view, request)`` returns ``(version, last_modified)``:
+    any JSON-encodable value that changes whenever the response would,
+    and an aware datetime or None when no timestamp covers every change.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(view, request, *args, **kwargs):
+            version, last_modified = validators(view, request)
+            etag = make_etag(request, version)
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = view_method(view, request, *args, **kwargs)
+            if response.status_code not in (200, 304):
+                return response
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        return wrapper
+    return decorator
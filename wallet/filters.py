@@ -0,0 +1,108 @@
+"""
+Server-side filtering and search for transaction history.
+
+Every query is scoped to one wallet and each filter is served by an
+index on the transactions table (see ``Transaction.Meta.indexes``):
+
+* date range          - txn_wallet_history_idx (wallet, created_at, id, amount)
+* transaction_type    - txn_wallet_type_idx (wallet, type, created_at, id)
+* status              - txn_wallet_status_idx (wallet, status, created_at, id)
+* currency            - txn_wallet_currency_idx (wallet, currency, created_at, id)
+* amount range        - txn_wallet_history_idx, read in page order with the
+                        range checked on each entry before its row is fetched
+* search              - txn_search_idx, GIN over a 'simple' tsvector of
+                        description and reference
+
+All but search return a page's rows in (created_at, id) order, without a
+sort.
+
+``filter_archived`` applies the same filters to archived transactions
+(see ``wallet.archive``).
+"""
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from .models import Transaction, Wallet
+
+# Must match the expression of txn_search_idx for the index to be used
+SEARCH_VECTOR = SearchVector('description', 'reference', config='simple')
+
+DATETIME_FORMATS = [api_settings.DATETIME_INPUT_FORMATS[0], '%Y-%m-%d']
+
+
+class TransactionFilterSerializer(serializers.Serializer):
+    """Query parameters accepted by the transaction history endpoint"""
+    created_after = serializers.DateTimeField(required=False, input_formats=DATETIME_FORMATS)
+    created_before = serializers.DateTimeField(required=False, input_formats=DATETIME_FORMATS)
+    transaction_type = serializers.ChoiceField(choices=Transaction.TRANSACTION_TYPES, required=False)
+    status = serializers.ChoiceField(choices=Transaction.STATUS_CHOICES, required=False)
+    currency = serializers.ChoiceField(choices=Wallet.CURRENCY_CHOICES, required=False)
+    min_amount = serializers.DecimalField(max_digits=15, decimal_places=2, required=False)
+    max_amount = serializers.DecimalField(max_digits=15, decimal_places=2, required=False)
+    search = serializers.CharField(max_length=200, required=False, trim_whitespace=True)
+
+    def validate(self, attrs):
+        if 'created_after' in attrs and 'created_before' in attrs and attrs['created_after'] > attrs['created_before']:
+            raise serializers.ValidationError("created_after must not be later than created_before")
+        if 'min_amount' in attrs and 'max_amount' in attrs and attrs['min_amount'] > attrs['max_amount']:
+            raise serializers.ValidationError("min_amount must not be greater than max_amount")
+        return attrs
+
+
+def history_filters(params):
+    """Validated history filters; invalid parameters raise a 400 ValidationError"""
+    serializer = TransactionFilterSerializer(data=params)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data
+
+
+def filter_transactions(queryset, params):
+    """Apply validated history filters; invalid parameters raise a 400 ValidationError"""
+    filters = history_filters(params)
+
+    if 'created_after' in filters:
+        queryset = queryset.filter(created_at__gte=filters['created_after'])
+    if 'created_before' in filters:
+        queryset = queryset.filter(created_at__lt=filters['created_before'])
+    for field in ('transaction_type', 'status', 'currency'):
+        if field in filters:
+            queryset = queryset.filter(**{field: filters[field]})
+    if 'min_amount' in filters:
+        queryset = queryset.filter(amount__gte=filters['min_amount'])
+    if 'max_amount' in filters:
+        queryset = queryset.filter(amount__lte=filters['max_amount'])
+    if filters.get('search'):
+        queryset = queryset.alias(search_vector=SEARCH_VECTOR).filter(
+            search_vector=SearchQuery(filters['search'], config='simple', search_type='websearch')
+        )
+    return queryset
+
+
+def filter_archived(rows, filters, connection):
+    """
+    The archived ``rows`` (dicts of transaction columns) that validated
+    ``filters`` keep, as ``filter_transactions`` would. Search is matched
+    by the database on ``connection``, with SEARCH_VECTOR's expression.
+    """
+    if 'created_after' in filters:
+        rows = [row for row in rows if row['created_at'] >= filters['created_after']]
+    if 'created_before' in filters:
+        rows = [row for row in rows if row['created_at'] < filters['created_before']]
+    for field in ('transaction_type', 'status', 'currency'):
+        if field in filters:
+            rows = [row for row in rows if row[field] == filters[field]]
+    if 'min_amount' in filters:
+        rows = [row for row in rows if row['amount'] >= filters['min_amount']]
+    if 'max_amount' in filters:
+        rows = [row for row in rows if row['amount'] <= filters['max_amount']]
+    if filters.get('search') and rows:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT r.i FROM unnest(%s::text[], %s::text[]) WITH ORDINALITY AS r (description, reference, i)
+                WHERE to_tsvector('simple', COALESCE(r.description, '') || ' ' || COALESCE(r.reference, ''))
+                    @@ websearch_to_tsquery('simple', %s)
+            """, [[row['description'] for row in rows], [row['reference'] for row in rows], filters['search']])
+            matched = {index for index, in cursor.fetchall()}
+        rows = [row for index, row in enumerate(rows, 1) if index in matched]
+    return rows
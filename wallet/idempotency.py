@@ -0,0 +1,204 @@
+"""
+Idempotency-Key support for money-moving endpoints.
+
+A client sends ``Idempotency-Key: <unique value>`` with a POST. The first
+request claims the key and runs normally; its response is stored against
+the key. Retries with the same key and payload get the stored response
+back without running the view again, so they never touch the wallet or
+transactions tables.
+
+Keys are scoped per user and live in the IdempotencyKey table on the
+user's shard. The key is claimed, and its response stored, in the same
+database transaction as the view's ledger writes (``idempotent`` runs the
+view in ``sharding.atomic_request``): a key row exists exactly when its
+request committed, so a request that crashed, timed out or rolled back
+left nothing behind and its retry runs for real, while a retry racing the
+first request waits on the key's unique constraint until it commits and
+then gets its response. With IDEMPOTENCY_STORE 'redis', stored responses
+are also cached in Redis and replays are answered by a single GET. Redis
+never holds a claim, so a key stored while Redis was down is still seen
+once it is back. Expired rows are purged in bulk by
+``wallet.tasks.purge_expired_idempotency_keys``.
+"""
+import hashlib
+import json
+from collections import namedtuple
+from datetime import timedelta
+from functools import wraps
+
+import redis
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import sharding
+from .models import IdempotencyKey
+from .redis_client import get_redis, mark_redis_down
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+
+# A key that is already claimed. status_code is None while the first
+# request is still in flight.
+StoredResponse = namedtuple('StoredResponse', ['fingerprint', 'status_code', 'body'])
+
+class RedisResponseCache:
+    """Completed responses as JSON strings in Redis with a TTL"""
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def _name(user_id, key):
+        return f"idempotency:{user_id}:{key}"
+
+    def get(self, user_id, key):
+        current = self.client.get(self._name(user_id, key))
+        if not current:
+            return None
+        data = json.loads(current)
+        return StoredResponse(data['fingerprint'], data['status_code'], data['body'])
+
+    def set(self, user_id, key, fingerprint, status_code, body):
+        value = json.dumps({'fingerprint': fingerprint, 'status_code': status_code, 'body': body})
+        self.client.set(self._name(user_id, key), value, ex=settings.IDEMPOTENCY_KEY_TTL)
+
+
+class DatabaseIdempotencyStore:
+    """
+    Idempotency keys in the IdempotencyKey table, claimed via its unique
+    constraint in the transaction of the request they belong to
+    """
+
+    def claim(self, user_id, key, fingerprint):
+        """
+        Claim ``key`` in the current transaction and return None, or return
+        the response stored for it. Waits for a request holding the same
+        uncommitted claim to finish.
+        """
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        try:
+            with transaction.atomic(using=router.db_for_write(IdempotencyKey)):
+                IdempotencyKey.objects.create(
+                    user_id=user_id, key=key, fingerprint=fingerprint, expires_at=expires_at
+                )
+            return None
+        except IntegrityError:
+            pass
+
+        # Responses past their TTL can be replaced; a key without one was
+        # left by an older release and is never taken over
+        taken = IdempotencyKey.objects.filter(
+            user_id=user_id, key=key, expires_at__lte=now, status_code__isnull=False
+        ).update(fingerprint=fingerprint, status_code=None, response_body='', expires_at=expires_at)
+        if taken:
+            return None
+
+        record = IdempotencyKey.objects.get(user_id=user_id, key=key)
+        return StoredResponse(record.fingerprint, record.status_code, record.response_body)
+
+    def complete(self, user_id, key, status_code, body):
+        """Store the response of a claimed key, in the transaction that claimed it"""
+        IdempotencyKey.objects.filter(user_id=user_id, key=key).update(
+            status_code=status_code, response_body=body,
+            expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+        )
+
+
+def get_cache():
+    """Return the response cache, or None when it is off or Redis is down"""
+    if settings.IDEMPOTENCY_STORE == 'redis':
+        client = get_redis()
+        if client is not None:
+            return RedisResponseCache(client)
+    return None
+
+
+def _cached(cache, operation, *args):
+    """Run a cache operation; a Redis failure is a miss, the database has every key"""
+    if cache is None:
+        return None
+    try:
+        return getattr(cache, operation)(*args)
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return None
+
+
+def request_fingerprint(request):
+    """Hash of the method, path and payload a key was first used with"""
+    payload = json.dumps(request.data, cls=JSONEncoder, sort_keys=True)
+    return hashlib.sha256(f"{request.method}:{request.path}:{payload}".encode()).hexdigest()
+
+
+def _replay(existing, fingerprint):
+    """Response to a request whose key is already stored"""
+    if existing.fingerprint != fingerprint:
+        return Response({
+            'error': 'Idempotency-Key was already used with a different request'
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if existing.status_code is None:
+        return Response({
+            'error': 'A request with this Idempotency-Key is still being processed'
+        }, status=status.HTTP_409_CONFLICT)
+    response = Response(json.loads(existing.body), status=existing.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """
+    Make an APIView handler safe to retry with an Idempotency-Key header.
+
+    Runs the handler in ``sharding.atomic_request`` (so do not apply that
+    as well) with the key claimed and its response stored in the same
+    transaction. Replays from the Redis cache open no transaction.
+    Requests without the header run unchanged.
+    """
+    atomic_view = sharding.atomic_request(view_method)
+
+    @sharding.atomic_request
+    def claimed(view, request, key, fingerprint, *args, **kwargs):
+        store = DatabaseIdempotencyStore()
+        existing = store.claim(request.user.pk, key, fingerprint)
+        if existing is not None:
+            return _replay(existing, fingerprint), None
+
+        response = view_method(view, request, *args, **kwargs)
+        if response.status_code >= 500:
+            # Let the client retry server errors for real: nothing of this request commits
+            transaction.set_rollback(True, using=router.db_for_write(IdempotencyKey))
+            return response, None
+        body = json.dumps(response.data, cls=JSONEncoder)
+        store.complete(request.user.pk, key, response.status_code, body)
+        return response, body
+
+    @wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return atomic_view(view, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({
+                'error': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        user_id = request.user.pk
+        fingerprint = request_fingerprint(request)
+        cache = get_cache()
+
+        existing = _cached(cache, 'get', user_id, key)
+        if existing is not None:
+            return _replay(existing, fingerprint)
+
+        response, body = claimed(view, request, key, fingerprint, *args, **kwargs)
+        if body is not None:
+            # Committed: from now on replays need not reach the database
+            _cached(cache, 'set', user_id, key, fingerprint, response.status_code, body)
+        return response
+
+    return wrapper
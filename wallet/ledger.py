@@ -0,0 +1,135 @@
+"""
+Ledger write path.
+
+Every balance mutation goes through here so the wallet row and the
+Transaction row that records it are written together, with the balance
+change applied by a single conditional UPDATE (see
+``WalletManager.apply_balance_change``).
+
+Hot wallets (``Wallet.hot_slots`` > 0) take credits on one of several
+balance slot rows instead of the wallet row; the balances recorded on
+their Transaction rows are the wallet total at the moment of the write.
+
+Writes happen on the shard the wallet was loaded from; both wallets of a
+transfer must be on the same shard.
+"""
+from django.db import transaction
+
+from .models import InsufficientBalance, Transaction, Wallet
+
+
+def deposit(wallet, amount, description='Wallet top-up', currency=None):
+    """Credit ``amount`` to the wallet and record a completed DEPOSIT"""
+    if amount <= 0:
+        raise ValueError("Deposit amount must be positive")
+
+    with transaction.atomic(using=wallet._state.db, savepoint=False):
+        balance_after = Wallet.objects.credit(wallet, amount)
+        if balance_after is not None:
+            return Transaction.objects.create(
+                wallet=wallet,
+                transaction_type='DEPOSIT',
+                amount=amount,
+                currency=currency or wallet.currency,
+                status='COMPLETED',
+                description=description,
+                balance_before=balance_after - amount,
+                balance_after=balance_after,
+            )
+    raise Wallet.DoesNotExist("Wallet no longer exists")
+
+
+def withdraw(wallet, amount, description='Wallet withdrawal'):
+    """
+    Debit ``amount`` from the wallet and record a completed WITHDRAWAL.
+
+    Raises InsufficientBalance without writing anything if the balance
+    does not cover the amount at the moment the UPDATE runs.
+    """
+    if amount <= 0:
+        raise ValueError("Withdrawal amount must be positive")
+
+    with transaction.atomic(using=wallet._state.db, savepoint=False):
+        balance_after = Wallet.objects.debit(wallet, amount)
+        if balance_after is not None:
+            return Transaction.objects.create(
+                wallet=wallet,
+                transaction_type='WITHDRAWAL',
+                amount=amount,
+                currency=wallet.currency,
+                status='COMPLETED',
+                description=description,
+                balance_before=balance_after + amount,
+                balance_after=balance_after,
+            )
+    # Raised outside the atomic block so a caller's transaction stays usable
+    raise InsufficientBalance("Insufficient balance")
+
+
+def transfer(source, destination, amount, description='Wallet transfer'):
+    """
+    Move ``amount`` between two wallets in one database transaction.
+
+    Both balances change in a single statement (see
+    ``WalletManager.apply_transfer``) and the paired TRANSFER rows, one
+    per wallet, are written with one bulk insert. Transfers involving a
+    hot wallet debit the source and then credit the recipient, on one of
+    its balance slots if it is hot, so a hot recipient's row is never
+    locked. Returns the
+    ``(debit, credit)`` transactions.
+    """
+    if amount <= 0:
+        raise ValueError("Transfer amount must be positive")
+    if source.pk == destination.pk:
+        raise ValueError("Cannot transfer to the same wallet")
+    if source.currency != destination.currency:
+        raise ValueError(f"Currency mismatch. Recipient wallet currency is {destination.currency}")
+
+    with transaction.atomic(using=source._state.db, savepoint=False):
+        balances = _move(source, destination, amount)
+        if balances is not None:
+            source_after, destination_after = balances
+            debit, credit = Transaction.objects.bulk_create([
+                Transaction(
+                    wallet=source,
+                    counterparty=destination,
+                    transaction_type='TRANSFER',
+                    amount=amount,
+                    currency=source.currency,
+                    status='COMPLETED',
+                    description=description,
+                    balance_before=source_after + amount,
+                    balance_after=source_after,
+                ),
+                Transaction(
+                    wallet=destination,
+                    counterparty=source,
+                    transaction_type='TRANSFER',
+                    amount=amount,
+                    currency=destination.currency,
+                    status='COMPLETED',
+                    description=description,
+                    balance_before=destination_after - amount,
+                    balance_after=destination_after,
+                ),
+            ])
+            return debit, credit
+    raise InsufficientBalance("Insufficient balance")
+
+
+def _move(source, destination, amount):
+    """Apply a transfer's balance changes; returns both new totals or None"""
+    if source.hot_slots or destination.hot_slots:
+        # One row per statement: the source debit folds in its slots if
+        # needed and a hot destination is credited on a slot, never its row
+        source_after = Wallet.objects.debit(source, amount)
+        if source_after is None:
+            return None
+        return source_after, Wallet.objects.credit(destination, amount)
+
+    balances = Wallet.objects.apply_transfer(source, destination, amount)
+    if balances is None:
+        return None
+    source.sync_balance(balances[source.pk])
+    destination.sync_balance(balances[destination.pk])
+    return balances[source.pk], balances[destination.pk]
@@ -0,0 +1,83 @@
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from wallet import cache as wallet_cache, revocation
+from wallet.authentication import CachedJWTAuthentication
+from wallet.models import User
+from wallet.redis_client import get_redis
+
+
+class _RedisCheckedAuthentication(CachedJWTAuthentication):
+    """Cached users, but every token looked up in Redis instead of the Bloom filter"""
+
+    def get_validated_token(self, raw_token):
+        token = JWTAuthentication.get_validated_token(self, raw_token)
+        get_redis().zscore(revocation.REVOKED_KEY, f"jti:{token['jti']}")
+        return token
+
+
+class Command(BaseCommand):
+    """
+    Authentication overhead benchmark.
+
+    Revokes ``--revoked`` throwaway tokens (forgotten after a minute),
+    then authenticates the same request ``--requests`` times with:
+
+    * ``simplejwt``   - stock JWTAuthentication, one users query per request
+    * ``redis_check`` - cached user + one Redis lookup per request
+    * ``bloom``       - CachedJWTAuthentication: cached user + Bloom filter
+
+    and reports the mean and p99 time per authentication, plus the raw
+    cost of one Bloom filter check.
+    """
+    help = 'Benchmark JWT authentication and revocation checks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--revoked', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:12]
+        user = User.objects.create_user(username=f'bench-{suffix}', email=f'bench-{suffix}@example.com', password=None)
+        try:
+            forget_at = time.time() + 60
+            for _ in range(options['revoked']):
+                revocation.revoke_token({'jti': uuid.uuid4().hex, 'exp': forget_at})
+            revocation.reset()
+            wallet_cache.clear_local()
+
+            access = revocation.issue_tokens(user)['access']
+            request = APIRequestFactory().get('/api/v1/profile/', HTTP_AUTHORIZATION=f'Bearer {access}')
+            request = APIView().initialize_request(request)
+            modes = {
+                'simplejwt': JWTAuthentication(),
+                'redis_check': _RedisCheckedAuthentication(),
+                'bloom': CachedJWTAuthentication(),
+            }
+            for name, authenticator in modes.items():
+                authenticator.authenticate(request)  # warm up caches and the filter
+                timings = []
+                for _ in range(options['requests']):
+                    started = time.perf_counter()
+                    authenticator.authenticate(request)
+                    timings.append(time.perf_counter() - started)
+                timings.sort()
+                self.stdout.write(
+                    f"{name:<12} mean={statistics.mean(timings) * 1e6:.0f}us "
+                    f"p99={timings[int(len(timings) * 0.99)] * 1e6:.0f}us"
+                )
+
+            bloom = revocation.BloomFilter(100000, 0.001)
+            started = time.perf_counter()
+            for n in range(options['requests']):
+                f"jti:{n}" in bloom
+            elapsed = (time.perf_counter() - started) / options['requests']
+            self.stdout.write(f"bloom check {elapsed * 1e6:.1f}us, stats={revocation.stats()}")
+        finally:
+            user.delete()
@@ -0,0 +1,95 @@
+import random
+import statistics
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from wallet import cache as wallet_cache, ledger
+from wallet.models import User, Wallet
+from wallet.views import WalletBalanceView
+
+
+class Command(BaseCommand):
+    """
+    Balance polling benchmark for the wallet cache.
+
+    Threads poll ``/wallet/balance/`` for a pool of wallets and top one
+    up every ``--write-every`` polls, reading the balance right after
+    each top-up. Reports throughput, latency, the cache hit rate and any
+    read that returned a balance older than the writer's own top-up.
+    """
+    help = 'Benchmark /wallet/balance/ polling through the wallet cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--polls', type=int, default=2000, help='Polls per thread')
+        parser.add_argument('--wallets', type=int, default=20)
+        parser.add_argument('--write-every', type=int, default=100, help='Polls between top-ups (0 = no writes)')
+
+    def handle(self, *args, **options):
+        users = [self._create_user() for _ in range(options['wallets'])]
+        view = WalletBalanceView.as_view()
+        factory = APIRequestFactory()
+        latencies, stale = [], []
+        lock = threading.Lock()
+        wallet_cache.clear_local()
+        wallet_cache.reset_stats()
+
+        def poll(user):
+            request = factory.get('/api/v1/wallet/balance/')
+            force_authenticate(request, user=user)
+            return Decimal(view(request).data['balance'])
+
+        def worker(index):
+            rng = random.Random(index)
+            local = []
+            try:
+                for i in range(options['polls']):
+                    user = rng.choice(users)
+                    if options['write_every'] and i % options['write_every'] == options['write_every'] - 1:
+                        ledger.deposit(user.wallet, Decimal('1.00'))
+                        seen = Wallet.objects.get(pk=user.wallet.pk).balance
+                        if poll(user) < seen:
+                            with lock:
+                                stale.append(user.pk)
+                        continue
+                    started = time.perf_counter()
+                    poll(user)
+                    local.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+                with lock:
+                    latencies.extend(local)
+
+        started = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(n,)) for n in range(options['threads'])]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        stats = wallet_cache.stats()
+        self.stdout.write(
+            f"polls={len(latencies)} time={elapsed:.2f}s "
+            f"throughput={len(latencies) / elapsed:.0f} polls/s "
+            f"p50={statistics.median(latencies) * 1000:.2f}ms "
+            f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}ms "
+            f"hit_rate={stats['hit_rate']} loads={stats['loads']} "
+            f"coalesced={stats['coalesced']} stale_reads={len(stale)}"
+        )
+        for user in users:
+            user.delete()
+
+    @staticmethod
+    def _create_user():
+        suffix = uuid.uuid4().hex[:12]
+        user = User.objects.create_user(username=f'bench-{suffix}', email=f'bench-{suffix}@example.com', password=None)
+        Wallet.objects.create(user=user, balance=Decimal('100.00'))
+        return user
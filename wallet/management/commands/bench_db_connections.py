@@ -0,0 +1,79 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from wallet.models import Wallet
+
+
+class Command(BaseCommand):
+    """
+    Database connection overhead benchmark.
+
+    Serves ``--requests`` simulated requests - open the connection, read
+    one wallet, close it as Django does when a request finishes - with
+    the ``default`` database settings in two ways:
+
+    * ``connect`` - a new server connection per request (no pool,
+      ``CONN_MAX_AGE = 0``: the settings before pooling)
+    * ``pool``    - a checkout from a health-checked pool of
+      DB_POOL_MIN_SIZE..DB_POOL_MAX_SIZE connections
+
+    and reports the mean and p99 time per request and what pooling saves.
+    """
+    help = 'Benchmark per-request database connection cost with and without pooling'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+
+    def _wrapper(self, alias, options):
+        default = connections['default']
+        settings_dict = {
+            **default.settings_dict, 'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': True, 'OPTIONS': options,
+        }
+        return type(default)(settings_dict, alias=alias)
+
+    def handle(self, *args, **options):
+        wallet_id = Wallet.objects.values_list('pk', flat=True).first()
+        base_options = {
+            key: value for key, value in connections['default'].settings_dict['OPTIONS'].items() if key != 'pool'
+        }
+        modes = {
+            'connect': self._wrapper('bench_connect', base_options),
+            'pool': self._wrapper('bench_pool', {**base_options, 'pool': {
+                'min_size': settings.DB_POOL_MIN_SIZE,
+                'max_size': settings.DB_POOL_MAX_SIZE,
+                'timeout': settings.DB_POOL_TIMEOUT,
+            }}),
+        }
+        means = {}
+        try:
+            for name, connection in modes.items():
+                connection.ensure_connection()  # warm up: opens the pool
+                connection.close()
+                timings = []
+                for _ in range(options['requests']):
+                    started = time.perf_counter()
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT balance FROM wallets WHERE id = %s', [wallet_id])
+                        cursor.fetchone()
+                    connection.close()
+                    timings.append(time.perf_counter() - started)
+                timings.sort()
+                means[name] = statistics.mean(timings)
+                self.stdout.write(
+                    f"{name:<8} mean={means[name] * 1e3:.2f}ms "
+                    f"p99={timings[int(len(timings) * 0.99)] * 1e3:.2f}ms"
+                )
+            stats = modes['pool'].pool.get_stats()
+            self.stdout.write(
+                f"saved {(means['connect'] - means['pool']) * 1e3:.2f}ms per request; "
+                f"pool checkouts={stats.get('requests_num', 0)} "
+                f"wait={stats.get('requests_wait_ms', 0)}ms connections={stats.get('connections_num', 0)}"
+            )
+        finally:
+            for connection in modes.values():
+                connection.close()
+            modes['pool'].close_pool()
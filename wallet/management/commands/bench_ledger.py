@@ -0,0 +1,153 @@
+import statistics
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from wallet import ledger
+from wallet.models import InsufficientBalance, Transaction, User, Wallet
+
+
+class Command(BaseCommand):
+    """
+    Same-wallet contention benchmark for the ledger write path.
+
+    Runs the same mix of deposits and withdrawals from many threads
+    against a single wallet using three strategies and reports
+    throughput, latency and whether any updates were lost:
+
+    * ``naive``      - the old read/modify/save() path (no locking)
+    * ``for_update`` - SELECT ... FOR UPDATE followed by save()
+    * ``ledger``     - the conditional UPDATE ... RETURNING path
+    * ``transfer``   - every thread transfers to and from the wallet
+                       using its own sender wallet (hot recipient)
+
+    ``--hot-slots N`` puts the wallet in hot wallet mode with N balance
+    slots first (``ledger`` and ``transfer`` modes only).
+    """
+    help = 'Benchmark concurrent balance updates on a single wallet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--ops', type=int, default=200, help='Operations per thread')
+        parser.add_argument('--modes', default='naive,for_update,ledger,transfer')
+        parser.add_argument('--hot-slots', type=int, default=0, help='Balance slots for the wallet (0 = off)')
+
+    def handle(self, *args, **options):
+        self._hot_slots = options['hot_slots']
+        for mode in options['modes'].split(','):
+            self._run(mode.strip(), options['threads'], options['ops'])
+
+    def _run(self, mode, threads, ops):
+        opening = Decimal('1000.00')
+        wallet = self._create_wallet(opening)
+        if self._hot_slots:
+            wallet.enable_hot_mode(self._hot_slots)
+        operation = getattr(self, f'_op_{mode}')
+        latencies = []
+        lock = threading.Lock()
+        self._senders = threading.local()
+        self._sender_wallets = []
+
+        def worker(index):
+            local = []
+            try:
+                for i in range(ops):
+                    amount = self._amount(index, i)
+                    started = time.perf_counter()
+                    operation(wallet.pk, amount)
+                    local.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+                with lock:
+                    latencies.extend(local)
+
+        started = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        expected = opening + sum(
+            self._amount(n, i) for n in range(threads) for i in range(ops)
+        )
+        actual = Wallet.objects.get(pk=wallet.pk).total_balance
+        latencies.sort()
+        total = threads * ops
+
+        self.stdout.write(
+            f"{mode:<11} ops={total} time={elapsed:.2f}s "
+            f"throughput={total / elapsed:.0f} ops/s "
+            f"p50={statistics.median(latencies) * 1000:.2f}ms "
+            f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}ms "
+            f"expected={expected} actual={actual} lost={expected - actual}"
+        )
+        for bench_wallet in [wallet] + self._sender_wallets:
+            bench_wallet.user.delete()
+
+    def _create_wallet(self, balance):
+        user = User.objects.create_user(
+            username=f'bench-{uuid.uuid4().hex[:12]}',
+            email=f'bench-{uuid.uuid4().hex[:12]}@example.com',
+            password=None,
+        )
+        return Wallet.objects.create(user=user, balance=balance)
+
+    @staticmethod
+    def _amount(thread_index, op_index):
+        # Alternate credits and debits; credits are larger so the balance
+        # only grows and every lost update shows up in the final total
+        return Decimal('2.00') if (thread_index + op_index) % 2 == 0 else Decimal('-1.00')
+
+    def _op_naive(self, wallet_id, amount):
+        with transaction.atomic():
+            wallet = Wallet.objects.get(pk=wallet_id)
+            balance_before = wallet.balance
+            wallet.balance += amount
+            wallet.save()
+            self._record(wallet, amount, balance_before)
+
+    def _op_for_update(self, wallet_id, amount):
+        with transaction.atomic():
+            wallet = Wallet.objects.select_for_update().get(pk=wallet_id)
+            balance_before = wallet.balance
+            wallet.balance += amount
+            wallet.save()
+            self._record(wallet, amount, balance_before)
+
+    def _op_ledger(self, wallet_id, amount):
+        wallet = Wallet(pk=wallet_id, currency='USD', hot_slots=self._hot_slots)
+        try:
+            if amount > 0:
+                ledger.deposit(wallet, amount)
+            else:
+                ledger.withdraw(wallet, -amount)
+        except InsufficientBalance:
+            pass
+
+    def _op_transfer(self, wallet_id, amount):
+        sender = getattr(self._senders, 'wallet', None)
+        if sender is None:
+            sender = self._senders.wallet = self._create_wallet(Decimal('1000.00'))
+            self._sender_wallets.append(sender)
+        recipient = Wallet(pk=wallet_id, currency='USD', hot_slots=self._hot_slots)
+        if amount > 0:
+            ledger.transfer(sender, recipient, amount)
+        else:
+            ledger.transfer(recipient, sender, -amount)
+
+    def _record(self, wallet, amount, balance_before):
+        Transaction.objects.create(
+            wallet=wallet,
+            transaction_type='DEPOSIT' if amount > 0 else 'WITHDRAWAL',
+            amount=abs(amount),
+            currency=wallet.currency,
+            status='COMPLETED',
+            balance_before=balance_before,
+            balance_after=wallet.balance,
+        )
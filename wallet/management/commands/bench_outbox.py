@@ -0,0 +1,85 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+
+from wallet import outbox
+from wallet.models import OutboxEvent
+
+TABLE = 'bench_outbox'
+
+
+class Command(BaseCommand):
+    """
+    Outbox relay throughput benchmark.
+
+    Builds a scratch copy of the ``transaction_outbox`` table and, for each
+    of ``--batch-sizes`` and ``--workers``, fills it with ``--events``
+    events carrying a transaction payload and times relays draining it
+    concurrently (``FOR UPDATE SKIP LOCKED``). Delivery is a no-op, so the
+    figures are the relay's own cost: taking events off the table and
+    grouping them by user. A batch size of 1 is a relay that handles
+    events one at a time.
+
+    The scratch table is dropped afterwards.
+    """
+    help = 'Benchmark draining the transaction outbox at several batch sizes and relay counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=20000)
+        parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 100, 500, 2000])
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+
+    def _fill(self, cursor, events):
+        qn = connection.ops.quote_name
+        cursor.execute(f"""
+            INSERT INTO {qn(TABLE)} (id, event, wallet_id, payload, created_at)
+            SELECT gen_random_uuid(), %s, md5('wallet' || n %% 1000)::uuid,
+                jsonb_build_object(
+                    'id', md5('txn' || n)::uuid, 'wallet_id', md5('wallet' || n %% 1000)::uuid,
+                    'counterparty_id', NULL, 'transaction_type', 'DEPOSIT', 'amount', '10.00', 'currency', 'USD',
+                    'status', 'COMPLETED', 'description', 'Wallet top-up', 'reference', 'BENCH-' || n,
+                    'balance_before', '100.00', 'balance_after', '110.00', 'created_at', now(), 'updated_at', now()
+                )::text,
+                now()
+            FROM generate_series(1, %s) AS n
+        """, [OutboxEvent.CREATED, events])
+        cursor.execute(f"ANALYZE {qn(TABLE)}")
+
+    def _drain(self, batch_size, workers):
+        def worker():
+            try:
+                outbox.relay('default', lambda groups: None, batch_size=batch_size, max_seconds=float('inf'), table=TABLE)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        qn = connection.ops.quote_name
+        events = options['events']
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TABLE {qn(TABLE)} (LIKE {qn(OutboxEvent._meta.db_table)} INCLUDING ALL)"
+                )
+                for batch_size in options['batch_sizes']:
+                    for workers in options['workers']:
+                        self._fill(cursor, events)
+                        seconds = self._drain(batch_size, workers)
+                        cursor.execute(f"SELECT count(*) FROM {qn(TABLE)}")
+                        left = cursor.fetchone()[0]
+                        self.stdout.write(
+                            f"batch={batch_size:<5} relays={workers:<3} {events - left} events in {seconds:.2f}s "
+                            f"({(events - left) / seconds:,.0f} events/s)"
+                        )
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {qn(TABLE)}")
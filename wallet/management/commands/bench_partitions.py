@@ -0,0 +1,126 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from wallet import partitions
+
+COLUMNS = """
+    id, wallet_id, transaction_type, amount, currency, status, description, reference,
+    balance_before, balance_after, created_at, updated_at
+"""
+
+
+class Command(BaseCommand):
+    """
+    Transactions table partitioning benchmark.
+
+    Builds two scratch copies of the ``transactions`` table - a plain one
+    (the table before partitioning) and one partitioned by month - fills
+    each with ``--rows`` transactions of ``--wallets`` wallets spread over
+    the last ``--months`` months, and times on both:
+
+    * ``insert``  - loading the rows, ``--batch`` per statement
+    * ``history`` - a wallet's newest page of the current month
+    * ``month``   - totals of every wallet for the oldest month
+    * ``expire``  - removing the oldest month: DELETE on the plain table,
+      DETACH and DROP of one partition on the partitioned one
+
+    The scratch tables are dropped afterwards.
+    """
+    help = 'Benchmark inserts, scans and expiry on a plain and a monthly partitioned transactions table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500000)
+        parser.add_argument('--wallets', type=int, default=1000)
+        parser.add_argument('--months', type=int, default=12)
+        parser.add_argument('--batch', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def _create(self, cursor, table, partitioned, months):
+        qn = connection.ops.quote_name
+        cursor.execute(
+            f"CREATE TABLE {qn(table)} (LIKE {qn(partitions.TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            + (" PARTITION BY RANGE (created_at)" if partitioned else "")
+        )
+        if partitioned:
+            cursor.execute(f"CREATE TABLE {qn(f'{table}_default')} PARTITION OF {qn(table)} DEFAULT")
+            partitions.create_partitions(connection, months[0], months[-1], table=table)
+        key = '(id, created_at)' if partitioned else '(id)'
+        cursor.execute(f"ALTER TABLE {qn(table)} ADD PRIMARY KEY {key}")
+        cursor.execute(f"CREATE INDEX ON {qn(table)} (wallet_id, created_at, id)")
+
+    def _time(self, cursor, sql, params, repeat=1):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            cursor.execute(sql, params)
+        return (time.perf_counter() - started) / repeat
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        current = partitions.month_start(timezone.now())
+        # At least two months, so expiring the oldest leaves the current one
+        months = [partitions.add_months(current, -offset) for offset in range(max(options['months'], 2) - 1, -1, -1)]
+        start = partitions.month_bound(months[0])
+        span = (timezone.now() - start).total_seconds()
+        oldest = (start, partitions.month_bound(months[1]))
+        tables = {'plain': 'bench_transactions_plain', 'partitioned': 'bench_transactions_partitioned'}
+        qn = connection.ops.quote_name
+        results = {}
+        try:
+            with connection.cursor() as cursor:
+                for mode, table in tables.items():
+                    self._create(cursor, table, mode == 'partitioned', months)
+                    timings = results[mode] = {}
+
+                    insert = f"""
+                        INSERT INTO {qn(table)} ({COLUMNS})
+                        SELECT md5('txn' || n)::uuid, md5('wallet' || n %% %(wallets)s)::uuid, 'DEPOSIT', 1, 'USD',
+                            'COMPLETED', '', 'BENCH-' || n, 0, 1, t, t
+                        FROM generate_series(%(first)s, %(last)s) AS n,
+                            LATERAL (SELECT %(start)s::timestamptz + n * %(step)s * interval '1 second' AS t) AS moment
+                    """
+                    started = time.perf_counter()
+                    for first in range(0, rows, options['batch']):
+                        cursor.execute(insert, {
+                            'wallets': options['wallets'], 'first': first,
+                            'last': min(first + options['batch'], rows) - 1,
+                            'start': start, 'step': span / rows,
+                        })
+                    timings['insert'] = time.perf_counter() - started
+                    cursor.execute(f"ANALYZE {qn(table)}")
+
+                    timings['history'] = self._time(cursor, f"""
+                        SELECT * FROM {qn(table)} WHERE wallet_id = md5('wallet1')::uuid AND created_at >= %s
+                        ORDER BY created_at DESC, id DESC LIMIT 20
+                    """, [partitions.month_bound(current)], options['repeat'])
+                    timings['month'] = self._time(cursor, f"""
+                        SELECT wallet_id, count(*), sum(amount) FROM {qn(table)}
+                        WHERE created_at >= %s AND created_at < %s GROUP BY wallet_id
+                    """, list(oldest), max(options['repeat'] // 10, 1))
+
+                    started = time.perf_counter()
+                    if mode == 'partitioned':
+                        name = partitions.partition_name(months[0], table)
+                        cursor.execute(f"ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}")
+                        cursor.execute(f"DROP TABLE {qn(name)}")
+                    else:
+                        cursor.execute(f"DELETE FROM {qn(table)} WHERE created_at < %s", [oldest[1]])
+                    timings['expire'] = time.perf_counter() - started
+
+                    self.stdout.write(
+                        f"{mode:<12} insert={timings['insert']:.2f}s ({rows / timings['insert']:,.0f} rows/s) "
+                        f"history={timings['history'] * 1e3:.2f}ms month={timings['month'] * 1e3:.1f}ms "
+                        f"expire={timings['expire'] * 1e3:.1f}ms"
+                    )
+        finally:
+            with connection.cursor() as cursor:
+                for table in tables.values():
+                    cursor.execute(f"DROP TABLE IF EXISTS {qn(table)}")
+
+        plain, partitioned = results.get('plain'), results.get('partitioned')
+        if plain and partitioned:
+            self.stdout.write(', '.join(
+                f"{name} x{plain[name] / partitioned[name]:.1f}" for name in ['insert', 'history', 'month', 'expire']
+            ) + ' (plain time / partitioned time)')
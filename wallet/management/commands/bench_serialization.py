@@ -0,0 +1,84 @@
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from wallet.models import Transaction, User, Wallet
+from wallet.renderers import MessagePackRenderer, ORJSONRenderer
+from wallet.serializers import TRANSACTION_LIST_PROJECTION, TransactionListSerializer
+
+
+class Command(BaseCommand):
+    """
+    Serialization micro-benchmark for transaction history pages.
+
+    Fetches ``--rows`` transactions once, then times turning them into
+    response bytes ``--repeat`` times with each path:
+
+    * ``serializer`` - TransactionListSerializer + DRF's JSONRenderer (before)
+    * ``orjson``     - TransactionListSerializer + ORJSONRenderer
+    * ``projection`` - values_list() rows + compiled mapper + ORJSONRenderer
+    * ``msgpack``    - values_list() rows + compiled mapper + MessagePackRenderer
+
+    Fetch time is reported separately for model instances and rows.
+    """
+    help = 'Benchmark transaction list serialization paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        wallet = self._create_wallet(options['rows'])
+        try:
+            queryset = wallet.transactions.order_by('-created_at', '-id')
+            started = time.perf_counter()
+            instances = list(queryset)
+            instance_fetch = time.perf_counter() - started
+            started = time.perf_counter()
+            rows = list(TRANSACTION_LIST_PROJECTION.queryset(queryset))
+            row_fetch = time.perf_counter() - started
+            self.stdout.write(
+                f"fetch rows={len(rows)} instances={instance_fetch * 1000:.1f}ms values_list={row_fetch * 1000:.1f}ms"
+            )
+
+            paths = {
+                'serializer': lambda: JSONRenderer().render(TransactionListSerializer(instances, many=True).data),
+                'orjson': lambda: ORJSONRenderer().render(TransactionListSerializer(instances, many=True).data),
+                'projection': lambda: ORJSONRenderer().render(TRANSACTION_LIST_PROJECTION.map_rows(rows)),
+                'msgpack': lambda: MessagePackRenderer().render(TRANSACTION_LIST_PROJECTION.map_rows(rows)),
+            }
+            baseline = None
+            for name, render in paths.items():
+                started = time.perf_counter()
+                for _ in range(options['repeat']):
+                    body = render()
+                elapsed = (time.perf_counter() - started) / options['repeat']
+                baseline = baseline or elapsed
+                self.stdout.write(
+                    f"{name:<11} {elapsed * 1000:.2f}ms/page {len(rows) / elapsed:.0f} rows/s "
+                    f"bytes={len(body)} speedup={baseline / elapsed:.1f}x"
+                )
+        finally:
+            wallet.user.delete()
+
+    @staticmethod
+    def _create_wallet(rows):
+        suffix = uuid.uuid4().hex[:12]
+        user = User.objects.create_user(username=f'bench-{suffix}', email=f'bench-{suffix}@example.com', password=None)
+        wallet = Wallet.objects.create(user=user, balance=Decimal('100.00'))
+        Transaction.objects.bulk_create([
+            Transaction(
+                wallet=wallet,
+                transaction_type='DEPOSIT' if i % 3 else 'WITHDRAWAL',
+                amount=Decimal('1.25'),
+                status='COMPLETED',
+                description=f'Benchmark row {i}',
+                balance_before=Decimal('100.00'),
+                balance_after=Decimal('101.25'),
+            )
+            for i in range(rows)
+        ], batch_size=1000)
+        return wallet
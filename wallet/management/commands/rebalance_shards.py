@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from wallet import rebalance, sharding
+
+
+class Command(BaseCommand):
+    """
+    Report on the shards and move buckets of users between them.
+
+    Without options it prints each shard's buckets, wallets, balances and
+    transactions, counted on all shards in parallel. ``--move BUCKET --to
+    SHARD`` moves one bucket; ``--even`` moves buckets until every shard in
+    SHARDS holds an equal share, e.g. after adding a shard (``--dry-run``
+    lists the moves). Moves happen while the API is in use, see
+    ``wallet.rebalance``; an interrupted one is finished by running it again.
+    """
+    help = 'Report on shards and rebalance buckets of users between them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--move', type=int, metavar='BUCKET')
+        parser.add_argument('--to', metavar='SHARD')
+        parser.add_argument('--even', action='store_true')
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--drain', type=float, default=settings.SHARD_MAP_TTL,
+                            help='Seconds to wait for stale shard maps before deleting moved rows')
+        parser.add_argument('--workers', type=int, default=None, help='Threads for the report; one per shard by default')
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError('Sharding is off: set SHARD_DATABASES')
+
+        if options['move'] is not None:
+            if options['to'] is None:
+                raise CommandError('--move needs --to')
+            if not 0 <= options['move'] < sharding.SHARD_BUCKETS:
+                raise CommandError(f"Buckets are 0..{sharding.SHARD_BUCKETS - 1}")
+            moves = [(options['move'], options['to'])]
+        elif options['even']:
+            moves = rebalance.even_moves()
+        else:
+            moves = []
+
+        for bucket, target in moves:
+            if options['dry_run']:
+                self.stdout.write(f"bucket {bucket} -> {target}")
+                continue
+            try:
+                moved = rebalance.move_bucket(bucket, target, drain=options['drain'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f"bucket {bucket} -> {target}: {moved} wallets")
+
+        for shard, totals in rebalance.report(options['workers']).items():
+            self.stdout.write(
+                f"{shard:<10} buckets={totals['buckets']} wallets={totals['wallets']} "
+                f"balance={totals['balance'] or 0} transactions={totals['transactions']}"
+            )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from wallet import sharding
+from wallet.models import WalletDailyRollup
+
+
+class Command(BaseCommand):
+    """
+    Recompute daily rollups from the transactions table.
+
+    Run once after deploying the rollup tables to cover existing history,
+    or for specific wallets if their rollups are ever in doubt. Writes
+    made while it runs are queued and picked up by the next refresh.
+    """
+    help = 'Rebuild daily wallet rollups from the ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wallet', action='append', dest='wallets', help='Wallet id (repeatable); default all')
+
+    def handle(self, *args, **options):
+        rows = 0
+        for shard in sharding.each_shard():
+            rows += WalletDailyRollup.objects.db_manager(shard).rebuild(wallet_ids=options['wallets'])
+        self.stdout.write(f"Rebuilt {rows} daily rollups")
@@ -0,0 +1,44 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+
+from wallet import archive, sharding
+
+
+class Command(BaseCommand):
+    """
+    Archive settled transactions to cold storage on every shard (see
+    ``wallet.archive``).
+
+    Moves the COMPLETED transactions from before the start of the month
+    ``--days`` (default ARCHIVE_AFTER_DAYS) days ago, or before
+    ``--before``, into segment files of at most ``--batch-rows`` rows of
+    ``--batch-size`` wallets, and reports rows moved, bytes written and
+    rows per second.
+    """
+    help = 'Move old settled transactions into compressed segment files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int)
+        parser.add_argument('--before', type=datetime.fromisoformat, help='Cutoff date (YYYY-MM-DD), UTC')
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--batch-rows', type=int)
+
+    def handle(self, *args, **options):
+        cutoff = options['before']
+        if cutoff is not None:
+            cutoff = cutoff if cutoff.tzinfo else cutoff.replace(tzinfo=dt_timezone.utc)
+        else:
+            cutoff = archive.archive_cutoff(days=options['days'])
+        if cutoff is None:
+            self.stdout.write('Archiving is disabled: set ARCHIVE_AFTER_DAYS or pass --days or --before')
+            return
+        for shard in sharding.each_shard():
+            result = archive.run(
+                shard, cutoff=cutoff, batch_size=options['batch_size'], batch_rows=options['batch_rows'],
+            )
+            rate = result.rows / result.seconds if result.seconds else 0
+            self.stdout.write(
+                f"{shard}: archived {result.rows} rows of {result.wallets} wallets from before {cutoff:%Y-%m-%d} "
+                f"into {result.files} files ({result.bytes} bytes), {result.seconds:.1f}s ({rate:.0f} rows/s)"
+            )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from wallet import purge, sharding
+
+
+class Command(BaseCommand):
+    """
+    Run (or resume) a retention policy of ``wallet.purge`` on every shard.
+
+    Deletes the policy's expired rows in batches of ``--batch-size``,
+    sleeping ``--pause`` seconds between them, for up to ``--max-seconds``
+    per shard, and reports rows deleted and rows per second. A run that
+    runs out of time is resumed from its checkpoint by the next one.
+    """
+    help = 'Delete expired rows of a retention policy in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('policy', choices=sorted(purge.POLICIES))
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--pause', type=float)
+        parser.add_argument('--max-seconds', type=float)
+
+    def handle(self, *args, **options):
+        policy = purge.POLICIES[options['policy']]
+        # Transactions and idempotency keys live on every shard, checkpoints only on default
+        shards = sharding.each_shard() if policy.model._meta.label_lower in sharding.SHARDED_MODELS else ['default']
+        for shard in shards:
+            result = purge.run(
+                policy, using=shard, batch_size=options['batch_size'], pause=options['pause'],
+                max_seconds=options['max_seconds'],
+            )
+            self.stdout.write(
+                f"{shard}: deleted {result.deleted} rows in {result.batches} batches, {result.seconds:.1f}s "
+                f"({result.rows_per_second:.0f} rows/s){'' if result.finished else ', resumes next run'}"
+            )
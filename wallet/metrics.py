@@ -0,0 +1,224 @@
+"""
+Per-worker metrics for scraping.
+
+Every web and Celery worker process has its own connection pool, so pool
+counters - checkouts, time spent waiting for a connection, timeouts,
+connections opened and discarded - are per process. After requests and
+tasks each process publishes a snapshot of them to Redis at most every
+METRICS_PUBLISH_INTERVAL seconds (``metrics:worker:<host>:<pid>``,
+expiring after three intervals), and ``GET /api/v1/metrics/`` renders
+every live worker's snapshot in the Prometheus text format, labelled by
+worker. Without Redis a scrape only sees the worker that served it.
+
+Processes in PgBouncer mode have no pool of their own and publish no pool
+metrics; PgBouncer's ``SHOW STATS`` covers them.
+
+Workers that relay the transaction outbox (see ``wallet.outbox``) also
+publish the events and batches they relayed and a histogram of delivery
+lag, and scrapes add each shard's outbox backlog.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+
+import redis
+from celery.signals import task_postrun
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import connections
+
+from .redis_client import get_redis, mark_redis_down
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'metrics:worker:'
+
+# (psycopg_pool stat, metric, type, scale, help)
+POOL_METRICS = [
+    ('requests_num', 'wallet_db_pool_checkouts_total', 'counter', 1,
+     'Connections checked out of the pool'),
+    ('requests_queued', 'wallet_db_pool_queued_checkouts_total', 'counter', 1,
+     'Checkouts that had to wait for a free connection'),
+    ('requests_wait_ms', 'wallet_db_pool_wait_seconds_total', 'counter', 0.001,
+     'Time checkouts spent waiting for a connection'),
+    ('requests_errors', 'wallet_db_pool_checkout_errors_total', 'counter', 1,
+     'Checkouts that timed out or failed'),
+    ('usage_ms', 'wallet_db_pool_usage_seconds_total', 'counter', 0.001,
+     'Time connections spent checked out'),
+    ('connections_num', 'wallet_db_pool_connections_opened_total', 'counter', 1,
+     'Connections opened to the server'),
+    ('connections_ms', 'wallet_db_pool_connect_seconds_total', 'counter', 0.001,
+     'Time spent opening connections'),
+    ('connections_errors', 'wallet_db_pool_connect_errors_total', 'counter', 1,
+     'Failed attempts to open a connection'),
+    ('connections_lost', 'wallet_db_pool_connections_lost_total', 'counter', 1,
+     'Connections found broken, by the checkout health check or on return'),
+    ('returns_bad', 'wallet_db_pool_bad_returns_total', 'counter', 1,
+     'Connections returned in a bad state and discarded'),
+    ('pool_size', 'wallet_db_pool_connections', 'gauge', 1,
+     'Connections open, in use or idle'),
+    ('pool_available', 'wallet_db_pool_idle_connections', 'gauge', 1,
+     'Idle connections ready to be checked out'),
+    ('requests_waiting', 'wallet_db_pool_waiting_checkouts', 'gauge', 1,
+     'Checkouts waiting for a connection right now'),
+    ('pool_max', 'wallet_db_pool_max_connections', 'gauge', 1,
+     'Largest size the pool may grow to'),
+]
+
+# Upper bounds, in seconds, of the outbox delivery lag histogram
+OUTBOX_LAG_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+
+_outbox = {'events': 0, 'batches': 0, 'lag_sum': 0.0, 'lag_buckets': [0] * (len(OUTBOX_LAG_BUCKETS) + 1)}
+_outbox_lock = threading.Lock()
+
+_published_at = float('-inf')
+_publish_lock = threading.Lock()
+
+
+def worker_name():
+    """``<host>:<pid>`` of this process; the pid changes in forked workers"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def pool_stats():
+    """Pool counters of this process by database alias"""
+    stats = {}
+    for alias in connections:
+        connection = connections[alias]
+        pool = getattr(connection, 'pool', None)
+        if pool is not None:
+            stats[alias] = pool.get_stats()
+    return stats
+
+
+def observe_relay(lags):
+    """Count a relayed outbox batch and the delivery lag, in seconds, of each of its events"""
+    with _outbox_lock:
+        _outbox['events'] += len(lags)
+        _outbox['batches'] += 1
+        _outbox['lag_sum'] += sum(lags)
+        for lag in lags:
+            _outbox['lag_buckets'][bisect_left(OUTBOX_LAG_BUCKETS, lag)] += 1
+
+
+def outbox_stats():
+    with _outbox_lock:
+        return {**_outbox, 'lag_buckets': list(_outbox['lag_buckets'])}
+
+
+def snapshot():
+    return {'worker': worker_name(), 'at': time.time(), 'pools': pool_stats(), 'outbox': outbox_stats()}
+
+
+def publish():
+    """Store this process's snapshot in Redis for scrapes served by other workers"""
+    client = get_redis()
+    if client is None:
+        return
+    data = snapshot()
+    try:
+        client.set(
+            KEY_PREFIX + data['worker'], json.dumps(data),
+            ex=3 * settings.METRICS_PUBLISH_INTERVAL,
+        )
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+
+
+def maybe_publish(**kwargs):
+    """Publish at most every METRICS_PUBLISH_INTERVAL seconds; signal receiver"""
+    global _published_at
+    if not settings.METRICS_TOKEN:
+        return
+    if time.monotonic() - _published_at < settings.METRICS_PUBLISH_INTERVAL:
+        return
+    if not _publish_lock.acquire(blocking=False):
+        return
+    try:
+        _published_at = time.monotonic()
+        publish()
+    except Exception:
+        # Metrics never fail a request or a task
+        logger.exception("Could not publish worker metrics")
+    finally:
+        _publish_lock.release()
+
+
+def worker_snapshots():
+    """Snapshots of every live worker, this process's own up to date"""
+    current = snapshot()
+    snapshots = {current['worker']: current}
+    client = get_redis()
+    if client is None:
+        return list(snapshots.values())
+    try:
+        keys = list(client.scan_iter(match=KEY_PREFIX + '*', count=1000))
+        values = client.mget(keys) if keys else []
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return list(snapshots.values())
+    for value in values:
+        if value is not None:
+            data = json.loads(value)
+            snapshots.setdefault(data['worker'], data)
+    return list(snapshots.values())
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _outbox_lines(snapshots):
+    # Only workers that have relayed
+    relays = [(_label(data['worker']), data['outbox']) for data in snapshots if data.get('outbox', {}).get('batches')]
+    lines = []
+    for key, metric, help_text in [
+        ('events', 'wallet_outbox_events_relayed_total', 'Outbox events relayed'),
+        ('batches', 'wallet_outbox_relay_batches_total', 'Outbox batches relayed'),
+    ]:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        lines.extend(f'{metric}{{worker="{worker}"}} {stats[key]}' for worker, stats in relays)
+
+    metric = 'wallet_outbox_delivery_lag_seconds'
+    lines.append(f"# HELP {metric} Time from an outbox event's write to its delivery by the relay")
+    lines.append(f"# TYPE {metric} histogram")
+    for worker, stats in relays:
+        count = 0
+        for bound, observed in zip(OUTBOX_LAG_BUCKETS + ['+Inf'], stats['lag_buckets']):
+            count += observed
+            lines.append(f'{metric}_bucket{{worker="{worker}",le="{bound}"}} {count}')
+        lines.append(f'{metric}_sum{{worker="{worker}"}} {stats["lag_sum"]}')
+        lines.append(f'{metric}_count{{worker="{worker}"}} {count}')
+    return lines
+
+
+def render(snapshots, outbox_backlog=None):
+    """Prometheus text exposition of worker snapshots and ``{shard: (waiting, oldest age)}`` outbox backlogs"""
+    lines = []
+    for stat, metric, kind, scale, help_text in POOL_METRICS:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for data in snapshots:
+            for alias, stats in sorted(data['pools'].items()):
+                value = stats.get(stat, 0)
+                value = value if scale == 1 else value * scale
+                lines.append(f'{metric}{{worker="{_label(data["worker"])}",database="{_label(alias)}"}} {value}')
+    lines.extend(_outbox_lines(snapshots))
+    for index, metric, help_text in [
+        (0, 'wallet_outbox_waiting_events', 'Outbox events not relayed yet'),
+        (1, 'wallet_outbox_oldest_event_age_seconds', 'Age of the oldest outbox event not relayed yet'),
+    ]:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for alias, values in sorted((outbox_backlog or {}).items()):
+            lines.append(f'{metric}{{database="{_label(alias)}"}} {values[index]}')
+    return '\n'.join(lines) + '\n'
+
+
+request_finished.connect(maybe_publish, dispatch_uid='wallet.metrics')
+task_postrun.connect(maybe_publish, dispatch_uid='wallet.metrics', weak=False)
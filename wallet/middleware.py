@@ -0,0 +1,95 @@
+"""
+Load shedding.
+
+Every process tracks the latency of the requests it served over the last
+LOAD_SHED_WINDOW seconds. When their p99 passes LOAD_SHED_P99_MS, views
+with ``shed_priority = LOW`` (history, exports, statements) are answered
+with ``503`` and ``Retry-After`` before they run; past twice the
+threshold ``NORMAL`` views are shed too. ``CRITICAL`` views - money
+movement, session management, the health check - are never shed. The
+process leaves overload once p99 drops below 80% of the threshold.
+"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.http import JsonResponse
+
+LOW, NORMAL, CRITICAL = 0, 1, 2
+
+
+class LatencyMonitor:
+    """Sliding window of request latencies and the shedding level they call for"""
+
+    def __init__(self):
+        self.samples = deque(maxlen=100000)
+        self.lock = threading.Lock()
+        self.level = LOW
+        self.p99 = None
+        self.checked_at = float('-inf')
+
+    def record(self, seconds):
+        self.samples.append((time.monotonic(), seconds))
+
+    def shed_level(self):
+        """Views with a priority below this are shed"""
+        now = time.monotonic()
+        if now - self.checked_at < 1.0:
+            return self.level
+        with self.lock:
+            if now - self.checked_at >= 1.0:
+                self.checked_at = now
+                self._update(now)
+        return self.level
+
+    def _update(self, now):
+        cutoff = now - settings.LOAD_SHED_WINDOW
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+        durations = sorted(seconds for _, seconds in list(self.samples))
+        if len(durations) < settings.LOAD_SHED_MIN_SAMPLES:
+            self.level, self.p99 = LOW, None
+            return
+        self.p99 = durations[int((len(durations) - 1) * 0.99)]
+        threshold = settings.LOAD_SHED_P99_MS / 1000
+        if self.p99 > 2 * threshold:
+            self.level = CRITICAL
+        elif self.p99 > threshold:
+            self.level = NORMAL
+        elif self.p99 < 0.8 * threshold:
+            self.level = LOW
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.level, self.p99, self.checked_at = LOW, None, float('-inf')
+
+
+monitor = LatencyMonitor()
+
+
+class LoadSheddingMiddleware:
+    """Shed low-priority views while this process's p99 latency is over LOAD_SHED_P99_MS"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        # Shed requests are instant and would hide the latency that caused them
+        if not getattr(request, 'load_shed', False):
+            monitor.record(time.perf_counter() - started)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.LOAD_SHED_ENABLED:
+            return None
+        priority = getattr(getattr(view_func, 'view_class', None), 'shed_priority', NORMAL)
+        if priority >= monitor.shed_level():
+            return None
+        request.load_shed = True
+        response = JsonResponse({'error': 'Server is overloaded, please retry later'}, status=503)
+        response['Retry-After'] = str(settings.LOAD_SHED_WINDOW)
+        return response
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0002_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='counterparty',
+            field=models.ForeignKey(blank=True, help_text='Other wallet of a transfer', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='wallet.wallet'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:54
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0003_transaction_counterparty'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayoutJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('currency', models.CharField(choices=[('USD', 'US Dollar'), ('EUR', 'Euro'), ('GBP', 'British Pound'), ('JPY', 'Japanese Yen')], default='USD', max_length=3)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('COMPLETED', 'Completed')], default='PENDING', max_length=20)),
+                ('total_items', models.PositiveIntegerField(default=0)),
+                ('processed_items', models.PositiveIntegerField(default=0)),
+                ('succeeded_items', models.PositiveIntegerField(default=0)),
+                ('failed_items', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='payout_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'payout_jobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PayoutItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row_number', models.PositiveIntegerField()),
+                ('wallet_id', models.UUIDField(blank=True, null=True)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True)),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='wallet.transaction')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='wallet.payoutjob')),
+            ],
+            options={
+                'db_table': 'payout_items',
+                'ordering': ['row_number'],
+                'indexes': [models.Index(fields=['job', 'status', 'row_number'], name='payout_item_job_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('job', 'row_number'), name='payout_item_unique_row')],
+            },
+        ),
+    ]
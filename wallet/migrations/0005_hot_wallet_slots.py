@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:59
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0004_payouts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='hot_slots',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Number of balance slots credits are spread over (0 turns hot wallet mode off)'),
+        ),
+        migrations.CreateModel(
+            name='WalletBalanceSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_slots', to='wallet.wallet')),
+            ],
+            options={
+                'db_table': 'wallet_balance_slots',
+                'constraints': [models.UniqueConstraint(fields=('wallet', 'slot'), name='wallet_balance_slot_unique')],
+            },
+        ),
+    ]
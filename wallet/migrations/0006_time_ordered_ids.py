@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:06
+
+import wallet.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0005_hot_wallet_slots'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payoutjob',
+            name='id',
+            field=models.UUIDField(default=wallet.ids.new_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='id',
+            field=models.UUIDField(default=wallet.ids.new_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='id',
+            field=models.UUIDField(default=wallet.ids.new_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='wallet',
+            name='id',
+            field=models.UUIDField(default=wallet.ids.new_id, editable=False, primary_key=True, serialize=False),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:09
+
+import django.db.models.deletion
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('wallet', '0006_time_ordered_ids'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='transaction',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['wallet', 'created_at', 'id'], name='txn_wallet_created_idx'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='wallet',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='wallet.wallet'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:15
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('wallet', '0007_transaction_history_index'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['wallet', 'transaction_type', 'created_at', 'id'], name='txn_wallet_type_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['wallet', 'amount'], name='txn_wallet_amount_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('status', 'COMPLETED'), _negated=True), fields=['wallet', 'status', 'created_at', 'id'], name='txn_wallet_open_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('description', 'reference', config='simple'), name='txn_search_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:55
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0008_transaction_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletRollupMark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wallet.wallet')),
+            ],
+            options={
+                'db_table': 'wallet_rollup_marks',
+            },
+        ),
+        migrations.CreateModel(
+            name='WalletDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('deposits_total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('deposits_count', models.PositiveIntegerField(default=0)),
+                ('withdrawals_total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('withdrawals_count', models.PositiveIntegerField(default=0)),
+                ('transfers_in_total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('transfers_in_count', models.PositiveIntegerField(default=0)),
+                ('transfers_out_total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('transfers_out_count', models.PositiveIntegerField(default=0)),
+                ('closing_balance', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='wallet.wallet')),
+            ],
+            options={
+                'db_table': 'wallet_daily_rollups',
+                'ordering': ['wallet', 'day'],
+                'constraints': [models.UniqueConstraint(fields=('wallet', 'day'), name='wallet_daily_rollup_unique')],
+            },
+        ),
+    ]
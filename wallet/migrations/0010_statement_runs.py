@@ -0,0 +1,59 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0009_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatementRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField(unique=True)),
+                ('period_end', models.DateField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('COMPLETED', 'Completed')], default='PENDING', max_length=20)),
+                ('total_wallets', models.PositiveIntegerField(default=0)),
+                ('processed_wallets', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'statement_runs',
+                'ordering': ['-period_start'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyStatement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField()),
+                ('period_end', models.DateField()),
+                ('currency', models.CharField(choices=[('USD', 'US Dollar'), ('EUR', 'Euro'), ('GBP', 'British Pound'), ('JPY', 'Japanese Yen')], max_length=3)),
+                ('opening_balance', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('closing_balance', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('deposits_total', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('deposits_count', models.PositiveIntegerField()),
+                ('withdrawals_total', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('withdrawals_count', models.PositiveIntegerField()),
+                ('transfers_in_total', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('transfers_in_count', models.PositiveIntegerField()),
+                ('transfers_out_total', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('transfers_out_count', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statements', to='wallet.wallet')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statements', to='wallet.statementrun')),
+            ],
+            options={
+                'db_table': 'wallet_statements',
+                'ordering': ['wallet', '-period_start'],
+                'constraints': [models.UniqueConstraint(fields=('wallet', 'period_start'), name='wallet_statement_unique_period')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0010_statement_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardBucket',
+            fields=[
+                ('bucket', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('shard', models.CharField(max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'shard_buckets',
+                'ordering': ['bucket'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ShardFence',
+            fields=[
+                ('bucket', models.PositiveIntegerField(primary_key=True, serialize=False)),
+            ],
+            options={
+                'db_table': 'shard_fences',
+            },
+        ),
+        migrations.AlterField(
+            model_name='payoutitem',
+            name='transaction',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='wallet.transaction'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='counterparty',
+            field=models.ForeignKey(blank=True, db_constraint=False, help_text='Other wallet of a transfer', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='wallet.wallet'),
+        ),
+    ]
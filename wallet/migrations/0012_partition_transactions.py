@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:58
+
+from django.db import migrations, models
+
+from wallet import partitions
+
+
+def partition_transactions(apps, schema_editor):
+    partitions.convert(schema_editor.connection)
+
+
+def unpartition_transactions(apps, schema_editor):
+    partitions.convert(schema_editor.connection, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0011_sharding'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='reference',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+        # Copies every row: the table is locked for writes until it is done
+        migrations.RunPython(partition_transactions, unpartition_transactions),
+    ]
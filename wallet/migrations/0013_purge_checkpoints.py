@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0012_partition_transactions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurgeCheckpoint',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('cutoff', models.DateTimeField()),
+                ('position', models.CharField(blank=True, max_length=64)),
+                ('deleted', models.BigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'purge_checkpoints',
+            },
+        ),
+    ]
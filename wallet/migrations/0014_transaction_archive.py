@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0013_purge_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('rows', models.PositiveIntegerField()),
+                ('first_created_at', models.DateTimeField()),
+                ('last_created_at', models.DateTimeField()),
+                ('cutoff', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to='wallet.wallet')),
+            ],
+            options={
+                'db_table': 'transaction_archive_segments',
+                'ordering': ['wallet', 'first_created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:32
+
+import wallet.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0014_transaction_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.UUIDField(default=wallet.ids.new_id, editable=False, primary_key=True, serialize=False)),
+                ('event', models.CharField(max_length=50)),
+                ('wallet_id', models.UUIDField()),
+                ('payload', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'transaction_outbox',
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+from django.db import migrations, models
+
+from wallet import partitions
+
+INDEXES = [
+    models.Index(fields=['wallet', 'created_at', 'id', 'amount'], name='txn_wallet_history_idx'),
+    models.Index(fields=['wallet', 'status', 'created_at', 'id'], name='txn_wallet_status_idx'),
+    models.Index(fields=['wallet', 'currency', 'created_at', 'id'], name='txn_wallet_currency_idx'),
+]
+REPLACED = [
+    models.Index(fields=['wallet', 'created_at', 'id'], name='txn_wallet_created_idx'),
+    models.Index(fields=['wallet', 'amount'], name='txn_wallet_amount_idx'),
+    models.Index(
+        fields=['wallet', 'status', 'created_at', 'id'], name='txn_wallet_open_status_idx',
+        condition=~models.Q(status='COMPLETED'),
+    ),
+]
+
+
+def replace_indexes(apps, schema_editor):
+    Transaction = apps.get_model('wallet', 'Transaction')
+    # The new indexes are in place before the ones they replace are dropped
+    for index in INDEXES:
+        partitions.add_index(schema_editor, Transaction, index)
+    for index in REPLACED:
+        schema_editor.remove_index(Transaction, index)
+
+
+def restore_indexes(apps, schema_editor):
+    Transaction = apps.get_model('wallet', 'Transaction')
+    for index in REPLACED:
+        if index.condition is None:
+            partitions.add_index(schema_editor, Transaction, index)
+        else:
+            schema_editor.add_index(Transaction, index)
+    for index in INDEXES:
+        schema_editor.remove_index(Transaction, index)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('wallet', '0015_transaction_outbox'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                *[migrations.AddIndex(model_name='transaction', index=index) for index in INDEXES],
+                *[migrations.RemoveIndex(model_name='transaction', name=index.name) for index in REPLACED],
+            ],
+            database_operations=[migrations.RunPython(replace_indexes, restore_indexes)],
+        ),
+    ]
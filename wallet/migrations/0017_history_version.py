@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 06:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0016_history_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='history_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='walletbalanceslot',
+            name='history_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,13 +1,24 @@
-from django.db import models
+from django.db import models, connections, router, transaction
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
 from django.core.validators import MinValueValidator
+from django.db.models.functions import Coalesce
+from django.conf import settings
+from django.utils import timezone
+from datetime import datetime, time, timedelta, timezone as dt_timezone
 from decimal import Decimal
-import uuid
+import random
+
+import orjson
+
+from . import cache as wallet_cache, sharding
+from .ids import encode_base32, new_id
 
 
 class User(AbstractUser):
     """Custom User model with additional fields"""
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=new_id, editable=False)
     email = models.EmailField(unique=True)
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     date_of_birth = models.DateField(blank=True, null=True)
@@ -23,6 +34,272 @@ class User(AbstractUser):
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        sharding.mirror_user(self)
+        wallet_cache.forget_user(self.pk, using=self._state.db)
+
+    def delete(self, *args, **kwargs):
+        user_id = self.pk
+        sharding.forget_user(self)
+        result = super().delete(*args, **kwargs)
+        wallet_cache.forget_user(user_id, using=self._state.db)
+        return result
+
+
+class InsufficientBalance(ValueError):
+    """Raised when a debit would take a wallet balance below zero"""
+
+
+class WalletManager(models.Manager):
+    """Manager with lock-free conditional balance updates"""
+
+    def _tables(self, wallet=None):
+        connection = connections[self._db or router.db_for_write(self.model, instance=wallet)]
+        qn = connection.ops.quote_name
+        return connection, qn(self.model._meta.db_table), qn(WalletBalanceSlot._meta.db_table)
+
+    @staticmethod
+    def _slots_sum(slot_table, wallet_column):
+        """SQL for the sum of a wallet's hot-wallet balance slots (0 for regular wallets)"""
+        return f"(SELECT COALESCE(SUM(balance), 0) FROM {slot_table} WHERE wallet_id = {wallet_column})"
+
+    def apply_balance_change(self, wallet, delta):
+        """
+        Atomically add ``delta`` to the wallet balance with a single
+        conditional UPDATE ... RETURNING. Debits only match while the
+        balance covers them, so concurrent writers never need a
+        SELECT ... FOR UPDATE round trip and can never overdraw.
+
+        Returns the new total balance (including any hot-wallet slots),
+        or None if no row matched (the debit was not covered or the
+        wallet is gone).
+        """
+        connection, table, slot_table = self._tables(wallet)
+        sql = (
+            f"UPDATE {table} SET balance = balance + %s, history_version = history_version + 1, updated_at = %s"
+            " WHERE id = %s"
+        )
+        params = [delta, timezone.now(), wallet.pk]
+        if delta < 0:
+            sql += " AND balance >= %s"
+            params.append(-delta)
+        sql += f" RETURNING balance + {self._slots_sum(slot_table, f'{table}.id')}"
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row:
+            wallet_cache.invalidate(wallet.pk, using=connection.alias)
+        return row[0] if row else None
+
+    def credit_balance_slot(self, wallet, amount):
+        """
+        Credit one randomly picked balance slot of a hot wallet, so
+        concurrent credits contend on N slot rows instead of the wallet
+        row. Returns the wallet total as seen right after the credit, or
+        None if the wallet is not (or no longer) in hot mode.
+        """
+        connection, table, slot_table = self._tables(wallet)
+        sql = f"""
+            WITH credited AS (
+                UPDATE {slot_table}
+                SET balance = balance + %(amount)s, history_version = history_version + 1, updated_at = %(now)s
+                WHERE wallet_id = %(wallet)s AND slot = %(slot)s
+                  AND EXISTS (SELECT 1 FROM {table} WHERE id = %(wallet)s AND hot_slots > %(slot)s)
+                RETURNING balance
+            )
+            SELECT credited.balance
+                + (SELECT balance FROM {table} WHERE id = %(wallet)s)
+                + (SELECT COALESCE(SUM(balance), 0) FROM {slot_table}
+                   WHERE wallet_id = %(wallet)s AND slot <> %(slot)s)
+            FROM credited
+        """
+        params = {
+            'wallet': wallet.pk,
+            'slot': random.randrange(wallet.hot_slots),
+            'amount': amount,
+            'now': timezone.now(),
+        }
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row:
+            wallet_cache.invalidate(wallet.pk, using=connection.alias)
+        return row[0] if row else None
+
+    def consolidate_balance_slots(self, wallet):
+        """
+        Move the balance of every slot of a wallet into its main balance.
+        The wallet row is locked before the slots, the same order debits
+        take, so this cannot deadlock with them. Row locks here and in the
+        other set-based updates are NO KEY UPDATE, like a plain UPDATE, so
+        they do not block the key-share locks taken by Transaction inserts
+        of credits already holding a slot. Returns the new main balance,
+        or None if the wallet is gone.
+        """
+        connection, table, slot_table = self._tables(wallet)
+        sql = f"""
+            WITH old AS (
+                SELECT id, balance FROM {slot_table}
+                WHERE wallet_id = %(wallet)s AND balance <> 0
+                ORDER BY id
+                FOR UPDATE
+            ), drained AS (
+                UPDATE {slot_table} AS s SET balance = 0, updated_at = %(now)s
+                FROM old WHERE s.id = old.id
+                RETURNING old.balance
+            )
+            UPDATE {table}
+            SET balance = balance + (SELECT COALESCE(SUM(balance), 0) FROM drained), updated_at = %(now)s
+            WHERE id = %(wallet)s
+            RETURNING balance
+        """
+
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {table} WHERE id = %s FOR NO KEY UPDATE", [wallet.pk])
+            cursor.execute(sql, {'wallet': wallet.pk, 'now': timezone.now()})
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def credit(self, wallet, amount):
+        """
+        Credit a wallet, through a balance slot when it is in hot mode.
+        Returns the new total balance, or None if the wallet is gone.
+        """
+        total = None
+        if wallet.hot_slots:
+            total = self.credit_balance_slot(wallet, amount)
+        if total is None:
+            total = self.apply_balance_change(wallet, amount)
+        wallet.sync_balance(total)
+        return total
+
+    def debit(self, wallet, amount):
+        """
+        Debit the main balance of a wallet. When a hot wallet's main
+        balance falls short, its slots are folded in and the debit is
+        retried once. Returns the new total balance, or None if the
+        balance does not cover the amount.
+        """
+        total = self.apply_balance_change(wallet, -amount)
+        if total is None and wallet.hot_slots:
+            self.consolidate_balance_slots(wallet)
+            total = self.apply_balance_change(wallet, -amount)
+        wallet.sync_balance(total)
+        return total
+
+    def apply_transfer(self, source, destination, amount):
+        """
+        Move ``amount`` from ``source`` to ``destination`` in one statement.
+
+        Both rows are locked in wallet-UUID order before either is
+        changed, so transfers running in opposite directions between the
+        same wallets cannot deadlock. Nothing is written unless the
+        source balance covers the amount.
+
+        Returns ``{wallet_id: new_total_balance}`` for both wallets, or
+        None if the source balance was insufficient.
+        """
+        connection, table, slot_table = self._tables(source)
+        sql = f"""
+            WITH locked AS (
+                SELECT id, balance FROM {table}
+                WHERE id IN (%(source)s, %(destination)s)
+                ORDER BY id
+                FOR NO KEY UPDATE
+            )
+            UPDATE {table} AS w
+            SET balance = w.balance + CASE WHEN w.id = %(source)s THEN -%(amount)s ELSE %(amount)s END,
+                history_version = w.history_version + 1, updated_at = %(now)s
+            FROM locked
+            WHERE w.id = locked.id
+              AND (SELECT balance FROM locked WHERE id = %(source)s) >= %(amount)s
+            RETURNING w.id, w.balance + {self._slots_sum(slot_table, 'w.id')}
+        """
+        params = {
+            'source': source.pk,
+            'destination': destination.pk,
+            'amount': amount,
+            'now': timezone.now(),
+        }
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        if len(rows) != 2:
+            return None
+        wallet_cache.invalidate(source.pk, destination.pk, using=connection.alias)
+        return dict(rows)
+
+    def apply_bulk_credit(self, credits):
+        """
+        Add ``{wallet_id: amount}`` to many wallets with one set-based
+        UPDATE ... FROM (VALUES ...). Rows are locked in wallet-UUID order
+        first, like ``apply_transfer``, so overlapping batches and
+        transfers cannot deadlock.
+
+        Returns ``{wallet_id: new_total_balance}`` for the wallets that exist.
+        """
+        connection, table, slot_table = self._tables()
+        values = ', '.join(['(%s::uuid, %s::numeric)'] * len(credits))
+        sql = f"""
+            WITH v (id, amount) AS (VALUES {values}),
+            locked AS (
+                SELECT w.id FROM {table} AS w
+                JOIN v ON v.id = w.id
+                ORDER BY w.id
+                FOR NO KEY UPDATE OF w
+            )
+            UPDATE {table} AS w
+            SET balance = w.balance + v.amount, history_version = w.history_version + 1, updated_at = %s
+            FROM v JOIN locked ON locked.id = v.id
+            WHERE w.id = v.id
+            RETURNING w.id, w.balance + {self._slots_sum(slot_table, 'w.id')}
+        """
+        params = [value for item in sorted(credits.items()) for value in item]
+        params.append(timezone.now())
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            totals = dict(cursor.fetchall())
+        wallet_cache.invalidate(*totals, using=connection.alias)
+        return totals
+
+    def bump_history(self, wallet_ids):
+        """
+        Move on the history version of wallets whose transactions were
+        edited or removed without a balance statement. Rows are locked in
+        wallet-UUID order, like ``apply_transfer``.
+        """
+        if not wallet_ids:
+            return
+        connection, table, _ = self._tables()
+        sql = f"""
+            WITH locked AS (
+                SELECT id FROM {table} WHERE id = ANY(%s::uuid[]) ORDER BY id FOR NO KEY UPDATE
+            )
+            UPDATE {table} AS w SET history_version = w.history_version + 1
+            FROM locked WHERE w.id = locked.id
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [sorted(str(wallet_id) for wallet_id in wallet_ids)])
+
+    def history_version(self, user):
+        """
+        Version of the transaction history of a user's wallet, or None
+        without one: the wallet's counter plus those of its balance slots,
+        which hot-wallet credits bump instead of the wallet row.
+        """
+        slots = (
+            WalletBalanceSlot.objects.filter(wallet=models.OuterRef('pk'))
+            .values('wallet').annotate(version=models.Sum('history_version')).values('version')
+        )
+        return self.filter(user=user).values_list(
+            models.F('history_version') + Coalesce(models.Subquery(slots), 0), flat=True
+        ).first()
+
 
 class Wallet(models.Model):
     """Wallet model to store user's wallet information"""
@@ -33,7 +310,7 @@ class Wallet(models.Model):
         ('JPY', 'Japanese Yen'),
     ]
 
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=new_id, editable=False)
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='wallet')
     balance = models.DecimalField(
         max_digits=15, 
@@ -43,34 +320,145 @@ class Wallet(models.Model):
     )
     currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES, default='USD')
     is_active = models.BooleanField(default=True)
+    hot_slots = models.PositiveSmallIntegerField(
+        default=0,
+        help_text='Number of balance slots credits are spread over (0 turns hot wallet mode off)'
+    )
+    # Bumped in the transaction of every write to the wallet's history; see WalletManager.history_version
+    history_version = models.PositiveBigIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = WalletManager()
+
     class Meta:
         db_table = 'wallets'
 
     def __str__(self):
         return f"{self.user.email} - {self.balance} {self.currency}"
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        if adding and sharding.enabled():
+            # The shard's foreign key needs its copy of the user
+            sharding.mirror_user(self.user, kwargs.get('using') or router.db_for_write(Wallet, instance=self))
+        super().save(*args, **kwargs)
+        wallet_cache.invalidate(self.pk, using=self._state.db)
+        if adding:
+            wallet_cache.forget_owner(self.user_id)
+
+    def delete(self, *args, **kwargs):
+        wallet_id, user_id = self.pk, self.user_id
+        result = super().delete(*args, **kwargs)
+        wallet_cache.invalidate(wallet_id, using=self._state.db)
+        wallet_cache.forget_owner(user_id)
+        return result
+
+    @property
+    def total_balance(self):
+        """Main balance plus any hot-wallet balance slots"""
+        if not self.hot_slots:
+            return self.balance
+        slots = self.balance_slots.aggregate(total=models.Sum('balance'))['total']
+        return self.balance + (slots or Decimal('0.00'))
+
+    def sync_balance(self, total):
+        """Keep the in-memory balance current after a ledger update"""
+        # For hot wallets ``balance`` is only the main part of the total
+        if total is not None and not self.hot_slots:
+            self.balance = total
+
     def can_withdraw(self, amount):
         """Check if wallet has sufficient balance for withdrawal"""
-        return self.balance >= amount
+        return self.total_balance >= amount
 
     def deposit(self, amount):
-        """Add money to wallet"""
+        """Add money to wallet and return the new balance"""
         if amount <= 0:
             raise ValueError("Deposit amount must be positive")
-        self.balance += amount
-        self.save()
+        new_balance = Wallet.objects.credit(self, amount)
+        if new_balance is None:
+            raise Wallet.DoesNotExist("Wallet no longer exists")
+        return new_balance
 
     def withdraw(self, amount):
-        """Withdraw money from wallet"""
+        """Withdraw money from wallet and return the new balance"""
         if amount <= 0:
             raise ValueError("Withdrawal amount must be positive")
-        if not self.can_withdraw(amount):
-            raise ValueError("Insufficient balance")
-        self.balance -= amount
-        self.save()
+        new_balance = Wallet.objects.debit(self, amount)
+        if new_balance is None:
+            raise InsufficientBalance("Insufficient balance")
+        return new_balance
+
+    def enable_hot_mode(self, slots):
+        """Spread future credits over ``slots`` balance slot rows"""
+        using = self._state.db
+        with transaction.atomic(using=using):
+            WalletBalanceSlot.objects.db_manager(using).bulk_create(
+                [WalletBalanceSlot(wallet=self, slot=slot) for slot in range(slots)],
+                ignore_conflicts=True,
+            )
+            Wallet.objects.db_manager(using).filter(pk=self.pk).update(hot_slots=slots)
+        self.hot_slots = slots
+
+    def disable_hot_mode(self):
+        """Send credits back to the main balance and fold the slots into it"""
+        using = self._state.db
+        with transaction.atomic(using=using):
+            Wallet.objects.db_manager(using).filter(pk=self.pk).update(hot_slots=0)
+            Wallet.objects.db_manager(using).consolidate_balance_slots(self)
+        self.hot_slots = 0
+        self.refresh_from_db(fields=['balance'])
+
+
+class WalletBalanceSlot(models.Model):
+    """
+    Part of a hot wallet's balance. Credits to a hot wallet land on a
+    random slot; debits drain the main balance, which the slots are
+    folded into on demand and by ``wallet.tasks.consolidate_hot_wallets``.
+    """
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='balance_slots')
+    slot = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    # Credits to the slot bump this rather than the wallet's, which they do not lock
+    history_version = models.PositiveBigIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'wallet_balance_slots'
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'slot'], name='wallet_balance_slot_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.wallet_id} slot {self.slot} - {self.balance}"
+
+
+class TransactionQuerySet(models.QuerySet):
+
+    def delete(self):
+        """Delete the rows and move on the history version of their wallets"""
+        with transaction.atomic(using=self.db, savepoint=False):
+            wallet_ids = set(self.values_list('wallet_id', flat=True))
+            result = super().delete()
+            Wallet.objects.db_manager(self.db).bump_history(wallet_ids)
+        return result
+
+
+class TransactionManager(models.Manager.from_queryset(TransactionQuerySet)):
+    """Manager that fills in references for bulk-created transactions and queues their events"""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            if not obj.reference:
+                obj.reference = obj.generate_reference(obj.id)
+        with transaction.atomic(using=self._db or router.db_for_write(self.model), savepoint=False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            if created:
+                WalletRollupMark.objects.db_manager(created[0]._state.db).mark(created)
+                OutboxEvent.objects.db_manager(created[0]._state.db).record(created, OutboxEvent.CREATED)
+        return created
 
 
 class Transaction(models.Model):
@@ -88,8 +476,14 @@ class Transaction(models.Model):
         ('CANCELLED', 'Cancelled'),
     ]
 
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='transactions')
+    id = models.UUIDField(primary_key=True, default=new_id, editable=False)
+    # Indexed by txn_wallet_history_idx, which wallet_id leads
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='transactions', db_index=False)
+    # Not enforced: a rebalance can move the other wallet to another shard
+    counterparty = models.ForeignKey(
+        Wallet, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', db_constraint=False,
+        help_text='Other wallet of a transfer'
+    )
     transaction_type = models.CharField(max_length=20, choices=TRANSACTION_TYPES)
     amount = models.DecimalField(
         max_digits=15, 
@@ -99,26 +493,541 @@ class Transaction(models.Model):
     currency = models.CharField(max_length=3, choices=Wallet.CURRENCY_CHOICES, default='USD')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     description = models.TextField(blank=True)
-    reference = models.CharField(max_length=100, blank=True, unique=True)
+    # Unique as the primary key is; the partitioned table cannot enforce it (see wallet.partitions)
+    reference = models.CharField(max_length=100, blank=True, db_index=True)
     balance_before = models.DecimalField(max_digits=15, decimal_places=2)
     balance_after = models.DecimalField(max_digits=15, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TransactionManager()
+
     class Meta:
         db_table = 'transactions'
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Transaction history pages, newest first (see wallet.pagination); amount
+            # ranges are checked on its entries while it is read in page order
+            models.Index(fields=['wallet', 'created_at', 'id', 'amount'], name='txn_wallet_history_idx'),
+            # History filters (see wallet.filters)
+            models.Index(fields=['wallet', 'transaction_type', 'created_at', 'id'], name='txn_wallet_type_idx'),
+            models.Index(fields=['wallet', 'status', 'created_at', 'id'], name='txn_wallet_status_idx'),
+            models.Index(fields=['wallet', 'currency', 'created_at', 'id'], name='txn_wallet_currency_idx'),
+            GinIndex(
+                SearchVector('description', 'reference', config='simple'), name='txn_search_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.transaction_type} - {self.amount} {self.currency} - {self.status}"
 
+    @staticmethod
+    def generate_reference(transaction_id):
+        """Generate a transaction reference; unique because the primary key is"""
+        return f"TXN-{encode_base32(transaction_id)}"
+
     def save(self, *args, **kwargs):
         """Override save to generate reference if not provided"""
         if not self.reference:
-            self.reference = f"TXN-{uuid.uuid4().hex[:8].upper()}"
-        super().save(*args, **kwargs)
+            self.reference = self.generate_reference(self.id)
+        adding = self._state.adding
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        # The row, its rollup mark and its outbox event are written together or not at all
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+            # Edits (e.g. a status change in the admin) also change the day's rollup
+            WalletRollupMark.objects.db_manager(self._state.db).mark([self])
+            OutboxEvent.objects.db_manager(self._state.db).record(
+                [self], OutboxEvent.CREATED if adding else OutboxEvent.UPDATED
+            )
+            # New rows are written beside the balance statement that bumps the history version
+            if not adding:
+                Wallet.objects.db_manager(self._state.db).bump_history([self.wallet_id])
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            result = super().delete(*args, **kwargs)
+            Wallet.objects.db_manager(using).bump_history([self.wallet_id])
+        return result
 
     @property
     def user(self):
         """Get the user associated with this transaction"""
         return self.wallet.user
+
+
+class WalletRollupMarkManager(models.Manager):
+    """Queue of wallet days whose rollups are out of date"""
+
+    def mark(self, transactions):
+        """Queue the days of newly written transactions for a rollup refresh"""
+        days = {(txn.wallet_id, rollup_day(txn.created_at)) for txn in transactions}
+        self.bulk_create([self.model(wallet_id=wallet_id, day=day) for wallet_id, day in sorted(days)])
+
+
+class WalletRollupMark(models.Model):
+    """
+    A wallet day written to since its rollup was last computed. Marks are
+    only ever inserted, never updated, so marking takes no row locks and
+    hot wallets do not contend on it.
+    """
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+
+    objects = WalletRollupMarkManager()
+
+    class Meta:
+        db_table = 'wallet_rollup_marks'
+
+    def __str__(self):
+        return f"{self.wallet_id} {self.day}"
+
+
+def rollup_day(moment):
+    """The (UTC) day a transaction is rolled up into"""
+    return moment.astimezone(dt_timezone.utc).date()
+
+
+class WalletDailyRollupManager(models.Manager):
+    """
+    Manager that computes daily rollups from the transactions table.
+
+    Days before a wallet's archive cutoff (see ``wallet.archive``) are
+    final: their transactions have left the table, so refresh and rebuild
+    keep the rollups they had when the days were archived.
+    """
+
+    COLUMNS = [
+        'wallet_id', 'day',
+        'deposits_total', 'deposits_count', 'withdrawals_total', 'withdrawals_count',
+        'transfers_in_total', 'transfers_in_count', 'transfers_out_total', 'transfers_out_count',
+        'closing_balance', 'updated_at',
+    ]
+
+    def _tables(self):
+        connection = connections[self._db or router.db_for_write(self.model)]
+        qn = connection.ops.quote_name
+        return (
+            connection, qn(self.model._meta.db_table),
+            qn(Transaction._meta.db_table), qn(WalletRollupMark._meta.db_table),
+        )
+
+    def _archived_sql(self, connection):
+        """Each archived wallet and its archive cutoff"""
+        table = connection.ops.quote_name(ArchiveSegment._meta.db_table)
+        return f"SELECT wallet_id, MAX(cutoff) AS cutoff FROM {table} GROUP BY wallet_id"
+
+    def _aggregate_sql(self, table, transactions, join='', condition=''):
+        """INSERT ... SELECT upserting the rollups of the completed transactions ``join``/``condition`` select"""
+        def total(condition):
+            return (
+                f"COALESCE(SUM(t.amount) FILTER (WHERE {condition}), 0), "
+                f"COUNT(*) FILTER (WHERE {condition})"
+            )
+        columns = ', '.join(self.COLUMNS)
+        updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in self.COLUMNS[2:])
+        return f"""
+            INSERT INTO {table} ({columns})
+            SELECT t.wallet_id, (t.created_at AT TIME ZONE 'UTC')::date,
+                {total("t.transaction_type = 'DEPOSIT'")},
+                {total("t.transaction_type = 'WITHDRAWAL'")},
+                {total("t.transaction_type = 'TRANSFER' AND t.balance_after > t.balance_before")},
+                {total("t.transaction_type = 'TRANSFER' AND t.balance_after < t.balance_before")},
+                (ARRAY_AGG(t.balance_after ORDER BY t.created_at DESC, t.id DESC))[1],
+                %(now)s
+            FROM {transactions} AS t {join}
+            WHERE t.status = 'COMPLETED' {condition}
+            GROUP BY 1, 2
+            ON CONFLICT (wallet_id, day) DO UPDATE SET {updates}
+        """
+
+    def refresh(self, wallet_ids=None, limit=None):
+        """
+        Recompute the rollups of up to ``limit`` queued wallet days (only
+        those of ``wallet_ids`` if given) and return how many were done.
+
+        Marks are claimed and deleted first, so the recompute - a later
+        statement with a newer snapshot - sees every transaction whose
+        mark was claimed. Marks of transactions still in flight stay
+        queued for the next refresh.
+        """
+        connection, table, transactions, marks = self._tables()
+        where, params = '', {'limit': limit or settings.ROLLUP_REFRESH_BATCH}
+        if wallet_ids is not None:
+            where, params['wallets'] = 'WHERE wallet_id = ANY(%(wallets)s::uuid[])', [str(pk) for pk in wallet_ids]
+
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(f"""
+                DELETE FROM {marks} WHERE id IN (
+                    SELECT id FROM {marks} {where} ORDER BY id LIMIT %(limit)s FOR UPDATE SKIP LOCKED
+                )
+                RETURNING wallet_id, day
+            """, params)
+            days = sorted(set(cursor.fetchall()))
+            claimed = len(days)
+            if not days:
+                return 0
+            # The marks of wallets that moved to another shard go with them; their rollups are rebuilt there
+            wallets = set(sharding.held_wallets(connection.alias, {wallet_id for wallet_id, _ in days}))
+            days = [(wallet_id, day) for wallet_id, day in days if wallet_id in wallets]
+            cursor.execute(
+                f"SELECT * FROM ({self._archived_sql(connection)}) AS a WHERE wallet_id = ANY(%s::uuid[])",
+                [sorted({str(wallet_id) for wallet_id, _ in days})],
+            )
+            cutoffs = {wallet_id: rollup_day(cutoff) for wallet_id, cutoff in cursor.fetchall()}
+            days = [(wallet_id, day) for wallet_id, day in days if day >= cutoffs.get(wallet_id, day)]
+            if not days:
+                return claimed
+
+            params = {'now': timezone.now()}
+            values = []
+            for index, (wallet_id, day) in enumerate(days):
+                values.append(f"(%(wallet{index})s::uuid, %(day{index})s::date)")
+                params[f'wallet{index}'], params[f'day{index}'] = wallet_id, day
+            values = ', '.join(values)
+            # Days left without completed transactions lose their row
+            cursor.execute(f"DELETE FROM {table} WHERE (wallet_id, day) IN (VALUES {values})", params)
+            # The join's day ranges do not prune partitions; the overall range does
+            first_day, last_day = min(day for _, day in days), max(day for _, day in days)
+            params['since'] = datetime.combine(first_day, time.min, tzinfo=dt_timezone.utc)
+            params['until'] = datetime.combine(last_day + timedelta(days=1), time.min, tzinfo=dt_timezone.utc)
+            cursor.execute(self._aggregate_sql(table, transactions, f"""
+                JOIN (VALUES {values}) AS d (wallet_id, day) ON t.wallet_id = d.wallet_id
+                    AND t.created_at >= d.day::timestamp AT TIME ZONE 'UTC'
+                    AND t.created_at < (d.day + 1)::timestamp AT TIME ZONE 'UTC'
+            """, """
+                AND t.created_at >= %(since)s AND t.created_at < %(until)s
+            """), params)
+        return claimed
+
+    def rebuild(self, wallet_ids=None):
+        """Recompute every rollup (of ``wallet_ids`` if given) from the ledger"""
+        connection, table, transactions, _ = self._tables()
+        where, params = '', {'now': timezone.now()}
+        if wallet_ids is not None:
+            where, params['wallets'] = 'WHERE wallet_id = ANY(%(wallets)s::uuid[])', [str(pk) for pk in wallet_ids]
+
+        archived = self._archived_sql(connection)
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(f"""
+                DELETE FROM {table} AS r {where or 'WHERE TRUE'} AND NOT EXISTS (
+                    SELECT 1 FROM ({archived}) AS a
+                    WHERE a.wallet_id = r.wallet_id AND a.cutoff > r.day::timestamp AT TIME ZONE 'UTC'
+                )
+            """, params)
+            condition = 'AND t.wallet_id = ANY(%(wallets)s::uuid[])' if wallet_ids is not None else ''
+            cursor.execute(self._aggregate_sql(
+                table, transactions, f"LEFT JOIN ({archived}) AS a ON a.wallet_id = t.wallet_id",
+                f"AND (a.cutoff IS NULL OR t.created_at >= a.cutoff) {condition}",
+            ), params)
+            return cursor.rowcount
+
+
+class WalletDailyRollup(models.Model):
+    """
+    Per-wallet, per-day (UTC) totals of completed transactions and the
+    balance after the day's last one. Kept current by
+    ``WalletDailyRollupManager.refresh`` from the queue of
+    ``WalletRollupMark`` rows and rebuildable from the ledger with
+    ``rebuild``; statements read these instead of the transactions.
+    """
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='daily_rollups')
+    day = models.DateField()
+    deposits_total = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    deposits_count = models.PositiveIntegerField(default=0)
+    withdrawals_total = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    withdrawals_count = models.PositiveIntegerField(default=0)
+    transfers_in_total = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    transfers_in_count = models.PositiveIntegerField(default=0)
+    transfers_out_total = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    transfers_out_count = models.PositiveIntegerField(default=0)
+    closing_balance = models.DecimalField(max_digits=15, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = WalletDailyRollupManager()
+
+    class Meta:
+        db_table = 'wallet_daily_rollups'
+        ordering = ['wallet', 'day']
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'day'], name='wallet_daily_rollup_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.wallet_id} {self.day} - {self.closing_balance}"
+
+    @property
+    def net_change(self):
+        return (
+            self.deposits_total - self.withdrawals_total
+            + self.transfers_in_total - self.transfers_out_total
+        )
+
+    @property
+    def transaction_count(self):
+        return self.deposits_count + self.withdrawals_count + self.transfers_in_count + self.transfers_out_count
+
+
+class StatementRun(models.Model):
+    """Month-end statements of every wallet, generated in chunks by ``wallet.statements``"""
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('PROCESSING', 'Processing'),
+        ('COMPLETED', 'Completed'),
+    ]
+
+    period_start = models.DateField(unique=True)
+    period_end = models.DateField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    total_wallets = models.PositiveIntegerField(default=0)
+    processed_wallets = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'statement_runs'
+        ordering = ['-period_start']
+
+    def __str__(self):
+        return f"Statements {self.period_start} - {self.processed_wallets}/{self.total_wallets} {self.status}"
+
+    @property
+    def duration(self):
+        """Seconds from start to completion (or now), including any interruptions"""
+        if self.started_at is None:
+            return None
+        return ((self.completed_at or timezone.now()) - self.started_at).total_seconds()
+
+    @property
+    def throughput(self):
+        """Wallets per second over ``duration``"""
+        duration = self.duration
+        return self.processed_wallets / duration if duration else None
+
+
+class MonthlyStatement(models.Model):
+    """One wallet's statement for the period of a ``StatementRun``"""
+    run = models.ForeignKey(StatementRun, on_delete=models.CASCADE, related_name='statements')
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='statements')
+    period_start = models.DateField()
+    period_end = models.DateField()
+    currency = models.CharField(max_length=3, choices=Wallet.CURRENCY_CHOICES)
+    opening_balance = models.DecimalField(max_digits=15, decimal_places=2)
+    closing_balance = models.DecimalField(max_digits=15, decimal_places=2)
+    deposits_total = models.DecimalField(max_digits=15, decimal_places=2)
+    deposits_count = models.PositiveIntegerField()
+    withdrawals_total = models.DecimalField(max_digits=15, decimal_places=2)
+    withdrawals_count = models.PositiveIntegerField()
+    transfers_in_total = models.DecimalField(max_digits=15, decimal_places=2)
+    transfers_in_count = models.PositiveIntegerField()
+    transfers_out_total = models.DecimalField(max_digits=15, decimal_places=2)
+    transfers_out_count = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'wallet_statements'
+        ordering = ['wallet', '-period_start']
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'period_start'], name='wallet_statement_unique_period'),
+        ]
+
+    def __str__(self):
+        return f"{self.wallet_id} {self.period_start} - {self.closing_balance}"
+
+
+class IdempotencyKey(models.Model):
+    """Idempotency-Key claims and their stored responses"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'idempotency_keys'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_unique_per_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} - {self.status_code or 'in flight'}"
+
+
+class PayoutJob(models.Model):
+    """Bulk credit of many wallets, processed asynchronously in chunks"""
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('PROCESSING', 'Processing'),
+        ('COMPLETED', 'Completed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=new_id, editable=False)
+    created_by = models.ForeignKey(User, on_delete=models.PROTECT, related_name='payout_jobs')
+    description = models.CharField(max_length=255, blank=True)
+    currency = models.CharField(max_length=3, choices=Wallet.CURRENCY_CHOICES, default='USD')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    total_items = models.PositiveIntegerField(default=0)
+    processed_items = models.PositiveIntegerField(default=0)
+    succeeded_items = models.PositiveIntegerField(default=0)
+    failed_items = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'payout_jobs'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Payout {self.id} - {self.processed_items}/{self.total_items} {self.status}"
+
+
+class PayoutItem(models.Model):
+    """One (wallet, amount, reference) row of a payout job"""
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    ]
+
+    job = models.ForeignKey(PayoutJob, on_delete=models.CASCADE, related_name='items')
+    row_number = models.PositiveIntegerField()
+    # Not a foreign key: rows naming unknown wallets are kept and reported as failures
+    wallet_id = models.UUIDField(null=True, blank=True)
+    amount = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+    reference = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    error = models.CharField(max_length=255, blank=True)
+    # Not enforced: the transaction is on the wallet's shard
+    transaction = models.ForeignKey(
+        Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', db_constraint=False
+    )
+
+    class Meta:
+        db_table = 'payout_items'
+        ordering = ['row_number']
+        indexes = [
+            models.Index(fields=['job', 'status', 'row_number'], name='payout_item_job_status_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'row_number'], name='payout_item_unique_row'),
+        ]
+
+    def __str__(self):
+        return f"Row {self.row_number} - {self.amount} - {self.status}"
+
+
+class ShardBucket(models.Model):
+    """The shard holding one bucket of users (see ``wallet.sharding``); only kept on ``default``"""
+    bucket = models.PositiveIntegerField(primary_key=True)
+    shard = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'shard_buckets'
+        ordering = ['bucket']
+
+    def __str__(self):
+        return f"Bucket {self.bucket} - {self.shard}"
+
+
+class ShardFence(models.Model):
+    """
+    A bucket whose wallets this database holds. Writers lock it FOR SHARE
+    and a rebalance FOR UPDATE (see ``wallet.sharding.claim``).
+    """
+    bucket = models.PositiveIntegerField(primary_key=True)
+
+    class Meta:
+        db_table = 'shard_fences'
+
+    def __str__(self):
+        return f"Bucket {self.bucket}"
+
+
+class PurgeCheckpoint(models.Model):
+    """Progress of an unfinished pass of a retention policy on one database (see ``wallet.purge``)"""
+    name = models.CharField(max_length=100, primary_key=True)
+    cutoff = models.DateTimeField()
+    position = models.CharField(max_length=64, blank=True)
+    deleted = models.BigIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'purge_checkpoints'
+
+    def __str__(self):
+        return f"{self.name} - {self.deleted} deleted up to {self.position or 'the start'}"
+
+
+class ArchiveSegment(models.Model):
+    """
+    One wallet's archived transactions: ``length`` bytes at ``offset`` of a
+    segment file in the archive storage (see ``wallet.archive``). Every
+    settled transaction of the wallet before ``cutoff`` has been archived.
+    """
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='archive_segments')
+    path = models.CharField(max_length=255)
+    offset = models.BigIntegerField()
+    length = models.PositiveIntegerField()
+    rows = models.PositiveIntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    cutoff = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'transaction_archive_segments'
+        ordering = ['wallet', 'first_created_at']
+
+    def __str__(self):
+        return f"{self.wallet_id} {self.first_created_at:%Y-%m-%d} to {self.last_created_at:%Y-%m-%d} - {self.rows} rows"
+
+
+class OutboxEventManager(models.Manager):
+    """Manager that queues transaction events in the transaction writing them"""
+
+    def record(self, transactions, event):
+        """Queue ``event`` for each of ``transactions``, in the transaction writing them"""
+        fields = Transaction._meta.concrete_fields
+        self.bulk_create([
+            self.model(
+                event=event, wallet_id=txn.wallet_id,
+                payload=orjson.dumps({field.attname: getattr(txn, field.attname) for field in fields}, default=str).decode(),
+            )
+            for txn in transactions
+        ])
+
+
+class OutboxEvent(models.Model):
+    """
+    A transaction event waiting to be relayed (see ``wallet.outbox``).
+    Written in the database transaction that writes the transaction, so
+    it exists if and only if the transaction committed; the payload holds
+    every column of the transaction, as JSON, so consumers never read it
+    back.
+    """
+    CREATED = 'transaction.created'
+    UPDATED = 'transaction.updated'
+
+    # Time-ordered, so the relay drains events roughly in the order they were written
+    id = models.UUIDField(primary_key=True, default=new_id, editable=False)
+    event = models.CharField(max_length=50)
+    # Not a foreign key, so queueing an event adds no constraint check to the write
+    wallet_id = models.UUIDField()
+    # Only ever passed on, so stored as encoded rather than parsed into jsonb
+    payload = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = OutboxEventManager()
+
+    class Meta:
+        db_table = 'transaction_outbox'
+
+    def __str__(self):
+        return f"{self.event} - {self.wallet_id}"
@@ -0,0 +1,136 @@
+"""
+Transactional outbox for transaction events.
+
+Every transaction written queues an ``OutboxEvent`` in the same database
+transaction (see ``TransactionManager.bulk_create`` and
+``Transaction.save``), so an event exists exactly when its transaction
+committed - unlike a Celery task enqueued inside the atomic block, which
+can run before the commit or survive a rollback. The event's payload is
+the whole transaction row, so consumers never query it back.
+
+The ``relay_outbox`` task drains each shard's outbox in batches of
+OUTBOX_BATCH_SIZE events, one statement per batch:
+
+    WITH batch AS (SELECT id ... ORDER BY id LIMIT n FOR UPDATE SKIP LOCKED)
+    DELETE ... USING batch RETURNING ...
+
+joined to the wallets for their users. It hands the batch, grouped by
+user, to a ``deliver`` callable before committing, so a failed delivery
+leaves the events queued. Concurrent relays skip each other's locked
+events instead of waiting for them. Delivery is at least once: an event
+delivered just before its batch failed to commit is delivered again, and
+consumers recognise it by its ``id``.
+
+Each relayed batch is counted, with its events' delivery lag (time from
+write to dispatch), in the worker's metrics (see ``wallet.metrics``).
+"""
+import logging
+import time
+from collections import namedtuple
+
+import orjson
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import metrics, sharding
+from .models import OutboxEvent, Wallet
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple('Event', ['id', 'event', 'wallet_id', 'user_id', 'payload', 'created_at'])
+
+
+class RelayResult(namedtuple('RelayResult', ['events', 'batches', 'seconds'])):
+
+    @property
+    def events_per_second(self):
+        return self.events / self.seconds if self.seconds else 0.0
+
+
+def _batch_sql(connection, table):
+    qn = connection.ops.quote_name
+    return f"""
+        WITH batch AS (
+            SELECT id FROM {qn(table)} ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED
+        ), events AS (
+            DELETE FROM {qn(table)} AS o USING batch WHERE o.id = batch.id
+            RETURNING o.id, o.event, o.wallet_id, o.payload, o.created_at
+        )
+        SELECT e.id, e.event, e.wallet_id, w.user_id, e.payload, e.created_at
+        FROM events AS e LEFT JOIN {qn(Wallet._meta.db_table)} AS w ON w.id = e.wallet_id
+        ORDER BY e.id
+    """
+
+
+def message(event):
+    """JSON-ready form of an event, as consumers receive it"""
+    return {
+        'id': str(event.id),
+        'event': event.event,
+        'wallet_id': str(event.wallet_id),
+        'created_at': event.created_at.isoformat(),
+        'transaction': event.payload,
+    }
+
+
+def by_user(events):
+    """``{user id: [messages]}`` of a batch, each user's in the order they were written"""
+    groups = {}
+    for event in events:
+        groups.setdefault(str(event.user_id) if event.user_id else None, []).append(message(event))
+    return groups
+
+
+def relay_batch(using, deliver, batch_size=None, table=OutboxEvent._meta.db_table):
+    """Take up to ``batch_size`` events off ``using``'s outbox and deliver them; returns the events"""
+    connection = connections[using]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(_batch_sql(connection, table), [batch_size or settings.OUTBOX_BATCH_SIZE])
+        events = [Event(*row[:4], orjson.loads(row[4]), row[5]) for row in cursor.fetchall()]
+        # Events of wallets that moved to another shard were copied there with them and are relayed there
+        users = sharding.held(using, {event.user_id for event in events if event.user_id})
+        events = [event for event in events if event.user_id is None or event.user_id in users]
+        if events:
+            deliver(by_user(events))
+    if events:
+        now = timezone.now()
+        metrics.observe_relay([(now - event.created_at).total_seconds() for event in events])
+    return events
+
+
+def relay(using, deliver, batch_size=None, max_seconds=None, table=OutboxEvent._meta.db_table):
+    """Relay ``using``'s outbox until it is empty or ``max_seconds`` have passed; returns a RelayResult"""
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    max_seconds = settings.OUTBOX_RELAY_MAX_SECONDS if max_seconds is None else max_seconds
+    started = time.monotonic()
+    relayed = batches = 0
+    while True:
+        events = relay_batch(using, deliver, batch_size, table)
+        if events:
+            relayed, batches = relayed + len(events), batches + 1
+        # A short batch emptied the outbox, or left only events other relays hold
+        if len(events) < batch_size or time.monotonic() - started >= max_seconds:
+            break
+
+    result = RelayResult(relayed, batches, time.monotonic() - started)
+    if relayed:
+        logger.info(
+            "Relayed %d outbox events on %s in %d batches (%.0f events/s)",
+            relayed, using, batches, result.events_per_second,
+        )
+    return result
+
+
+def backlog():
+    """``{shard: (events waiting, age in seconds of the oldest)}``"""
+    waiting = {}
+    now = timezone.now()
+    for shard in sharding.each_shard():
+        with connections[shard].cursor() as cursor:
+            cursor.execute(
+                f"SELECT count(*), min(created_at) FROM {connections[shard].ops.quote_name(OutboxEvent._meta.db_table)}"
+            )
+            count, oldest = cursor.fetchone()
+        waiting[shard] = (count, (now - oldest).total_seconds() if oldest else 0.0)
+    return waiting
@@ -0,0 +1,205 @@
+"""
+Keyset pagination for transaction history.
+
+Page-number pagination runs COUNT(*) on every page and skips rows with
+OFFSET, so it gets slower the deeper a client pages. Keyset pages carry
+the (created_at, id) of the row they stopped at in an opaque cursor and
+fetch the next page with a row comparison on it, which Postgres answers
+with a range scan of the (wallet, created_at, id) index regardless of
+depth. There is no total count. The row comparison is repeated as a bound
+on created_at alone, which Postgres can use to skip the monthly
+partitions past the cursor (see wallet.partitions).
+
+Views whose history may reach into cold storage set ``archived`` (a
+``wallet.archive.ArchivedTransactions``) and both paginators merge its
+rows into their pages by (created_at, id).
+"""
+import base64
+import heapq
+import json
+import uuid
+from itertools import islice
+
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .archive import row_key
+
+
+def seek(queryset, position=None, reverse=False):
+    """
+    ``queryset`` from just past ``position``, a (created_at, id): older rows
+    newest first, or newer rows oldest first if ``reverse``.
+    """
+    if position is None:
+        return queryset.order_by('-created_at', '-id')
+    table = queryset.model._meta.db_table
+    operator = '>' if reverse else '<'
+    comparison = RawSQL(
+        f'("{table}"."created_at", "{table}"."id") {operator} (%s, %s)', position, output_field=BooleanField()
+    )
+    if reverse:
+        return queryset.filter(comparison, created_at__gte=position[0]).order_by('created_at', 'id')
+    return queryset.filter(comparison, created_at__lte=position[0]).order_by('-created_at', '-id')
+
+
+class KeysetPagination(BasePagination):
+    """Newest-first pages over (created_at, id) addressed by opaque cursors"""
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        position, reverse = self.decode_cursor(request)
+
+        queryset = seek(queryset, position, reverse)
+
+        # One extra row tells whether there is a page beyond this one
+        results = list(queryset[:self.page_size + 1])
+        archived = getattr(view, 'archived', None)
+        if archived is not None:
+            results = self.merge_archived(results, archived, position, reverse)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        if results:
+            first, last = results[0], results[-1]
+            self.next_position = (last.created_at, last.id) if has_more or reverse else None
+            self.previous_position = (first.created_at, first.id) if position and (has_more or not reverse) else None
+        else:
+            self.next_position = self.previous_position = None
+        return results
+
+    def merge_archived(self, results, archived, position, reverse):
+        """The page's rows with the archived ones that belong on it merged in"""
+        # A full page only takes archived rows from before its last row
+        limit = row_key(results[-1]) if len(results) > self.page_size else None
+        if reverse:
+            rows = archived.rows(after=position, before=limit, descending=False)
+        else:
+            rows = archived.rows(after=limit, before=position, descending=True)
+        rows = list(islice(rows, self.page_size + 1))
+        if not rows:
+            return results
+        return list(heapq.merge(results, rows, key=row_key, reverse=not reverse))[:self.page_size + 1]
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def decode_cursor(self, request):
+        """Return ``((created_at, id), reverse)``, or ``(None, False)`` for the first page"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            created_at = parse_datetime(data['t'])
+            if created_at is None:
+                raise ValueError(data['t'])
+            return (created_at, uuid.UUID(data['i'])), bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position, reverse):
+        created_at, pk = position
+        data = {'t': created_at.isoformat(), 'i': str(pk)}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode('ascii').rstrip('=')
+        return replace_query_param(remove_query_param(self.base_url, 'page'), self.cursor_query_param, encoded)
+
+
+class MergedHistory:
+    """
+    A newest-first history queryset and its archived rows, as the sliceable
+    sequence Django's Paginator takes.
+
+    A page seeks to the end of the newest segment it does not reach past,
+    found by binary search on the rows created after each segment's end:
+    a COUNT of the table's and the segments' row counts. It then merges
+    from there, so it reads at most one segment's span of rows before it
+    rather than every row of the history. Pages before the newest segment
+    hold table rows only and skip them with OFFSET.
+    """
+    # Sorts after every id, so (moment, LAST_ID) bounds rows created up to moment
+    LAST_ID = uuid.UUID(int=(1 << 128) - 1)
+
+    def __init__(self, queryset, archived):
+        self.queryset = queryset
+        self.archived = archived
+
+    def count(self):
+        return self.queryset.count() + self.archived.count()
+
+    def newer(self, moment):
+        """How many rows were created after ``moment``"""
+        return self.queryset.filter(created_at__gt=moment).count() + self.archived.count(since=moment)
+
+    def seek(self, start):
+        """``(moment, rows created after it)`` of the oldest segment end with at most ``start`` rows after it"""
+        ends = sorted({segment.last_created_at for segment in self.archived.segments}, reverse=True)
+        found, low, high = (None, 0), 0, len(ends)
+        while low < high:
+            middle = (low + high) // 2
+            newer = self.newer(ends[middle])
+            if newer <= start:
+                found, low = (ends[middle], newer), middle + 1
+            else:
+                high = middle
+        return found
+
+    def __getitem__(self, index):
+        start, size = index.start or 0, index.stop - (index.start or 0)
+        moment, skipped = self.seek(start)
+        if moment is None:
+            # Every row before the page is newer than all the archived ones
+            table, archived, skip = self.queryset[start:index.stop], self.archived.rows(), 0
+        else:
+            skip = start - skipped
+            table = self.queryset.filter(created_at__lte=moment)[:skip + size]
+            archived = self.archived.rows(before=(moment, self.LAST_ID))
+        rows = heapq.merge(table, islice(archived, skip + size), key=row_key, reverse=True)
+        return list(islice(rows, skip, skip + size))
+
+
+class TransactionPagination(PageNumberPagination):
+    """Page numbers by default; keyset pages once a ``cursor`` parameter is sent"""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if KeysetPagination.cursor_query_param in request.query_params:
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        archived = getattr(view, 'archived', None)
+        if archived is not None:
+            queryset = MergedHistory(queryset, archived)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,245 @@
+"""
+Monthly range partitions of the ``transactions`` table.
+
+``transactions`` is partitioned by ``created_at``, one partition per UTC
+month (``transactions_y2026m10``) plus ``transactions_default`` for rows
+no month partition covers. Queries that bound ``created_at`` - history
+pages, date filters, rollup refreshes, the cleanup task - only read the
+partitions of the months they span, and each partition is vacuumed and
+indexed on its own.
+
+The ``maintain_transaction_partitions`` task creates the partitions of
+the next TRANSACTION_PARTITIONS_AHEAD months ahead of time and, with
+TRANSACTION_RETENTION_MONTHS set, detaches (or drops, with
+TRANSACTION_PARTITION_EXPIRY = 'drop') the partitions of older months
+instead of deleting their rows one by one. Months whose COMPLETED
+transactions have not been archived (ARCHIVE_AFTER_DAYS) are kept;
+archive segments and daily rollups are never expired.
+
+A partitioned table's primary key must contain the partition key, so the
+primary key in the database is ``(id, created_at)``; ids stay unique as
+they are generated.
+"""
+import logging
+import re
+from datetime import date, datetime, time, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'transactions'
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+_MONTH = re.compile(r'_y(\d{4})m(\d{2})$')
+
+
+def month_start(moment):
+    """First day of the month of a date or datetime"""
+    return date(moment.year, moment.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month, table=TABLE):
+    return f'{table}_y{month.year}m{month.month:02d}'
+
+
+def month_bound(month):
+    """Midnight UTC starting ``month``, where its partition begins"""
+    return datetime.combine(month, time.min, tzinfo=dt_timezone.utc)
+
+
+def is_partitioned(connection, table=TABLE):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def month_partitions(connection, table=TABLE):
+    """``{month: partition name}`` of the month partitions attached to ``table``"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(%s)
+        """, [table])
+        names = [row[0] for row in cursor.fetchall()]
+    months = {}
+    for name in names:
+        match = _MONTH.search(name)
+        if match and name.startswith(f'{table}_'):
+            months[date(int(match[1]), int(match[2]), 1)] = name
+    return months
+
+
+def create_partition(connection, month, table=TABLE):
+    """
+    Attach the partition of ``month`` to ``table``, moving in the rows the
+    default partition holds for it. Returns False if it already existed.
+    """
+    name = partition_name(month, table)
+    qn = connection.ops.quote_name
+    lower, upper = month_bound(month), month_bound(add_months(month, 1))
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+        if cursor.fetchone()[0]:
+            return False
+        cursor.execute(f"CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        # Rows written while the partition was missing
+        cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM {qn(f'{table}_default')} WHERE created_at >= %s AND created_at < %s RETURNING *
+            )
+            INSERT INTO {qn(name)} SELECT * FROM moved
+        """, [lower, upper])
+        cursor.execute(
+            f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} FOR VALUES FROM (%s) TO (%s)", [lower, upper]
+        )
+    return True
+
+
+def create_partitions(connection, first, last, table=TABLE):
+    """Create the partitions of the months from ``first`` to ``last``; returns the names of the new ones"""
+    created = []
+    month = month_start(first)
+    while month <= last:
+        if create_partition(connection, month, table):
+            created.append(partition_name(month, table))
+        month = add_months(month, 1)
+    return created
+
+
+def ensure_partitions(connection, today=None, ahead=None):
+    """Partitions of the current month and the next ``ahead`` (TRANSACTION_PARTITIONS_AHEAD) months"""
+    current = month_start(today or timezone.now())
+    ahead = settings.TRANSACTION_PARTITIONS_AHEAD if ahead is None else ahead
+    return create_partitions(connection, current, add_months(current, ahead))
+
+
+def expire_partitions(connection, today=None, keep=None, drop=None):
+    """
+    Detach, or drop, the partitions of months before the last ``keep``
+    (TRANSACTION_RETENTION_MONTHS; never when 0). Returns their names.
+
+    Rows of those months stranded in the default partition are moved into
+    partitions of their own first, so they expire with their months. A
+    month still holding COMPLETED transactions is kept: they are history
+    and balances that only archiving (see ``wallet.archive``) may move out
+    of the table, so expiry only removes the rest of a month.
+    """
+    keep = settings.TRANSACTION_RETENTION_MONTHS if keep is None else keep
+    if not keep:
+        return []
+    drop = settings.TRANSACTION_PARTITION_EXPIRY == 'drop' if drop is None else drop
+    cutoff = add_months(month_start(today or timezone.now()), -keep + 1)
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC')::date
+            FROM {qn(DEFAULT_PARTITION)} WHERE created_at < %s
+        """, [month_bound(cutoff)])
+        stranded = [row[0] for row in cursor.fetchall()]
+    for month in stranded:
+        create_partition(connection, month)
+
+    from .models import Wallet
+
+    expired = []
+    for month, name in sorted(month_partitions(connection).items()):
+        if month >= cutoff:
+            break
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {qn(name)} WHERE status = 'COMPLETED')")
+            if cursor.fetchone()[0]:
+                logger.warning("Kept expired partition %s: it holds COMPLETED transactions not archived yet", name)
+                continue
+            cursor.execute(f"ALTER TABLE {qn(TABLE)} DETACH PARTITION {qn(name)}")
+            # The month's rows leave the histories of their wallets with it
+            cursor.execute(f"SELECT DISTINCT wallet_id FROM {qn(name)}")
+            Wallet.objects.db_manager(connection.alias).bump_history([row[0] for row in cursor.fetchall()])
+            if drop:
+                cursor.execute(f"DROP TABLE {qn(name)}")
+        expired.append(name)
+    return expired
+
+
+def add_index(schema_editor, model, index):
+    """
+    Build ``index`` (a plain index on fields) on ``model``'s table without
+    holding off writes while it builds: on a partitioned table it is created
+    on the parent only, then concurrently on each partition and attached.
+    Run outside a transaction.
+    """
+    connection = schema_editor.connection
+    table = model._meta.db_table
+    if not is_partitioned(connection, table):
+        schema_editor.execute(index.create_sql(model, schema_editor, concurrently=True))
+        return
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(model._meta.get_field(name).column) for name in index.fields)
+    schema_editor.execute(f"CREATE INDEX {qn(index.name)} ON ONLY {qn(table)} ({columns})")
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(%s)", [table])
+        children = [row[0] for row in cursor.fetchall()]
+    for child in children:
+        name = f'{child}_{index.name}'[:connection.ops.max_name_length()]
+        schema_editor.execute(f"CREATE INDEX CONCURRENTLY {qn(name)} ON {qn(child)} ({columns})")
+        # The parent's index is valid once every partition's is attached
+        schema_editor.execute(f"ALTER INDEX {qn(index.name)} ATTACH PARTITION {qn(name)}")
+
+
+def convert(connection, partitioned=True, ahead=None):
+    """
+    Rebuild ``transactions`` as a partitioned table (or back into a plain
+    one) holding the same rows, indexes and foreign keys. Run in a
+    transaction: the table is locked for writes until it commits.
+    """
+    qn = connection.ops.quote_name
+    old = f'{TABLE}_unpartitioned' if partitioned else f'{TABLE}_partitioned'
+    with connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {qn(TABLE)} IN ACCESS EXCLUSIVE MODE")
+        # Deferred foreign key checks of rows written earlier in the transaction must not outlive the old table
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        # Partitions carry copies of the parent's indexes; the definitions to recreate are the parent's
+        cursor.execute("""
+            SELECT pg_get_indexdef(i.indexrelid) FROM pg_index AS i
+            WHERE i.indrelid = to_regclass(%s) AND NOT i.indisprimary
+            AND NOT EXISTS (SELECT 1 FROM pg_constraint AS c WHERE c.conindid = i.indexrelid)
+        """, [TABLE])
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""
+            SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = to_regclass(%s) AND contype IN ('f', 'u')
+        """, [TABLE])
+        constraints = cursor.fetchall()
+        cursor.execute(f"SELECT min(created_at) FROM {qn(TABLE)}")
+        oldest = cursor.fetchone()[0]
+
+        cursor.execute(f"ALTER TABLE {qn(TABLE)} RENAME TO {qn(old)}")
+        cursor.execute(
+            f"CREATE TABLE {qn(TABLE)} (LIKE {qn(old)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            + (" PARTITION BY RANGE (created_at)" if partitioned else "")
+        )
+        if partitioned:
+            cursor.execute(f"CREATE TABLE {qn(DEFAULT_PARTITION)} PARTITION OF {qn(TABLE)} DEFAULT")
+            today = month_start(timezone.now())
+            ahead = settings.TRANSACTION_PARTITIONS_AHEAD if ahead is None else ahead
+            create_partitions(connection, min(month_start(oldest or today), today), add_months(today, ahead))
+        cursor.execute(f"INSERT INTO {qn(TABLE)} SELECT * FROM {qn(old)}")
+        cursor.execute(f"DROP TABLE {qn(old)}")
+
+        primary_key = '(id, created_at)' if partitioned else '(id)'
+        cursor.execute(f"ALTER TABLE {qn(TABLE)} ADD CONSTRAINT {qn(f'{TABLE}_pkey')} PRIMARY KEY {primary_key}")
+        for name, definition in constraints:
+            cursor.execute(f"ALTER TABLE {qn(TABLE)} ADD CONSTRAINT {qn(name)} {definition}")
+        for definition in indexes:
+            cursor.execute(definition)
+        # Django's foreign keys are all INITIALLY DEFERRED
+        cursor.execute("SET CONSTRAINTS ALL DEFERRED")
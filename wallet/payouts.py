@@ -0,0 +1,242 @@
+"""
+Bulk payouts.
+
+A payout job is a list of (wallet, amount, reference) rows stored as
+PayoutItem rows and credited asynchronously in chunks by the Celery
+tasks in ``wallet.tasks``. Each chunk is one database transaction: one
+set-based UPDATE ... FROM (VALUES ...) for the balances, one bulk insert
+for the Transaction rows and one more UPDATE ... FROM (VALUES ...) for
+the items, so a retried chunk either ran completely or not at all.
+
+With several shards the credits of each shard are a transaction of that
+shard, committed before the items are. Each item's Transaction has an id
+derived from the item, so a chunk retried after a shard committed finds
+those credits and only records them.
+"""
+import csv
+import io
+import uuid
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import sharding
+from .ids import derived_id
+from .models import PayoutItem, PayoutJob, Transaction, Wallet
+
+MAX_AMOUNT = Decimal('10000000000000')  # max_digits=15, decimal_places=2
+
+
+class PayoutFormatError(ValueError):
+    """Raised when a payout upload cannot be read as rows at all"""
+
+
+def read_csv_rows(upload):
+    """Read payout rows from an uploaded CSV file with a wallet,amount,reference header"""
+    try:
+        text = upload.read().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise PayoutFormatError("CSV file must be UTF-8 encoded")
+    reader = csv.DictReader(io.StringIO(text))
+    missing = {'wallet', 'amount'} - set(reader.fieldnames or [])
+    if missing:
+        raise PayoutFormatError(f"CSV file is missing columns: {', '.join(sorted(missing))}")
+    return list(reader)
+
+
+def build_item(row_number, row):
+    """Validate one raw row into an unsaved PayoutItem; bad rows come back FAILED"""
+    if not isinstance(row, dict):
+        return PayoutItem(row_number=row_number, status='FAILED', error='Row must be an object')
+
+    item = PayoutItem(row_number=row_number, reference=str(row.get('reference') or '')[:100])
+    try:
+        item.wallet_id = uuid.UUID(str(row.get('wallet', '')))
+    except ValueError:
+        item.status, item.error = 'FAILED', 'Invalid wallet id'
+        return item
+
+    try:
+        amount = Decimal(str(row.get('amount', '')))
+    except InvalidOperation:
+        item.status, item.error = 'FAILED', 'Invalid amount'
+        return item
+    if not amount.is_finite() or amount <= 0 or amount >= MAX_AMOUNT or amount.as_tuple().exponent < -2:
+        item.status, item.error = 'FAILED', 'Amount must be positive with at most 2 decimal places'
+        return item
+    item.amount = amount
+    return item
+
+
+def create_job(user, rows, description='', currency='USD'):
+    """Store rows as a payout job; rows that fail validation are recorded as failures"""
+    if not isinstance(rows, list) or not rows:
+        raise PayoutFormatError("Provide a non-empty list of payout rows")
+    if len(rows) > settings.PAYOUT_MAX_ITEMS:
+        raise PayoutFormatError(f"A payout job can contain at most {settings.PAYOUT_MAX_ITEMS} rows")
+
+    items = [build_item(row_number, row) for row_number, row in enumerate(rows, start=1)]
+    failed = sum(1 for item in items if item.status == 'FAILED')
+
+    with transaction.atomic():
+        job = PayoutJob.objects.create(
+            created_by=user,
+            description=description,
+            currency=currency,
+            total_items=len(items),
+            processed_items=failed,
+            failed_items=failed,
+        )
+        for item in items:
+            item.job = job
+        PayoutItem.objects.bulk_create(items, batch_size=5000)
+        if failed == len(items):
+            job.status, job.completed_at = 'COMPLETED', timezone.now()
+            job.save(update_fields=['status', 'completed_at'])
+    return job
+
+
+def chunk_bounds(job_id, chunk_size):
+    """Split the pending items of a job into (first_id, last_id) ranges"""
+    ids = list(
+        PayoutItem.objects.filter(job_id=job_id, status='PENDING')
+        .order_by('id').values_list('id', flat=True)
+    )
+    return [
+        (ids[start], ids[min(start + chunk_size, len(ids)) - 1])
+        for start in range(0, len(ids), chunk_size)
+    ]
+
+
+def save_outcomes(items):
+    """Write status, error and transaction of many items with one UPDATE ... FROM (VALUES ...)"""
+    connection = connections[router.db_for_write(PayoutItem)]
+    table = connection.ops.quote_name(PayoutItem._meta.db_table)
+    values = ', '.join(['(%s::bigint, %s, %s, %s::uuid)'] * len(items))
+    sql = f"""
+        UPDATE {table} AS p
+        SET status = v.status, error = v.error, transaction_id = v.transaction_id
+        FROM (VALUES {values}) AS v (id, status, error, transaction_id)
+        WHERE p.id = v.id
+    """
+    params = [
+        value for item in items
+        for value in (item.pk, item.status, item.error, item.transaction_id)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def transaction_id(job, item):
+    """Id of the Transaction crediting ``item``, the same on every attempt"""
+    return derived_id(job.created_at, item.pk)
+
+
+def credit_shard(job, items, shard):
+    """
+    Credit the pending ``items`` whose wallets are on ``shard`` in one
+    transaction there. Returns the ids of the wallets found.
+    """
+    with sharding.use_shard(shard), transaction.atomic(using=shard):
+        wallets = {
+            wallet['id']: wallet
+            for wallet in Wallet.objects.filter(id__in={item.wallet_id for item in items})
+            .values('id', 'user_id', 'currency', 'is_active')
+        }
+        if not wallets:
+            return set()
+        sharding.claim(shard, *{wallet['user_id'] for wallet in wallets.values()})
+
+        items = [item for item in items if item.wallet_id in wallets]
+        ids = {item.pk: transaction_id(job, item) for item in items}
+        # Credited by an earlier attempt whose outcomes were not saved
+        done = set(Transaction.objects.filter(id__in=ids.values()).values_list('id', flat=True))
+        credits = defaultdict(Decimal)
+        for item in items:
+            wallet = wallets[item.wallet_id]
+            if ids[item.pk] in done:
+                item.status, item.transaction_id = 'COMPLETED', ids[item.pk]
+            elif not wallet['is_active']:
+                item.status, item.error = 'FAILED', 'Wallet is inactive'
+            elif wallet['currency'] != job.currency:
+                item.status, item.error = 'FAILED', f"Currency mismatch. Wallet currency is {wallet['currency']}"
+            else:
+                credits[item.wallet_id] += item.amount
+
+        balances = Wallet.objects.apply_bulk_credit(credits) if credits else {}
+
+        # Replay each wallet's credits in row order to get per-row balances
+        running = {
+            wallet_id: balances[wallet_id] - total
+            for wallet_id, total in credits.items() if wallet_id in balances
+        }
+        transactions = []
+        for item in items:
+            if item.status != 'PENDING':
+                continue
+            if item.wallet_id not in running:
+                item.status, item.error = 'FAILED', 'Wallet not found'
+                continue
+            balance_before = running[item.wallet_id]
+            running[item.wallet_id] = balance_before + item.amount
+            item.transaction = Transaction(
+                id=ids[item.pk],
+                wallet_id=item.wallet_id,
+                transaction_type='DEPOSIT',
+                amount=item.amount,
+                currency=job.currency,
+                status='COMPLETED',
+                description=f"{job.description} [{item.reference}]" if item.reference else job.description,
+                balance_before=balance_before,
+                balance_after=running[item.wallet_id],
+            )
+            item.status = 'COMPLETED'
+            transactions.append(item.transaction)
+
+        Transaction.objects.bulk_create(transactions)
+    return set(wallets)
+
+
+def process_chunk(job_id, first_item_id, last_item_id):
+    """
+    Credit the pending items of one chunk. Returns ``(succeeded, failed)``.
+
+    Only PENDING items are picked up, so running a chunk twice is a no-op.
+    """
+    job = PayoutJob.objects.only('id', 'currency', 'description', 'created_at').get(id=job_id)
+
+    with transaction.atomic():
+        items = list(
+            PayoutItem.objects.select_for_update()
+            .filter(job_id=job_id, id__gte=first_item_id, id__lte=last_item_id, status='PENDING')
+            .order_by('id')
+        )
+        if not items:
+            return 0, 0
+
+        pending = items
+        for shard in sharding.each_shard():
+            if pending:
+                found = credit_shard(job, pending, shard)
+                pending = [item for item in pending if item.wallet_id not in found]
+        for item in pending:
+            item.status, item.error = 'FAILED', 'Wallet not found'
+        save_outcomes(items)
+
+        succeeded = sum(1 for item in items if item.status == 'COMPLETED')
+        failed = len(items) - succeeded
+        PayoutJob.objects.filter(id=job_id).update(
+            processed_items=F('processed_items') + len(items),
+            succeeded_items=F('succeeded_items') + succeeded,
+            failed_items=F('failed_items') + failed,
+        )
+
+    # Whichever chunk finishes last completes the job
+    PayoutJob.objects.filter(
+        id=job_id, status='PROCESSING', processed_items__gte=F('total_items')
+    ).update(status='COMPLETED', completed_at=timezone.now())
+    return succeeded, failed
@@ -0,0 +1,67 @@
+"""
+values()-based fast path for read-only list endpoints.
+
+A ``ModelSerializer`` walks a tree of field objects for every row it
+renders. For flat, read-only lists a ``Projection`` derives the columns
+from the serializer once, fetches them with ``values_list()`` and turns
+each row into a dict with a function generated for that serializer (a
+single dict literal indexing into the row). Decimals become strings as
+``DecimalField`` renders them; UUIDs and datetimes are left for
+``wallet.renderers`` to encode, so the output matches the serializer's.
+
+Supported fields are model fields (foreign keys render as their id) and
+``get_<field>_display`` labels of choice fields.
+"""
+import re
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import models
+from rest_framework.settings import api_settings
+
+_DISPLAY_SOURCE = re.compile(r'^get_(\w+)_display$')
+
+
+class Projection:
+    """Columns and a compiled row-to-dict mapper derived from a ModelSerializer"""
+
+    def __init__(self, serializer_class):
+        model = serializer_class.Meta.model
+        self.columns = []
+        self.names = []
+        labels = {}
+        items = []
+        for name, field in serializer_class().fields.items():
+            match = _DISPLAY_SOURCE.match(field.source)
+            model_field = self._model_field(model, match.group(1) if match else field.source, serializer_class)
+            if model_field.attname not in self.columns:
+                self.columns.append(model_field.attname)
+            index = self.columns.index(model_field.attname)
+            self.names.append(name)
+            if match:
+                labels[name] = {value: str(label) for value, label in model_field.flatchoices}
+                items.append(f"{name!r}: _labels[{name!r}].get(row[{index}], row[{index}])")
+            elif isinstance(model_field, models.DecimalField) and api_settings.COERCE_DECIMAL_TO_STRING:
+                # Stored with the field's scale, so str() matches DecimalField's quantized output
+                items.append(f"{name!r}: None if row[{index}] is None else str(row[{index}])")
+            else:
+                items.append(f"{name!r}: row[{index}]")
+
+        source = f"lambda row: {{{', '.join(items)}}}"
+        self.map_row = eval(source, {'_labels': labels})
+
+    @staticmethod
+    def _model_field(model, name, serializer_class):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            field = None
+        if field is None or not field.concrete:
+            raise ImproperlyConfigured(f"{serializer_class.__name__} field '{name}' cannot be projected")
+        return field
+
+    def queryset(self, queryset):
+        """Fetch only the projected columns, as named rows (so paginators can read them)"""
+        return queryset.values_list(*self.columns, named=True)
+
+    def map_rows(self, rows):
+        return list(map(self.map_row, rows))
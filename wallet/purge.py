@@ -0,0 +1,131 @@
+"""
+Batched, resumable deletes for retention policies.
+
+A ``Policy`` names a table and the SQL condition (on ``%(cutoff)s``, the
+policy's ``retention`` before now) of the rows it expires. ``run()``
+deletes them in primary key order, PURGE_BATCH_SIZE rows per statement
+and transaction:
+
+    WITH batch AS (SELECT pk ... WHERE <condition> AND pk > <position>
+                   ORDER BY pk LIMIT <size>)
+    DELETE FROM <table> WHERE pk IN (SELECT pk FROM batch) AND <condition>
+
+so no batch holds locks or builds WAL for more than a bounded number of
+rows and nothing is loaded into Python. It sleeps PURGE_BATCH_PAUSE
+seconds between batches to leave the database to other traffic, and
+stops after PURGE_MAX_SECONDS.
+
+After each batch the position reached is saved in a ``PurgeCheckpoint``
+on ``default``. A pass that stopped early or was interrupted resumes
+from there, with the cutoff it started with, the next time it runs; a
+finished pass deletes its checkpoint. Rerunning a batch is harmless,
+so concurrent runs of a policy only waste work.
+
+Deletes are raw SQL: signals do not fire and Django does not cascade,
+so policies must only cover rows nothing else points at (or that the
+database itself cascades to). A policy with a ``wallet_column`` moves on
+the history version of the wallets of each batch in its transaction.
+"""
+import logging
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import IdempotencyKey, PurgeCheckpoint, Transaction, Wallet
+
+logger = logging.getLogger(__name__)
+
+Policy = namedtuple('Policy', ['name', 'model', 'condition', 'retention', 'wallet_column'], defaults=[None])
+
+
+class PurgeResult(namedtuple('PurgeResult', ['deleted', 'batches', 'seconds', 'finished'])):
+
+    @property
+    def rows_per_second(self):
+        return self.deleted / self.seconds if self.seconds else 0.0
+
+
+FAILED_TRANSACTIONS = Policy(
+    'failed-transactions', Transaction, "status = 'FAILED' AND created_at < %(cutoff)s", timedelta(days=30),
+    'wallet_id',
+)
+EXPIRED_IDEMPOTENCY_KEYS = Policy(
+    'expired-idempotency-keys', IdempotencyKey, "expires_at < %(cutoff)s", timedelta(0),
+)
+
+POLICIES = {policy.name: policy for policy in [FAILED_TRANSACTIONS, EXPIRED_IDEMPOTENCY_KEYS]}
+
+
+def _batch_sql(connection, policy, resume):
+    qn = connection.ops.quote_name
+    table, pk = qn(policy.model._meta.db_table), qn(policy.model._meta.pk.column)
+    after = f"AND {pk} > %(position)s" if resume else ""
+    wallets = f"array_agg(DISTINCT {qn(policy.wallet_column)})" if policy.wallet_column else "NULL"
+    returning = qn(policy.wallet_column) if policy.wallet_column else "1"
+    return f"""
+        WITH batch AS (
+            SELECT {pk} FROM {table} WHERE {policy.condition} {after} ORDER BY {pk} LIMIT %(limit)s
+        ), deleted AS (
+            DELETE FROM {table} WHERE {pk} IN (SELECT {pk} FROM batch) AND {policy.condition}
+            RETURNING {returning}
+        )
+        SELECT (SELECT count(*) FROM deleted), (SELECT {pk} FROM batch ORDER BY {pk} DESC LIMIT 1),
+            (SELECT {wallets} FROM deleted)
+    """
+
+
+def run(policy, using=DEFAULT_DB_ALIAS, batch_size=None, pause=None, max_seconds=None):
+    """Delete ``policy``'s expired rows from ``using`` until done or out of time; returns a PurgeResult"""
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    pause = settings.PURGE_BATCH_PAUSE if pause is None else pause
+    max_seconds = settings.PURGE_MAX_SECONDS if max_seconds is None else max_seconds
+
+    name = f'{policy.name}:{using}'
+    checkpoint, _ = PurgeCheckpoint.objects.using(DEFAULT_DB_ALIAS).get_or_create(
+        name=name, defaults={'cutoff': timezone.now() - policy.retention},
+    )
+    params = {'cutoff': checkpoint.cutoff, 'position': checkpoint.position, 'limit': batch_size}
+    connection = connections[using]
+    started = time.monotonic()
+    deleted = batches = 0
+    finished = False
+    while True:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(_batch_sql(connection, policy, bool(params['position'])), params)
+            count, last, wallet_ids = cursor.fetchone()
+            if wallet_ids:
+                Wallet.objects.db_manager(using).bump_history(wallet_ids)
+        if last is None:
+            finished = True
+            break
+        deleted, batches, params['position'] = deleted + count, batches + 1, str(last)
+        PurgeCheckpoint.objects.using(DEFAULT_DB_ALIAS).filter(name=name).update(
+            position=params['position'], deleted=F('deleted') + count,
+        )
+        if time.monotonic() - started >= max_seconds:
+            break
+        time.sleep(pause)
+
+    if finished:
+        PurgeCheckpoint.objects.using(DEFAULT_DB_ALIAS).filter(name=name).delete()
+    result = PurgeResult(deleted, batches, time.monotonic() - started, finished)
+    logger.info(
+        "Purged %d rows of %s on %s in %d batches (%.0f rows/s)%s", deleted, policy.name, using,
+        batches, result.rows_per_second, '' if finished else ', resuming next run',
+    )
+    return result
+
+
+def describe(results):
+    """One line summing up the PurgeResults of a policy's runs"""
+    deleted = sum(result.deleted for result in results)
+    seconds = sum(result.seconds for result in results)
+    line = f"{deleted} rows, {deleted / seconds if seconds else 0:.0f} rows/s"
+    if not all(result.finished for result in results):
+        line += ', resuming next run'
+    return line
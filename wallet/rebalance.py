@@ -0,0 +1,255 @@
+"""
+Moving buckets of users between shards while they are in use.
+
+``move_bucket`` moves one bucket (see ``wallet.sharding``):
+
+1. lock the bucket's fence on the source FOR UPDATE; writes to the
+   bucket now wait, everything else carries on
+2. copy the bucket's users, wallets, balance slots, transactions,
+   archive segments, outbox events, statements and idempotency keys to
+   the target and rebuild their rollups there, in one transaction,
+   reading the source in one REPEATABLE READ snapshot taken once the
+   fence is held
+3. delete the source fence and commit; waiting writers find the fence
+   gone and reload the map
+4. point the map at the target and put the fence there
+5. after ``drain`` seconds, once every process has reloaded the map,
+   delete the bucket's rows from the source
+
+Only step 2 holds up writes, for the time it takes to copy 1/1024 of the
+data. An interrupted move is finished by running it again: a source
+without the fence has not been written to since its copy started, and a
+bucket already mapped to the target only has its leftovers removed.
+"""
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Count, IntegerField, Sum
+from django.db.models.expressions import RawSQL
+
+from . import sharding
+from .models import (
+    ArchiveSegment, IdempotencyKey, MonthlyStatement, OutboxEvent, ShardBucket, ShardFence, StatementRun,
+    Transaction, User, Wallet, WalletBalanceSlot, WalletDailyRollup, WalletRollupMark,
+)
+
+COPY_BATCH = 5000
+
+
+def _wallets_sql(connection):
+    return (
+        f"SELECT id FROM {connection.ops.quote_name(Wallet._meta.db_table)} "
+        f"WHERE {sharding.bucket_sql('user_id')} = %(bucket)s"
+    )
+
+
+def in_bucket(queryset, column, bucket):
+    """Rows of ``queryset`` whose user, in ``column``, is in ``bucket``"""
+    table = connections[queryset.db].ops.quote_name(queryset.model._meta.db_table)
+    return queryset.alias(
+        user_bucket=RawSQL(sharding.bucket_sql(f'{table}.{column}'), (), output_field=IntegerField())
+    ).filter(user_bucket=bucket)
+
+
+def wallet_ids(shard, bucket):
+    """Ids of the wallets of ``bucket`` on ``shard``"""
+    return list(in_bucket(Wallet._base_manager.using(shard), 'user_id', bucket).values_list('id', flat=True))
+
+
+def drop_bucket(shard, bucket):
+    """Delete the fence and every row of ``bucket`` from ``shard``"""
+    connection = connections[shard]
+    qn = connection.ops.quote_name
+    wallets = _wallets_sql(connection)
+    with transaction.atomic(using=shard), connection.cursor() as cursor:
+        for model in [
+            WalletRollupMark, WalletDailyRollup, MonthlyStatement, WalletBalanceSlot, Transaction, ArchiveSegment,
+            OutboxEvent,
+        ]:
+            cursor.execute(
+                f"DELETE FROM {qn(model._meta.db_table)} WHERE wallet_id IN ({wallets})", {'bucket': bucket}
+            )
+        cursor.execute(
+            f"DELETE FROM {qn(Wallet._meta.db_table)} WHERE id IN ({wallets})", {'bucket': bucket}
+        )
+        cursor.execute(
+            f"DELETE FROM {qn(IdempotencyKey._meta.db_table)} WHERE {sharding.bucket_sql('user_id')} = %s", [bucket]
+        )
+        cursor.execute(f"DELETE FROM {qn(ShardFence._meta.db_table)} WHERE bucket = %s", [bucket])
+        if shard != DEFAULT_DB_ALIAS:
+            # Copies of users; the users themselves live on default
+            cursor.execute(
+                f"DELETE FROM {qn(User._meta.db_table)} WHERE {sharding.bucket_sql('id')} = %s", [bucket]
+            )
+
+
+def _batches(queryset):
+    batch = []
+    for obj in queryset.iterator(chunk_size=COPY_BATCH):
+        batch.append(obj)
+        if len(batch) == COPY_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_bucket(source, target, bucket, wallets):
+    """Copy the rows of ``wallets`` (all of ``bucket``) from ``source`` to ``target``"""
+    if target != DEFAULT_DB_ALIAS:
+        users = in_bucket(User._base_manager.using(DEFAULT_DB_ALIAS), 'id', bucket).order_by('id')
+        for batch in _batches(users):
+            sharding.mirror_users(User, batch, target)
+
+    Wallet._base_manager.using(target).bulk_create(Wallet._base_manager.using(source).filter(id__in=wallets))
+    slots = list(WalletBalanceSlot.objects.using(source).filter(wallet_id__in=wallets))
+    for slot in slots:
+        slot.pk = None
+    WalletBalanceSlot.objects.using(target).bulk_create(slots)
+    # The base manager does not queue rollup marks; the rollups are rebuilt below
+    for batch in _batches(Transaction._base_manager.using(source).filter(wallet_id__in=wallets).order_by('id')):
+        Transaction._base_manager.using(target).bulk_create(batch)
+
+    # The segment files themselves are shared by every shard
+    segments = list(ArchiveSegment.objects.using(source).filter(wallet_id__in=wallets))
+    for segment in segments:
+        segment.pk = None
+    ArchiveSegment.objects.using(target).bulk_create(segments)
+    # Events not relayed yet; they keep their ids, so one relayed from both shards is recognisable
+    OutboxEvent.objects.using(target).bulk_create(OutboxEvent.objects.using(source).filter(wallet_id__in=wallets))
+
+    keys = list(in_bucket(IdempotencyKey.objects.using(source), 'user_id', bucket))
+    for key in keys:
+        key.pk = None
+    IdempotencyKey.objects.using(target).bulk_create(keys)
+
+    statements = list(MonthlyStatement.objects.using(source).filter(wallet_id__in=wallets).select_related('run'))
+    runs = {}
+    for statement in statements:
+        run = statement.run
+        if run.period_start not in runs:
+            runs[run.period_start], _ = StatementRun.objects.using(target).get_or_create(
+                period_start=run.period_start,
+                defaults={
+                    'period_end': run.period_end, 'status': run.status,
+                    'started_at': run.started_at, 'completed_at': run.completed_at,
+                },
+            )
+        statement.pk, statement.run = None, runs[run.period_start]
+    MonthlyStatement.objects.using(target).bulk_create(statements)
+    # Archived days cannot be recomputed from the transactions left; the rebuild keeps these
+    rollups = list(WalletDailyRollup.objects.using(source).filter(wallet_id__in=wallets))
+    for rollup in rollups:
+        rollup.pk = None
+    WalletDailyRollup.objects.using(target).bulk_create(rollups)
+    if wallets:
+        WalletDailyRollup.objects.db_manager(target).rebuild(wallet_ids=wallets)
+
+
+@contextmanager
+def hold_fence(source, bucket):
+    """
+    Lock ``bucket``'s fence on ``source`` FOR UPDATE for the block and
+    delete it if the block succeeds. Yields whether the block can open a
+    REPEATABLE READ transaction of its own on ``source``: outside a
+    transaction the fence is locked on a separate connection, as the
+    first query of a REPEATABLE READ transaction takes its snapshot and
+    must not be the one waiting for the writers in flight. Inside one,
+    the fence is locked in it and the copy reads as it does.
+    """
+    if connections[source].in_atomic_block:
+        with transaction.atomic(using=source):
+            ShardFence.objects.using(source).select_for_update().filter(bucket=bucket).first()
+            yield False
+            ShardFence.objects.using(source).filter(bucket=bucket).delete()
+        return
+
+    connection = connections.create_connection(source)
+    table = connection.ops.quote_name(ShardFence._meta.db_table)
+    try:
+        connection.set_autocommit(False)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT bucket FROM {table} WHERE bucket = %s FOR UPDATE", [bucket])
+            yield True
+            cursor.execute(f"DELETE FROM {table} WHERE bucket = %s", [bucket])
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def move_bucket(bucket, target, drain=None):
+    """Move ``bucket`` to shard ``target``; returns how many wallets moved"""
+    if target not in settings.SHARDS:
+        raise ValueError(f"Unknown shard {target!r}")
+    drain = settings.SHARD_MAP_TTL if drain is None else drain
+    source = sharding.shard_map(refresh=True)[bucket]
+    if source == target:
+        finish_move(bucket, target)
+        return 0
+
+    with hold_fence(source, bucket) as isolated, transaction.atomic(using=source):
+        if isolated:
+            # One snapshot for the whole copy, taken now that the writes in flight have committed
+            with connections[source].cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        wallets = wallet_ids(source, bucket)
+        with transaction.atomic(using=target):
+            # Left by an interrupted move
+            drop_bucket(target, bucket)
+            copy_bucket(source, target, bucket, wallets)
+
+    ShardBucket.objects.using(DEFAULT_DB_ALIAS).filter(bucket=bucket).update(shard=target)
+    ShardFence.objects.using(target).get_or_create(bucket=bucket)
+    sharding.shard_map(refresh=True)
+    # Stale maps keep reading the source until every process has reloaded
+    time.sleep(drain)
+    drop_bucket(source, bucket)
+    return len(wallets)
+
+
+def finish_move(bucket, shard):
+    """Make sure ``shard``, which the map says holds ``bucket``, has its fence and no other shard has its rows"""
+    ShardFence.objects.using(shard).get_or_create(bucket=bucket)
+    for other in sharding.each_shard():
+        if other != shard:
+            drop_bucket(other, bucket)
+
+
+def even_moves():
+    """``(bucket, target)`` moves that leave every shard with an equal share of the buckets"""
+    buckets = sharding.shard_map(refresh=True)
+    shards = sharding.each_shard()
+    owned = {shard: [] for shard in shards}
+    for bucket, shard in enumerate(buckets):
+        owned.setdefault(shard, []).append(bucket)
+    quota = {shard: len(buckets) // len(shards) + (index < len(buckets) % len(shards))
+             for index, shard in enumerate(shards)}
+    spare = []
+    for shard, held in owned.items():
+        # Buckets on shards no longer in SHARDS are all spare
+        spare += held[quota.get(shard, 0):]
+    moves = []
+    for shard in shards:
+        while len(owned[shard]) < quota[shard]:
+            bucket = spare.pop()
+            owned[shard].append(bucket)
+            moves.append((bucket, shard))
+    return moves
+
+
+def report(workers=None):
+    """Buckets, wallets, balances and transactions of every shard, counted on all of them at once"""
+    buckets = sharding.shard_map(refresh=True)
+
+    def count(shard):
+        totals = Wallet._base_manager.using(shard).aggregate(wallets=Count('id'), balance=Sum('balance'))
+        totals['transactions'] = Transaction._base_manager.using(shard).count()
+        totals['buckets'] = buckets.count(shard)
+        return totals
+
+    return sharding.fan_out(count, workers)
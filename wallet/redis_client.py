@@ -0,0 +1,44 @@
+"""
+Shared Redis connection for the wallet app.
+
+Redis is an accelerator here, never the system of record: callers catch
+``redis.RedisError``, call ``mark_redis_down()`` and fall back to their
+database path. While Redis is marked down ``get_redis()`` returns None
+so a dead Redis costs one failed connection per cool-off period instead
+of one per request.
+"""
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+_down_until = 0.0
+
+
+def get_redis():
+    """Return the shared Redis client, or None while Redis is marked down"""
+    global _client
+    if time.monotonic() < _down_until:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = redis.Redis.from_url(
+                    settings.REDIS_URL,
+                    socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                )
+    return _client
+
+
+def mark_redis_down(exc=None):
+    """Skip Redis for REDIS_RETRY_AFTER seconds after a failure"""
+    global _down_until
+    _down_until = time.monotonic() + settings.REDIS_RETRY_AFTER
+    logger.warning("Redis unavailable, using fallbacks for %ss: %s", settings.REDIS_RETRY_AFTER, exc)
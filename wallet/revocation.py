@@ -0,0 +1,269 @@
+"""
+JWT revocation keyed on the ``jti`` claim.
+
+Revocations are written to Redis:
+
+* ``auth:revoked`` - sorted set of revoked keys, scored by when they can
+  be forgotten: ``jti:<jti>`` for a token or session, ``user:<id>`` for
+  "revoke all sessions" of a user
+* ``auth:revoked:user:<id>`` - the time before which the user's sessions
+  are revoked
+* ``auth:revocations`` - stream of revoked keys, which processes follow
+
+Each process keeps a Bloom filter of the revoked keys and applies new
+stream entries at most every TOKEN_REVOCATION_SYNC_INTERVAL seconds, so
+checking a token that is not revoked - nearly every request - costs a
+few hashes in memory. Only Bloom hits are confirmed in Redis.
+
+Tokens issued by ``issue_tokens`` carry ``sid`` (the refresh token's jti)
+and ``auth_time`` (when the user logged in). Access tokens copy both from
+their refresh token, so revoking a session revokes the refresh token and
+every access token minted from it.
+
+Revoking needs Redis and raises ``RevocationUnavailable`` without it.
+While Redis is down, checks use the last synced filter, and a Bloom hit
+that cannot be confirmed counts as revoked.
+"""
+import hashlib
+import math
+import threading
+import time
+
+import redis
+from django.conf import settings
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .redis_client import get_redis, mark_redis_down
+
+REVOKED_KEY = 'auth:revoked'
+STREAM_KEY = 'auth:revocations'
+
+
+class RevocationUnavailable(Exception):
+    """Raised when a revocation cannot be recorded because Redis is unavailable"""
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter of strings using double hashing over one blake2b digest"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+_filter = None
+_last_id = None
+_synced_at = float('-inf')
+_sync_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = dict.fromkeys(['checks', 'bloom_hits', 'revoked', 'cleared', 'syncs', 'rebuilds'], 0)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    """Check counters of this process"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset():
+    """Forget this process's filter and counters, so the next check rebuilds it"""
+    global _filter, _last_id, _synced_at
+    with _sync_lock:
+        _filter, _last_id, _synced_at = None, None, float('-inf')
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def _user_key(user_id):
+    return f"auth:revoked:user:{user_id}"
+
+
+def _stream_id(value):
+    milliseconds, sequence = value.split(b'-')
+    return int(milliseconds), int(sequence)
+
+
+def _rebuild(client):
+    """Fresh filter of every unexpired revocation, and the stream entry it covers"""
+    pipe = client.pipeline()
+    pipe.xrevrange(STREAM_KEY, count=1)
+    pipe.zrangebyscore(REVOKED_KEY, time.time(), '+inf')
+    latest, keys = pipe.execute()
+
+    bloom = BloomFilter(
+        max(settings.TOKEN_REVOCATION_BLOOM_CAPACITY, 2 * len(keys)),
+        settings.TOKEN_REVOCATION_BLOOM_ERROR_RATE,
+    )
+    for key in keys:
+        bloom.add(key.decode())
+    _count('rebuilds')
+    return bloom, latest[0][0] if latest else b'0-0'
+
+
+def _sync():
+    global _filter, _last_id
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        if _filter is None or _filter.count >= _filter.capacity:
+            # Rebuilding also drops expired revocations
+            _filter, _last_id = _rebuild(client)
+            return
+        pipe = client.pipeline(transaction=False)
+        pipe.xrange(STREAM_KEY, count=1)
+        pipe.xread({STREAM_KEY: _last_id})
+        oldest, new = pipe.execute()
+        if oldest and _stream_id(oldest[0][0]) > _stream_id(_last_id):
+            # Entries we have not seen may have been trimmed from the stream
+            _filter, _last_id = _rebuild(client)
+            return
+        for entry_id, fields in new[0][1] if new else []:
+            _filter.add(fields[b'key'].decode())
+            _last_id = entry_id
+        _count('syncs')
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+
+
+def _maybe_sync():
+    global _synced_at
+    if time.monotonic() - _synced_at < settings.TOKEN_REVOCATION_SYNC_INTERVAL:
+        return
+    # Only the first check has to wait; later ones use the current filter meanwhile
+    if not _sync_lock.acquire(blocking=_filter is None):
+        return
+    try:
+        if time.monotonic() - _synced_at >= settings.TOKEN_REVOCATION_SYNC_INTERVAL:
+            _sync()
+            _synced_at = time.monotonic()
+    finally:
+        _sync_lock.release()
+
+
+def _keys(token):
+    jti = token[api_settings.JTI_CLAIM]
+    keys = [f"jti:{jti}"]
+    if token.get('sid', jti) != jti:
+        keys.append(f"jti:{token['sid']}")
+    keys.append(f"user:{token[api_settings.USER_ID_CLAIM]}")
+    return keys
+
+
+def issued_at(token):
+    """When the session a token belongs to was started"""
+    return float(token.get('auth_time', token['iat']))
+
+
+def is_revoked(token):
+    """True if the token, its session or all of its user's sessions were revoked"""
+    _count('checks')
+    _maybe_sync()
+    bloom = _filter
+    if bloom is None:
+        return False
+    hits = [key for key in _keys(token) if key in bloom]
+    if not hits:
+        return False
+
+    _count('bloom_hits')
+    client = get_redis()
+    if client is None:
+        return True
+    try:
+        pipe = client.pipeline(transaction=False)
+        for key in hits:
+            if key.startswith('user:'):
+                pipe.get(_user_key(key[5:]))
+            else:
+                pipe.zscore(REVOKED_KEY, key)
+        results = pipe.execute()
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return True
+
+    for key, value in zip(hits, results):
+        if value is None:
+            continue
+        if not key.startswith('user:') or issued_at(token) < float(value):
+            _count('revoked')
+            return True
+    # A Bloom false positive, or a session started after its user's cutoff
+    _count('cleared')
+    return False
+
+
+def _revoke(key, forget_at, cutoff=None):
+    client = get_redis()
+    if client is None:
+        raise RevocationUnavailable("Token revocation is unavailable")
+    try:
+        pipe = client.pipeline()
+        pipe.zadd(REVOKED_KEY, {key: forget_at})
+        if cutoff is not None:
+            pipe.set(_user_key(key[5:]), repr(cutoff), exat=math.ceil(forget_at))
+        pipe.xadd(STREAM_KEY, {'key': key}, maxlen=settings.TOKEN_REVOCATION_BLOOM_CAPACITY, approximate=True)
+        pipe.zremrangebyscore(REVOKED_KEY, '-inf', time.time())
+        pipe.execute()
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        raise RevocationUnavailable("Token revocation is unavailable") from exc
+
+    bloom = _filter
+    if bloom is not None:
+        bloom.add(key)
+
+
+def revoke_token(token):
+    """Revoke one token by its jti; a refresh token's jti is its session"""
+    _revoke(f"jti:{token[api_settings.JTI_CLAIM]}", token['exp'])
+
+
+def revoke_session(token):
+    """Revoke the session a token belongs to: its refresh token and every access token from it"""
+    if 'sid' not in token:
+        return revoke_token(token)
+    forget_at = issued_at(token) + api_settings.REFRESH_TOKEN_LIFETIME.total_seconds()
+    _revoke(f"jti:{token['sid']}", forget_at)
+
+
+def revoke_user(user_id):
+    """Revoke every session of a user started until now"""
+    now = time.time()
+    _revoke(f"user:{user_id}", now + api_settings.REFRESH_TOKEN_LIFETIME.total_seconds(), cutoff=now)
+
+
+def issue_tokens(user):
+    """Access and refresh token of a new session for ``user``"""
+    refresh = RefreshToken.for_user(user)
+    refresh['sid'] = refresh[api_settings.JTI_CLAIM]
+    refresh['auth_time'] = time.time()
+    return {
+        'access': str(refresh.access_token),
+        'refresh': str(refresh),
+    }
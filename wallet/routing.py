@@ -0,0 +1,154 @@
+"""
+Primary/replica database routing.
+
+Writes always go to the primary (``default``). Reads go to the primary
+too, except inside ``replica_reads()`` - read-only API endpoints
+(``ReplicaReadMixin`` in the views), admin change lists and reporting
+tasks - where they go to one of DATABASE_REPLICAS.
+
+A replica is only used while its replication lag, checked by each
+process at most every REPLICA_LAG_CHECK_INTERVAL seconds, is under
+REPLICA_MAX_LAG; a replica that is behind or unreachable is skipped until
+the next check, and without a fresh replica reads stay on the primary.
+
+Users who just moved money read their own writes: money-moving views
+call ``pin_to_primary()`` before writing, which keeps that user's reads
+on the primary for REPLICA_STICKY_SECONDS in every process. The pins
+live in Redis; while Redis is unavailable every read goes to the primary.
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import redis
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from .redis_client import get_redis, mark_redis_down
+
+logger = logging.getLogger(__name__)
+
+# Seconds the replica is behind; 0 when it has replayed everything it received
+LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 'Infinity')
+END
+"""
+
+_reads = ContextVar('wallet_read_alias', default=None)
+_lag = {}  # alias -> (checked at, fresh)
+_lag_lock = threading.Lock()
+
+
+def _pin_key(user_id):
+    return f"db:primary:{user_id}"
+
+
+def pin_to_primary(user_id):
+    """Keep the user's reads on the primary for REPLICA_STICKY_SECONDS"""
+    if not settings.DATABASE_REPLICAS:
+        return
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.set(_pin_key(user_id), 1, ex=settings.REPLICA_STICKY_SECONDS)
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+
+
+def is_pinned(user_id):
+    """True if the user's reads must go to the primary; always while Redis is unavailable"""
+    client = get_redis()
+    if client is None:
+        return True
+    try:
+        return bool(client.exists(_pin_key(user_id)))
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return True
+
+
+def replica_lag(alias):
+    """Seconds replica ``alias`` is behind the primary"""
+    with connections[alias].cursor() as cursor:
+        cursor.execute(LAG_SQL)
+        return float(cursor.fetchone()[0])
+
+
+def is_fresh(alias):
+    """True if the replica's lag was under REPLICA_MAX_LAG at the last check"""
+    now = time.monotonic()
+    checked_at, fresh = _lag.get(alias, (float('-inf'), False))
+    if now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return fresh
+    with _lag_lock:
+        checked_at, fresh = _lag.get(alias, (float('-inf'), False))
+        if now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+            return fresh
+        try:
+            lag = replica_lag(alias)
+            fresh = lag <= settings.REPLICA_MAX_LAG
+            if not fresh:
+                logger.warning("Replica %s is %.1fs behind, reading from the primary", alias, lag)
+        except DatabaseError as exc:
+            fresh = False
+            logger.warning("Replica %s unavailable, reading from the primary: %s", alias, exc)
+        _lag[alias] = (now, fresh)
+        return fresh
+
+
+def reset():
+    """Forget this process's replica lag checks"""
+    with _lag_lock:
+        _lag.clear()
+
+
+def read_alias(user_id=None):
+    """Database to read from for ``user_id`` (or a background job): a fresh replica or the primary"""
+    replicas = settings.DATABASE_REPLICAS
+    if not replicas or (user_id is not None and is_pinned(user_id)):
+        return DEFAULT_DB_ALIAS
+    fresh = [alias for alias in replicas if is_fresh(alias)]
+    return random.choice(fresh) if fresh else DEFAULT_DB_ALIAS
+
+
+def begin_reads(alias):
+    """Route reads to ``alias`` until ``end_reads()`` is called with the returned token"""
+    return _reads.set(alias)
+
+
+def end_reads(token):
+    _reads.reset(token)
+
+
+@contextmanager
+def replica_reads(user_id=None):
+    """Route reads inside the block as ``read_alias(user_id)`` says"""
+    token = begin_reads(read_alias(user_id))
+    try:
+        yield
+    finally:
+        end_reads(token)
+
+
+class PrimaryReplicaRouter:
+    """Writes to the primary; reads to the alias chosen by the enclosing ``replica_reads()``"""
+
+    def db_for_read(self, model, **hints):
+        # Not the database of a related instance: that may be a shard's copy of a user
+        return _reads.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        aliases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
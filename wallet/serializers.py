@@ -1,7 +1,11 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
-from .models import User, Wallet, Transaction
+from django.conf import settings
+from django.utils import timezone
+from .models import User, Wallet, Transaction, PayoutJob, PayoutItem, WalletDailyRollup
+from . import sharding
+from .projections import Projection
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -22,8 +26,9 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         validated_data.pop('password_confirm')
         user = User.objects.create_user(**validated_data)
-        # Create wallet for the user
-        Wallet.objects.create(user=user)
+        # Create wallet for the user, on the shard its bucket maps to
+        with sharding.atomic(user.pk):
+            Wallet.objects.create(user=user)
         return user
 
 
@@ -60,6 +65,7 @@ class UserSerializer(serializers.ModelSerializer):
 class WalletSerializer(serializers.ModelSerializer):
     """Serializer for wallet information"""
     user = UserSerializer(read_only=True)
+    balance = serializers.DecimalField(max_digits=15, decimal_places=2, source='total_balance', read_only=True)
     currency_display = serializers.CharField(source='get_currency_display', read_only=True)
 
     class Meta:
@@ -68,8 +74,50 @@ class WalletSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'user', 'created_at', 'updated_at']
 
 
+class WalletStateSerializer(WalletSerializer):
+    """Wallet information without the owner, as held in the balance cache"""
+    class Meta(WalletSerializer.Meta):
+        fields = [name for name in WalletSerializer.Meta.fields if name != 'user']
+
+
+def flat_requested(context):
+    """Whether the request asked for the flat representation with ``?mode=flat``"""
+    request = context.get('request')
+    return request is not None and request.query_params.get('mode') == 'flat'
+
+
+def requested_expansions(context):
+    """Relations named in the request's ``?expand=`` parameter, e.g. ``{'wallet', 'user'}``"""
+    request = context.get('request')
+    if request is None:
+        return set()
+    return {name.strip() for name in request.query_params.get('expand', '').split(',') if name.strip()}
+
+
+class WalletSummarySerializer(serializers.ModelSerializer):
+    """Wallet embedded in an expanded transaction; the owner is an id unless ``user`` is expanded"""
+    balance = serializers.DecimalField(max_digits=15, decimal_places=2, source='total_balance', read_only=True)
+
+    class Meta:
+        model = Wallet
+        fields = ['id', 'user', 'balance', 'currency', 'is_active']
+        read_only_fields = fields
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if 'user' in requested_expansions(self.context):
+            fields['user'] = UserSerializer(read_only=True)
+        return fields
+
+
 class TransactionSerializer(serializers.ModelSerializer):
-    """Serializer for transaction information"""
+    """
+    Serializer for transaction information, with the wallet and its owner
+    nested. ``?mode=flat`` renders ``wallet`` as an id instead; there
+    ``?expand=wallet`` embeds a wallet summary and ``?expand=wallet,user``
+    its owner too.
+    """
+    flat = False
     wallet = WalletSerializer(read_only=True)
     transaction_type_display = serializers.CharField(source='get_transaction_type_display', read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
@@ -78,11 +126,45 @@ class TransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = [
-            'id', 'wallet', 'transaction_type', 'transaction_type_display', 'amount', 
+            'id', 'wallet', 'counterparty', 'transaction_type', 'transaction_type_display', 'amount', 
             'currency', 'currency_display', 'status', 'status_display', 'description', 
             'reference', 'balance_before', 'balance_after', 'created_at'
         ]
-        read_only_fields = ['id', 'wallet', 'reference', 'balance_before', 'balance_after', 'created_at']
+        read_only_fields = ['id', 'wallet', 'counterparty', 'reference', 'balance_before', 'balance_after', 'created_at']
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.flat or flat_requested(self.context):
+            fields['wallet'] = (
+                WalletSummarySerializer(read_only=True) if 'wallet' in requested_expansions(self.context)
+                else serializers.PrimaryKeyRelatedField(read_only=True)
+            )
+        return fields
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, context):
+        """Select only the columns the serializer renders for ``context``'s request, joining nested relations"""
+        columns = [
+            'id', 'wallet_id', 'counterparty_id', 'transaction_type', 'amount', 'currency', 'status',
+            'description', 'reference', 'balance_before', 'balance_after', 'created_at',
+        ]
+        flat = cls.flat or flat_requested(context)
+        expand = requested_expansions(context) if flat else {'wallet', 'user'}
+        if 'wallet' in expand:
+            wallet_fields = ['id', 'user_id', 'balance', 'hot_slots', 'currency', 'is_active']
+            if not flat:
+                wallet_fields += ['created_at', 'updated_at']
+            queryset = queryset.select_related('wallet')
+            columns += [f'wallet__{name}' for name in wallet_fields]
+            if 'user' in expand:
+                queryset = queryset.select_related('wallet__user')
+                columns += [f'wallet__user__{name}' for name in UserSerializer.Meta.fields]
+        return queryset.only(*columns)
+
+
+class FlatTransactionSerializer(TransactionSerializer):
+    """Transaction information with ``wallet`` as an id, whatever the request asks"""
+    flat = True
 
 
 class TopUpSerializer(serializers.Serializer):
@@ -108,6 +190,18 @@ class WithdrawalSerializer(serializers.Serializer):
         return value
 
 
+class TransferSerializer(serializers.Serializer):
+    """Serializer for wallet-to-wallet transfer"""
+    recipient_email = serializers.EmailField()
+    amount = serializers.DecimalField(max_digits=15, decimal_places=2, min_value=0.01)
+    description = serializers.CharField(max_length=500, required=False, allow_blank=True)
+
+    def validate_amount(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Amount must be greater than zero")
+        return value
+
+
 class TransactionListSerializer(serializers.ModelSerializer):
     """Serializer for transaction list with minimal fields"""
     transaction_type_display = serializers.CharField(source='get_transaction_type_display', read_only=True)
@@ -120,4 +214,93 @@ class TransactionListSerializer(serializers.ModelSerializer):
             'currency', 'status', 'status_display', 'description', 
             'reference', 'created_at'
         ]
-        read_only_fields = ['id', 'reference', 'created_at'] 
\ No newline at end of file
+        read_only_fields = ['id', 'reference', 'created_at']
+
+
+# History pages and exports render serializer fields straight from values_list() rows
+TRANSACTION_LIST_PROJECTION = Projection(TransactionListSerializer)
+TRANSACTION_EXPORT_PROJECTION = Projection(FlatTransactionSerializer)
+
+
+class PayoutJobCreateSerializer(serializers.Serializer):
+    """Serializer for bulk payout job options (rows are parsed separately)"""
+    description = serializers.CharField(max_length=255, required=False, allow_blank=True, default='')
+    currency = serializers.ChoiceField(choices=Wallet.CURRENCY_CHOICES, default='USD')
+
+
+class PayoutJobSerializer(serializers.ModelSerializer):
+    """Serializer for bulk payout job progress"""
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = PayoutJob
+        fields = [
+            'id', 'description', 'currency', 'status', 'total_items', 'processed_items',
+            'succeeded_items', 'failed_items', 'progress', 'created_at', 'started_at', 'completed_at'
+        ]
+        read_only_fields = fields
+
+    def get_progress(self, obj):
+        if not obj.total_items:
+            return 100.0
+        return round(obj.processed_items * 100 / obj.total_items, 2)
+
+
+class PayoutItemSerializer(serializers.ModelSerializer):
+    """Serializer for a single payout row and its outcome"""
+
+    class Meta:
+        model = PayoutItem
+        fields = ['row_number', 'wallet_id', 'amount', 'reference', 'status', 'error', 'transaction']
+        read_only_fields = fields
+
+
+class StatementPeriodSerializer(serializers.Serializer):
+    """Query parameters of the statement endpoint; the period defaults to the month to date"""
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        today = timezone.now().date()
+        attrs.setdefault('end', today)
+        attrs.setdefault('start', attrs['end'].replace(day=1))
+        if attrs['start'] > attrs['end']:
+            raise serializers.ValidationError("start must not be later than end")
+        if (attrs['end'] - attrs['start']).days >= settings.STATEMENT_MAX_DAYS:
+            raise serializers.ValidationError(f"A statement covers at most {settings.STATEMENT_MAX_DAYS} days")
+        return attrs
+
+
+class DailyRollupSerializer(serializers.ModelSerializer):
+    """One day of a statement"""
+    net_change = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = WalletDailyRollup
+        fields = [
+            'day', 'deposits_total', 'deposits_count', 'withdrawals_total', 'withdrawals_count',
+            'transfers_in_total', 'transfers_in_count', 'transfers_out_total', 'transfers_out_count',
+            'net_change', 'closing_balance',
+        ]
+        read_only_fields = fields
+
+
+class StatementSerializer(serializers.Serializer):
+    """Statement built by ``wallet.statements.build_statement``"""
+    wallet = serializers.UUIDField()
+    currency = serializers.CharField()
+    start = serializers.DateField()
+    end = serializers.DateField()
+    opening_balance = serializers.DecimalField(max_digits=15, decimal_places=2)
+    deposits_total = serializers.DecimalField(max_digits=15, decimal_places=2)
+    deposits_count = serializers.IntegerField()
+    withdrawals_total = serializers.DecimalField(max_digits=15, decimal_places=2)
+    withdrawals_count = serializers.IntegerField()
+    transfers_in_total = serializers.DecimalField(max_digits=15, decimal_places=2)
+    transfers_in_count = serializers.IntegerField()
+    transfers_out_total = serializers.DecimalField(max_digits=15, decimal_places=2)
+    transfers_out_count = serializers.IntegerField()
+    net_change = serializers.DecimalField(max_digits=15, decimal_places=2)
+    transaction_count = serializers.IntegerField()
+    closing_balance = serializers.DecimalField(max_digits=15, decimal_places=2)
+    days = DailyRollupSerializer(many=True)
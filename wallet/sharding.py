@@ -0,0 +1,303 @@
+"""
+Horizontal sharding of wallets.
+
+Users are hashed into SHARD_BUCKETS buckets and the shard map - the
+``shard_buckets`` table on ``default`` - says which of SHARDS holds each
+bucket's wallets, balance slots, transactions, rollups, statements and
+idempotency keys. Users themselves and payout jobs stay on ``default``;
+each shard keeps a copy of the users whose wallets it holds (without
+their passwords) for its foreign keys and joins.
+
+``ShardRouter`` sends queries of the sharded models to the shard of the
+instance they concern (a user, a wallet or a row of one) or else to the
+shard selected with ``use_shard()``; views select the requesting user's
+shard, tasks and reports loop over ``each_shard()``. Reads of ``default``
+are left to ``wallet.routing`` so they can still go to a replica.
+
+Every shard also has ``shard_fences`` rows for the buckets it holds.
+Writers take them with ``atomic()``, which locks the user's fence FOR
+SHARE in the shard transaction; ``wallet.rebalance`` moves a bucket by
+locking its fence FOR UPDATE, so a move waits for the writes in flight
+and writers wait for the move, then find the fence gone, reload the map
+and retry on the new shard. Background writers looping over a shard
+(balance consolidation, rollup refreshes, archiving, the outbox relay)
+take the fences of the wallets they are about to write with ``held()``
+and leave those that moved to their new shard.
+
+With a single shard (the default) nothing here runs: the router defers
+to the other routers and ``atomic()`` is a plain transaction on
+``default``.
+"""
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# Changing it reshuffles every user, so it is fixed rather than a setting
+SHARD_BUCKETS = 1024
+
+MAP_TABLE = 'shard_buckets'
+FENCE_TABLE = 'shard_fences'
+
+# Models whose rows live on their user's shard
+SHARDED_MODELS = {
+    'wallet.wallet', 'wallet.walletbalanceslot', 'wallet.transaction', 'wallet.walletrollupmark',
+    'wallet.walletdailyrollup', 'wallet.statementrun', 'wallet.monthlystatement', 'wallet.archivesegment',
+    'wallet.outboxevent', 'wallet.idempotencykey',
+}
+
+_shard = ContextVar('wallet_shard', default=None)
+_map = {'buckets': None, 'loaded_at': float('-inf')}
+_map_lock = threading.Lock()
+
+
+class BucketMoved(APIException):
+    """The user's bucket moved to another shard while a write was waiting for it"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Wallet is being moved, please retry'
+    default_code = 'bucket_moved'
+
+
+def enabled():
+    return len(settings.SHARDS) > 1
+
+
+def bucket_for(user_id):
+    """Bucket of a user: the first 32 bits of the MD5 of its id, modulo SHARD_BUCKETS"""
+    return int(hashlib.md5(str(user_id).encode()).hexdigest()[:8], 16) % SHARD_BUCKETS
+
+
+def bucket_sql(column):
+    """SQL computing ``bucket_for`` of a uuid column, for a query with parameters"""
+    return f"(('x' || substr(md5({column}::text), 1, 8))::bit(32)::bigint %% {SHARD_BUCKETS})"
+
+
+def load_map():
+    """Read the shard map from ``default``, creating it (everything on ``default``) the first time"""
+    connection = connections[DEFAULT_DB_ALIAS]
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT bucket, shard FROM {MAP_TABLE}")
+        rows = cursor.fetchall()
+        if len(rows) < SHARD_BUCKETS:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                cursor.execute(f"""
+                    INSERT INTO {MAP_TABLE} (bucket, shard, updated_at)
+                    SELECT bucket, %s, now() FROM generate_series(0, %s) AS bucket
+                    ON CONFLICT (bucket) DO NOTHING
+                """, [DEFAULT_DB_ALIAS, SHARD_BUCKETS - 1])
+                cursor.execute(f"""
+                    INSERT INTO {FENCE_TABLE} (bucket)
+                    SELECT bucket FROM {MAP_TABLE} WHERE shard = %s
+                    ON CONFLICT (bucket) DO NOTHING
+                """, [DEFAULT_DB_ALIAS])
+            cursor.execute(f"SELECT bucket, shard FROM {MAP_TABLE}")
+            rows = cursor.fetchall()
+    buckets = [DEFAULT_DB_ALIAS] * SHARD_BUCKETS
+    for bucket, shard in rows:
+        buckets[bucket] = shard
+    return buckets
+
+
+def shard_map(refresh=False):
+    """Shard of every bucket, reloaded at most every SHARD_MAP_TTL seconds"""
+    now = time.monotonic()
+    buckets, loaded_at = _map['buckets'], _map['loaded_at']
+    if not refresh and buckets is not None and now - loaded_at < settings.SHARD_MAP_TTL:
+        return buckets
+    with _map_lock:
+        if refresh or _map['buckets'] is None or now - _map['loaded_at'] >= settings.SHARD_MAP_TTL:
+            _map['buckets'], _map['loaded_at'] = load_map(), time.monotonic()
+        return _map['buckets']
+
+
+def reset():
+    """Forget this process's copy of the shard map"""
+    with _map_lock:
+        _map['buckets'], _map['loaded_at'] = None, float('-inf')
+
+
+def shard_for_user(user_id, refresh=False):
+    """Database holding the wallet of ``user_id``"""
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    return shard_map(refresh)[bucket_for(user_id)]
+
+
+def each_shard():
+    return list(settings.SHARDS)
+
+
+def fan_out(fn, workers=None):
+    """
+    ``{shard: fn(shard)}`` for every shard, run on up to ``workers``
+    threads (one per shard by default) with their own connections
+    """
+    shards = each_shard()
+    workers = len(shards) if workers is None else workers
+    if workers <= 1:
+        return {shard: fn(shard) for shard in shards}
+
+    def run(shard):
+        try:
+            return fn(shard)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(shards, pool.map(run, shards)))
+
+
+def begin_shard(alias):
+    """Route sharded queries without an instance to ``alias`` until ``end_shard()``"""
+    return _shard.set(alias)
+
+
+def end_shard(token):
+    _shard.reset(token)
+
+
+@contextmanager
+def use_shard(alias):
+    token = begin_shard(alias)
+    try:
+        yield alias
+    finally:
+        end_shard(token)
+
+
+def held(shard, user_ids):
+    """
+    Lock the fences of the users' buckets on ``shard`` FOR SHARE until the
+    current transaction ends and return the ids of the users whose
+    buckets ``shard`` still holds, waiting for any move in progress.
+    """
+    user_ids = set(user_ids)
+    if not enabled() or not user_ids:
+        return user_ids
+    buckets = sorted({bucket_for(user_id) for user_id in user_ids})
+    with connections[shard].cursor() as cursor:
+        cursor.execute(
+            f"SELECT bucket FROM {FENCE_TABLE} WHERE bucket = ANY(%s) ORDER BY bucket FOR SHARE", [buckets]
+        )
+        fenced = {row[0] for row in cursor.fetchall()}
+    return {user_id for user_id in user_ids if bucket_for(user_id) in fenced}
+
+
+def held_wallets(shard, wallet_ids):
+    """``held()`` for wallets: those of ``wallet_ids`` still on ``shard``, in their order"""
+    wallet_ids = list(wallet_ids)
+    if not enabled() or not wallet_ids:
+        return wallet_ids
+    from .models import Wallet
+
+    owners = dict(Wallet._base_manager.using(shard).filter(id__in=wallet_ids).values_list('id', 'user_id'))
+    users = held(shard, owners.values())
+    return [wallet_id for wallet_id in wallet_ids if owners.get(wallet_id) in users]
+
+
+def claim(shard, *user_ids):
+    """
+    Lock the fences of the users' buckets on ``shard`` FOR SHARE until the
+    current transaction ends. Raises BucketMoved, after reloading the
+    map, if ``shard`` no longer holds one of them.
+    """
+    if len(held(shard, user_ids)) < len(set(user_ids)):
+        shard_map(refresh=True)
+        raise BucketMoved()
+
+
+@contextmanager
+def atomic(user_id):
+    """Transaction on the user's shard, which keeps the user's bucket from moving until it ends"""
+    shard = shard_for_user(user_id)
+    with use_shard(shard), transaction.atomic(using=shard):
+        claim(shard, user_id)
+        yield shard
+
+
+def atomic_request(view_method):
+    """Run a view method in ``atomic(request.user.pk)``, once more if the user's bucket just moved"""
+    @wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        try:
+            with atomic(request.user.pk):
+                return view_method(view, request, *args, **kwargs)
+        except BucketMoved:
+            # Nothing was written and the claim reloaded the map
+            with atomic(request.user.pk):
+                return view_method(view, request, *args, **kwargs)
+    return wrapper
+
+
+def mirror_user(user, shard=None):
+    """Copy a user, without the password, to ``shard`` or the shard holding its wallet"""
+    if not enabled():
+        return
+    shard = shard or shard_for_user(user.pk)
+    if shard != DEFAULT_DB_ALIAS:
+        mirror_users(type(user), [user], shard)
+
+
+def mirror_users(model, users, shard):
+    """Upsert copies of ``users`` on ``shard``"""
+    copies = []
+    for user in users:
+        copy = model(**{field.attname: getattr(user, field.attname) for field in model._meta.concrete_fields})
+        copy.set_unusable_password()
+        copies.append(copy)
+    fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+    model._base_manager.using(shard).bulk_create(
+        copies, update_conflicts=True, unique_fields=[model._meta.pk.name], update_fields=fields,
+    )
+
+
+def forget_user(user):
+    """Delete a user's wallet data and copy from a shard other than ``default``"""
+    if not enabled():
+        return
+    shard = shard_for_user(user.pk)
+    if shard != DEFAULT_DB_ALIAS:
+        type(user)._base_manager.using(shard).filter(pk=user.pk).delete()
+
+
+class ShardRouter:
+    """Queries of sharded models to the shard of their user"""
+
+    def _shard(self, model, hints):
+        if model._meta.label_lower not in SHARDED_MODELS or not enabled():
+            return None
+        instance = hints.get('instance')
+        if instance is not None:
+            label = instance._meta.label_lower
+            if label == settings.AUTH_USER_MODEL.lower():
+                return shard_for_user(instance.pk)
+            if label in SHARDED_MODELS and instance._state.db in settings.SHARDS:
+                return instance._state.db
+            if label in ('wallet.wallet', 'wallet.idempotencykey') and instance.user_id is not None:
+                return shard_for_user(instance.user_id)
+            wallet = instance._state.fields_cache.get('wallet')
+            if wallet is not None and wallet._state.db in settings.SHARDS:
+                return wallet._state.db
+        return _shard.get()
+
+    def db_for_read(self, model, **hints):
+        shard = self._shard(model, hints)
+        # ``default`` reads are wallet.routing's to send to a replica
+        return None if shard == DEFAULT_DB_ALIAS else shard
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # A shard's rows point at its copies of users and at wallets on the same shard
+        if enabled() and obj1._state.db in settings.SHARDS and obj2._state.db in settings.SHARDS:
+            return True
+        return None
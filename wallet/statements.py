@@ -0,0 +1,209 @@
+"""
+Wallet statements built from daily rollups.
+
+A statement for any period reads one ``WalletDailyRollup`` row per day
+with activity plus the closing balance of the last active day before it,
+instead of scanning the wallet's transactions. The wallet's queued
+rollup days are refreshed first so statements include its latest writes.
+
+Month-end statements for every wallet are a ``StatementRun``: wallets are
+split into id ranges, and each range is one Celery task that aggregates
+the rollups of all its wallets and inserts their ``MonthlyStatement``
+rows with a single INSERT ... SELECT. Stored statements are the
+checkpoint - a restarted run only dispatches the wallets still without
+one - so a crashed or retried run never does a wallet twice.
+
+Balances are those recorded on transactions; for hot wallets these are
+the total at the time of each write, see ``wallet.ledger``.
+"""
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import MonthlyStatement, StatementRun, Wallet, WalletBalanceSlot, WalletDailyRollup
+
+TOTALS = [
+    'deposits_total', 'deposits_count', 'withdrawals_total', 'withdrawals_count',
+    'transfers_in_total', 'transfers_in_count', 'transfers_out_total', 'transfers_out_count',
+]
+
+
+def build_statement(wallet, start, end):
+    """Totals, daily breakdown and opening/closing balances of ``wallet`` from ``start`` to ``end`` inclusive"""
+    while WalletDailyRollup.objects.refresh(wallet_ids=[wallet.pk]) >= settings.ROLLUP_REFRESH_BATCH:
+        pass
+
+    rollups = wallet.daily_rollups.all()
+    days = list(rollups.filter(day__gte=start, day__lte=end).order_by('day'))
+    previous = rollups.filter(day__lt=start).order_by('-day').first()
+    if previous is not None:
+        opening = previous.closing_balance
+    elif days:
+        opening = days[0].closing_balance - days[0].net_change
+    else:
+        # No activity up to the end of the period: work back from the next active day
+        following = rollups.filter(day__gt=end).order_by('day').first()
+        opening = following.closing_balance - following.net_change if following else wallet.total_balance
+
+    statement = {
+        'wallet': wallet.pk,
+        'currency': wallet.currency,
+        'start': start,
+        'end': end,
+        'opening_balance': opening,
+        'closing_balance': days[-1].closing_balance if days else opening,
+        'days': days,
+    }
+    for name in TOTALS:
+        statement[name] = sum((getattr(day, name) for day in days), Decimal('0.00') if name.endswith('_total') else 0)
+    statement['net_change'] = sum((day.net_change for day in days), Decimal('0.00'))
+    statement['transaction_count'] = sum(day.transaction_count for day in days)
+    return statement
+
+
+def month_bounds(year, month):
+    """First and last day of a month"""
+    return date(year, month, 1), date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+
+
+def _refresh_all():
+    while WalletDailyRollup.objects.refresh() >= settings.ROLLUP_REFRESH_BATCH:
+        pass
+
+
+def _run_sql(run):
+    """Connection, quoted table names and base parameters for a run's queries"""
+    connection = connections[router.db_for_write(MonthlyStatement)]
+    qn = connection.ops.quote_name
+    tables = {
+        name: qn(model._meta.db_table) for name, model in [
+            ('wallets', Wallet), ('slots', WalletBalanceSlot),
+            ('rollups', WalletDailyRollup), ('statements', MonthlyStatement),
+        ]
+    }
+    params = {
+        'run': run.pk,
+        'start': run.period_start,
+        'end': run.period_end,
+        # Wallets opened after the period get their first statement next time
+        'until': datetime.combine(run.period_end + timedelta(days=1), time.min, tzinfo=dt_timezone.utc),
+    }
+    pending = f"""
+        w.created_at < %(until)s AND NOT EXISTS (
+            SELECT 1 FROM {tables['statements']} AS s WHERE s.wallet_id = w.id AND s.period_start = %(start)s
+        )
+    """
+    return connection, tables, params, pending
+
+
+def chunk_bounds(run, chunk_size):
+    """Split the wallets still without a statement into ``(first_id, next_first_id)`` ranges"""
+    connection, tables, params, pending = _run_sql(run)
+    params['size'] = chunk_size
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT id FROM (
+                SELECT w.id, row_number() OVER (ORDER BY w.id) AS n
+                FROM {tables['wallets']} AS w WHERE {pending}
+            ) AS numbered
+            WHERE (n - 1) %% %(size)s = 0 ORDER BY id
+        """, params)
+        firsts = [str(row[0]) for row in cursor.fetchall()]
+    return list(zip(firsts, firsts[1:] + [None]))
+
+
+def start_run(year, month, chunk_size):
+    """
+    Create or resume the statement run for a month. Returns the run and
+    the chunk bounds left to process (none once it has completed).
+    """
+    start, end = month_bounds(year, month)
+    run, _ = StatementRun.objects.get_or_create(period_start=start, defaults={'period_end': end})
+    if run.status == 'COMPLETED':
+        return run, []
+
+    _refresh_all()
+    bounds = chunk_bounds(run, chunk_size)
+    _, _, params, _ = _run_sql(run)
+    run.total_wallets = Wallet.objects.filter(created_at__lt=params['until']).count()
+    run.processed_wallets = run.statements.count()
+    run.status = 'PROCESSING'
+    run.started_at = run.started_at or timezone.now()
+    run.save(update_fields=['total_wallets', 'processed_wallets', 'status', 'started_at'])
+    return run, bounds
+
+
+def process_chunk(run_id, first_wallet_id, next_wallet_id=None):
+    """
+    Write the statements of the wallets in ``[first_wallet_id, next_wallet_id)``
+    that do not have one yet. Returns how many were written.
+    """
+    run = StatementRun.objects.get(id=run_id)
+    connection, tables, params, pending = _run_sql(run)
+    params.update(first=first_wallet_id, next=next_wallet_id, now=timezone.now())
+    upper = 'AND w.id < %(next)s::uuid' if next_wallet_id else ''
+    net = 'r.deposits_total - r.withdrawals_total + r.transfers_in_total - r.transfers_out_total'
+    sums = ', '.join(f"SUM(r.{name}) AS {name}" for name in TOTALS)
+    columns = ', '.join(TOTALS)
+    values = ', '.join(f"COALESCE(t.{name}, 0)" for name in TOTALS)
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        # Same opening balance fallbacks as build_statement
+        cursor.execute(f"""
+            WITH w AS (
+                SELECT w.id, w.currency, w.balance FROM {tables['wallets']} AS w
+                WHERE w.id >= %(first)s::uuid {upper} AND {pending}
+            ),
+            t AS (
+                SELECT r.wallet_id, {sums},
+                    (ARRAY_AGG(r.closing_balance ORDER BY r.day DESC))[1] AS closing_balance,
+                    (ARRAY_AGG(r.closing_balance - ({net}) ORDER BY r.day))[1] AS opening_balance
+                FROM {tables['rollups']} AS r JOIN w ON r.wallet_id = w.id
+                WHERE r.day BETWEEN %(start)s AND %(end)s
+                GROUP BY r.wallet_id
+            ),
+            b AS (
+                SELECT w.id, w.currency, COALESCE(
+                    previous.closing_balance, t.opening_balance, following.opening_balance,
+                    w.balance + (SELECT COALESCE(SUM(balance), 0) FROM {tables['slots']} WHERE wallet_id = w.id)
+                ) AS opening_balance
+                FROM w LEFT JOIN t ON t.wallet_id = w.id
+                LEFT JOIN LATERAL (
+                    SELECT r.closing_balance FROM {tables['rollups']} AS r
+                    WHERE r.wallet_id = w.id AND r.day < %(start)s ORDER BY r.day DESC LIMIT 1
+                ) AS previous ON TRUE
+                LEFT JOIN LATERAL (
+                    SELECT r.closing_balance - ({net}) AS opening_balance FROM {tables['rollups']} AS r
+                    WHERE r.wallet_id = w.id AND r.day > %(end)s ORDER BY r.day LIMIT 1
+                ) AS following ON TRUE
+            )
+            INSERT INTO {tables['statements']} (
+                run_id, wallet_id, period_start, period_end, currency,
+                opening_balance, closing_balance, {columns}, created_at
+            )
+            SELECT %(run)s, b.id, %(start)s, %(end)s, b.currency,
+                b.opening_balance, COALESCE(t.closing_balance, b.opening_balance), {values}, %(now)s
+            FROM b LEFT JOIN t ON t.wallet_id = b.id
+            ON CONFLICT (wallet_id, period_start) DO NOTHING
+        """, params)
+        written = cursor.rowcount
+        StatementRun.objects.filter(id=run_id).update(processed_wallets=F('processed_wallets') + written)
+    return written
+
+
+def finish_run(run_id):
+    """Mark a run completed and return it"""
+    StatementRun.objects.filter(id=run_id, status='PROCESSING').update(status='COMPLETED', completed_at=timezone.now())
+    return StatementRun.objects.get(id=run_id)
+
+
+def describe_run(run):
+    """One-line progress, runtime and throughput summary of a run"""
+    summary = f"Statements {run.period_start:%Y-%m}: {run.processed_wallets}/{run.total_wallets} wallets {run.status}"
+    if run.duration:
+        summary += f" in {run.duration:.1f}s ({run.throughput:.0f} wallets/s)"
+    return summary
@@ -1,80 +1,217 @@
-from celery import shared_task
+import logging
+from contextlib import nullcontext
+
+from celery import chord, group, shared_task
+from django.conf import settings
+from django.db import OperationalError, connections, transaction
 from django.utils import timezone
 from datetime import timedelta
-from .models import Transaction
+from . import archive, outbox, partitions, payouts, purge, routing, sharding, statements
+from .models import PayoutJob, Wallet, WalletBalanceSlot, WalletDailyRollup
+
+logger = logging.getLogger(__name__)
 
 
 @shared_task
 def cleanup_old_transactions():
-    """Clean up old failed transactions (older than 30 days)"""
-    cutoff_date = timezone.now() - timedelta(days=30)
-    deleted_count, _ = Transaction.objects.filter(
-        status='FAILED',
-        created_at__lt=cutoff_date
-    ).delete()
-    
-    return f"Deleted {deleted_count} old failed transactions"
+    """Clean up old failed transactions (older than 30 days), in batches (see wallet.purge)"""
+    # Only reads the partitions of months before the cutoff
+    results = [purge.run(purge.FAILED_TRANSACTIONS, using=shard) for shard in sharding.each_shard()]
+
+    return f"Deleted old failed transactions: {purge.describe(results)}"
 
 
 @shared_task
-def process_transaction_notification(transaction_id):
-    """Process transaction notification (placeholder for future implementation)"""
-    try:
-        transaction = Transaction.objects.get(id=transaction_id)
-        # Here you would implement notification logic
-        # e.g., send email, push notification, etc.
-        print(f"Processing notification for transaction: {transaction.reference}")
-        return f"Notification processed for transaction {transaction.reference}"
-    except Transaction.DoesNotExist:
-        return f"Transaction {transaction_id} not found"
+def maintain_transaction_partitions():
+    """Create the coming months' transaction partitions and expire those past retention"""
+    created, expired = [], []
+    for shard in sharding.each_shard():
+        connection = connections[shard]
+        if not partitions.is_partitioned(connection):
+            continue
+        with transaction.atomic(using=shard):
+            created += partitions.ensure_partitions(connection)
+            expired += partitions.expire_partitions(connection)
+
+    return f"Created {len(created)} and expired {len(expired)} transaction partitions"
+
+
+@shared_task
+def archive_transactions():
+    """Move settled transactions older than ARCHIVE_AFTER_DAYS to cold storage (see wallet.archive)"""
+    if not settings.ARCHIVE_AFTER_DAYS:
+        return "Transaction archiving is disabled"
+    results = [archive.run(shard) for shard in sharding.each_shard()]
+
+    return (
+        f"Archived {sum(result.rows for result in results)} transactions of "
+        f"{sum(result.wallets for result in results)} wallets into {sum(result.files for result in results)} files"
+    )
+
+
+@shared_task
+def purge_expired_idempotency_keys():
+    """Delete expired Idempotency-Key records"""
+    results = [purge.run(purge.EXPIRED_IDEMPOTENCY_KEYS, using=shard) for shard in sharding.each_shard()]
+
+    return f"Deleted expired idempotency keys: {purge.describe(results)}"
+
+
+@shared_task
+def consolidate_hot_wallets():
+    """Fold the balance slots of hot wallets back into their main balances"""
+    consolidated = 0
+    for shard in sharding.each_shard():
+        wallet_ids = set(
+            WalletBalanceSlot.objects.using(shard).exclude(balance=0).values_list('wallet_id', flat=True)
+        )
+        for wallet in Wallet.objects.using(shard).filter(id__in=wallet_ids).only('id', 'user_id'):
+            with transaction.atomic(using=shard):
+                # A wallet moved to another shard is consolidated there
+                if sharding.held(shard, [wallet.user_id]):
+                    Wallet.objects.consolidate_balance_slots(wallet)
+                    consolidated += 1
+
+    return f"Consolidated balance slots of {consolidated} hot wallets"
+
+
+@shared_task
+def process_transaction_notification(user_id, events):
+    """Notify a user of a batch of their transaction events, from the events' payloads (see wallet.outbox)"""
+    references = [event['transaction']['reference'] for event in events]
+    logger.info("Notifying user %s of transactions %s", user_id, ', '.join(references))
+    return f"Notification processed for {len(events)} transactions of user {user_id}"
+
+
+def _notify(groups):
+    """Dispatch one notification task per user of a relayed outbox batch"""
+    group(process_transaction_notification.s(user_id, events) for user_id, events in groups.items()).apply_async()
+
+
+@shared_task
+def relay_outbox():
+    """Relay queued transaction events to notification tasks, in batches (see wallet.outbox)"""
+    results = [outbox.relay(shard, _notify) for shard in sharding.each_shard()]
+
+    return f"Relayed {sum(result.events for result in results)} outbox events"
 
 
 @shared_task
 def generate_monthly_statement(user_id, year, month):
-    """Generate monthly statement for a user"""
+    """Generate monthly statement for a user from the daily rollups"""
     from .models import User
-    from django.db.models import Sum
-    
+
+    start_date, end_date = statements.month_bounds(year, month)
+    # A finished month's rollups no longer change, so a fresh replica has them;
+    # the current month is read where its rollups were just refreshed
+    finished = end_date < timezone.now().date()
     try:
-        user = User.objects.get(id=user_id)
-        wallet = user.wallet
-        
-        # Get transactions for the specified month
-        start_date = timezone.datetime(year, month, 1, tzinfo=timezone.utc)
-        if month == 12:
-            end_date = timezone.datetime(year + 1, 1, 1, tzinfo=timezone.utc)
-        else:
-            end_date = timezone.datetime(year, month + 1, 1, tzinfo=timezone.utc)
-        
-        transactions = Transaction.objects.filter(
-            wallet=wallet,
-            created_at__gte=start_date,
-            created_at__lt=end_date,
-            status='COMPLETED'
-        )
-        
-        # Calculate totals
-        total_deposits = transactions.filter(transaction_type='DEPOSIT').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        total_withdrawals = transactions.filter(transaction_type='WITHDRAWAL').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
+        with (
+            sharding.use_shard(sharding.shard_for_user(user_id)),
+            routing.replica_reads() if finished else nullcontext(),
+        ):
+            user = User.objects.get(id=user_id)
+            wallet = user.wallet
+            statement = statements.build_statement(wallet, start_date, end_date)
+
         statement_data = {
             'user': user.email,
             'month': f"{year}-{month:02d}",
-            'total_deposits': total_deposits,
-            'total_withdrawals': total_withdrawals,
-            'net_change': total_deposits - total_withdrawals,
-            'transaction_count': transactions.count(),
-            'ending_balance': wallet.balance
+            'total_deposits': statement['deposits_total'],
+            'total_withdrawals': statement['withdrawals_total'],
+            'total_transfers_in': statement['transfers_in_total'],
+            'total_transfers_out': statement['transfers_out_total'],
+            'net_change': statement['net_change'],
+            'transaction_count': statement['transaction_count'],
+            'opening_balance': statement['opening_balance'],
+            'ending_balance': statement['closing_balance'],
         }
-        
+
         # Here you would save or send the statement
         print(f"Generated statement for {user.email}: {statement_data}")
         return statement_data
-        
+
     except User.DoesNotExist:
-        return f"User {user_id} not found" 
\ No newline at end of file
+        return f"User {user_id} not found"
+
+
+@shared_task
+def refresh_daily_rollups():
+    """Recompute the daily rollups of wallet days written to since the last run"""
+    refreshed = 0
+    for shard in sharding.each_shard():
+        while True:
+            count = WalletDailyRollup.objects.db_manager(shard).refresh()
+            refreshed += count
+            if count < settings.ROLLUP_REFRESH_BATCH:
+                break
+
+    return f"Refreshed {refreshed} wallet day rollups"
+
+
+@shared_task
+def start_statement_run(year=None, month=None):
+    """Generate (or resume) every wallet's statement for a month, last month by default"""
+    if year is None:
+        last_month = timezone.now().date().replace(day=1) - timedelta(days=1)
+        year, month = last_month.year, last_month.month
+    # Each shard has its own run over its own wallets
+    summaries = []
+    for shard in sharding.each_shard():
+        with sharding.use_shard(shard):
+            run, bounds = statements.start_run(year, month, settings.STATEMENT_CHUNK_SIZE)
+            if not bounds:
+                summaries.append(statements.describe_run(statements.finish_run(run.id)))
+                continue
+
+        chunks = group(
+            process_statement_chunk.s(run.id, first, following, shard=shard) for first, following in bounds
+        )
+        chord(chunks)(finish_statement_run.si(run.id, shard=shard))
+        summaries.append(f"Dispatched {len(bounds)} chunks for statement run {run.id}")
+    return '; '.join(summaries)
+
+
+@shared_task(bind=True, max_retries=3)
+def process_statement_chunk(self, run_id, first_wallet_id, next_wallet_id, shard='default'):
+    """Write the statements of one range of wallets"""
+    try:
+        with sharding.use_shard(shard):
+            written = statements.process_chunk(run_id, first_wallet_id, next_wallet_id)
+    except OperationalError as exc:
+        # Each chunk is a single transaction, so a retry starts from scratch
+        raise self.retry(exc=exc, countdown=5)
+
+    return written
+
+
+@shared_task
+def finish_statement_run(run_id, shard='default'):
+    """Complete a statement run once all its chunks are done"""
+    with sharding.use_shard(shard):
+        return statements.describe_run(statements.finish_run(run_id))
+
+
+@shared_task
+def process_payout_job(job_id):
+    """Split a payout job into chunks and credit them in parallel"""
+    PayoutJob.objects.filter(id=job_id, status='PENDING').update(
+        status='PROCESSING', started_at=timezone.now()
+    )
+    # Only pending items are chunked, so re-running this resumes a stalled job
+    bounds = payouts.chunk_bounds(job_id, settings.PAYOUT_CHUNK_SIZE)
+    group(process_payout_chunk.s(job_id, first, last) for first, last in bounds).apply_async()
+
+    return f"Dispatched {len(bounds)} chunks for payout job {job_id}"
+
+
+@shared_task(bind=True, max_retries=3)
+def process_payout_chunk(self, job_id, first_item_id, last_item_id):
+    """Credit one chunk of a payout job"""
+    try:
+        succeeded, failed = payouts.process_chunk(job_id, first_item_id, last_item_id)
+    except (OperationalError, sharding.BucketMoved) as exc:
+        # Credits already committed on a shard are found again by the retry
+        raise self.retry(exc=exc, countdown=5)
+
+    return f"Payout job {job_id}: {succeeded} credited, {failed} failed"
@@ -1,16 +1,86 @@
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase, APIClient
-from rest_framework import status
+from rest_framework import serializers, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import RefreshToken
+from datetime import timedelta
 from decimal import Decimal
+import csv
+import gzip
+import io
 import json
+import threading
+import time
+from unittest import mock
+from uuid import RFC_4122, uuid4
 
-from .models import Wallet, Transaction
+import msgpack
+import redis
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connection, connections, router
+from django.test.utils import CaptureQueriesContext
+from django.http import QueryDict
+from django.db.models import Sum
+
+from . import cache as wallet_cache, ids, ledger, metrics, partitions, rebalance, revocation, routing, sharding, throttling
+from .middleware import monitor as load_monitor
+from .pagination import seek
+from .projections import Projection
+from .redis_client import get_redis
+from .renderers import ORJSONRenderer
+from .serializers import (
+    FlatTransactionSerializer, TRANSACTION_LIST_PROJECTION, TransactionListSerializer, WalletSerializer,
+)
+from .filters import filter_transactions
+from .tasks import (
+    consolidate_hot_wallets, generate_monthly_statement, maintain_transaction_partitions, refresh_daily_rollups,
+)
+from .models import (
+    Wallet, Transaction, InsufficientBalance, PayoutJob, ShardBucket, ShardFence, WalletBalanceSlot,
+    WalletDailyRollup, StatementRun,
+)
 
 User = get_user_model()
 
 
+def index_names(index):
+    """An index and its copies on the partitions of its table, as a regex"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(%s)
+        """, [index])
+        return '|'.join([index] + [row[0] for row in cursor.fetchall()])
+
+
+def fill_transactions(rows):
+    """
+    ``rows`` transactions of another wallet, so plans are chosen against a
+    table the size of a real one rather than a few rows; returns the wallet
+    """
+    user = User.objects.create_user(username='filler', email='filler@example.com', password='testpass123')
+    wallet = Wallet.objects.create(user=user)
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO transactions (
+                id, wallet_id, transaction_type, amount, currency, status, description, reference,
+                balance_before, balance_after, created_at, updated_at
+            )
+            SELECT gen_random_uuid(), %s, (ARRAY['DEPOSIT', 'WITHDRAWAL', 'TRANSFER'])[n %% 3 + 1], n %% 500 + 1,
+                'USD', (ARRAY['COMPLETED', 'COMPLETED', 'COMPLETED', 'FAILED'])[n %% 4 + 1], 'Filler', 'FILL-' || n,
+                0, 0, now() - n * interval '1 second', now()
+            FROM generate_series(1, %s) AS n
+        """, [wallet.id, rows])
+        cursor.execute('ANALYZE transactions')
+    return wallet
+
+
 class UserModelTest(TestCase):
     """Test cases for User model"""
     
@@ -76,6 +146,254 @@ class WalletModelTest(TestCase):
             self.wallet.withdraw(Decimal('-10.00'))
 
 
+class LedgerTest(TestCase):
+    """Test cases for the ledger write path"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+
+    def test_deposit_records_balances(self):
+        txn = ledger.deposit(self.wallet, Decimal('25.00'))
+        self.assertEqual(txn.balance_before, Decimal('100.00'))
+        self.assertEqual(txn.balance_after, Decimal('125.00'))
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('125.00'))
+
+    def test_withdraw_uses_database_balance(self):
+        # Another writer changed the balance after this instance was loaded
+        Wallet.objects.filter(pk=self.wallet.pk).update(balance=Decimal('40.00'))
+        with self.assertRaises(InsufficientBalance):
+            ledger.withdraw(self.wallet, Decimal('50.00'))
+        txn = ledger.withdraw(self.wallet, Decimal('30.00'))
+        self.assertEqual(txn.balance_before, Decimal('40.00'))
+        self.assertEqual(txn.balance_after, Decimal('10.00'))
+        self.assertEqual(self.wallet.transactions.count(), 1)
+
+
+class LedgerConcurrencyTest(TransactionTestCase):
+    """Concurrent writers on one wallet must not lose updates or overdraw"""
+
+    def test_concurrent_withdrawals(self):
+        user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        wallet = Wallet.objects.create(user=user, balance=Decimal('50.00'))
+        results = []
+
+        def worker():
+            try:
+                for _ in range(10):
+                    try:
+                        ledger.withdraw(Wallet(pk=wallet.pk), Decimal('1.00'))
+                        results.append(True)
+                    except InsufficientBalance:
+                        results.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        wallet.refresh_from_db()
+        self.assertEqual(results.count(True), 50)
+        self.assertEqual(wallet.balance, Decimal('0.00'))
+        self.assertEqual(wallet.transactions.count(), 50)
+
+
+class TransferTest(APITestCase):
+    """Test cases for wallet-to-wallet transfers"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        self.recipient = User.objects.create_user(
+            username='recipient',
+            email='recipient@example.com',
+            password='testpass123'
+        )
+        self.recipient_wallet = Wallet.objects.create(user=self.recipient, balance=Decimal('10.00'))
+        self.client.force_authenticate(user=self.user)
+
+    def test_transfer(self):
+        url = reverse('wallet:transfer')
+        data = {'recipient_email': 'recipient@example.com', 'amount': '40.00'}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(str(response.data['new_balance']), '60.00')
+
+        self.wallet.refresh_from_db()
+        self.recipient_wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('60.00'))
+        self.assertEqual(self.recipient_wallet.balance, Decimal('50.00'))
+
+        credit = self.recipient_wallet.transactions.get()
+        self.assertEqual(credit.transaction_type, 'TRANSFER')
+        self.assertEqual(credit.counterparty, self.wallet)
+        self.assertEqual(credit.balance_before, Decimal('10.00'))
+        self.assertEqual(credit.balance_after, Decimal('50.00'))
+        self.assertEqual(self.wallet.transactions.get().counterparty, self.recipient_wallet)
+
+    def test_transfer_insufficient_balance(self):
+        url = reverse('wallet:transfer')
+        data = {'recipient_email': 'recipient@example.com', 'amount': '150.00'}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.recipient_wallet.refresh_from_db()
+        self.assertEqual(self.recipient_wallet.balance, Decimal('10.00'))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_transfer_to_self(self):
+        url = reverse('wallet:transfer')
+        data = {'recipient_email': 'test@example.com', 'amount': '10.00'}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_transfer_unknown_recipient(self):
+        url = reverse('wallet:transfer')
+        data = {'recipient_email': 'nobody@example.com', 'amount': '10.00'}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TransferConcurrencyTest(TransactionTestCase):
+    """Opposite-direction transfers between two wallets must not deadlock"""
+
+    def test_opposite_direction_transfers(self):
+        wallets = []
+        for name in ('alice', 'bob'):
+            user = User.objects.create_user(username=name, email=f'{name}@example.com', password='testpass123')
+            wallets.append(Wallet.objects.create(user=user, balance=Decimal('100.00')))
+        errors = []
+
+        def worker(source, destination):
+            try:
+                for _ in range(20):
+                    ledger.transfer(source, destination, Decimal('1.00'))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(wallets[n % 2], wallets[(n + 1) % 2]))
+            for n in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        balances = sorted(Wallet.objects.values_list('balance', flat=True))
+        self.assertEqual(balances, [Decimal('100.00'), Decimal('100.00')])
+        self.assertEqual(Transaction.objects.count(), 6 * 20 * 2)
+
+
+class HotWalletTest(TestCase):
+    """Test cases for hot wallets with sharded balance slots"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='merchant',
+            email='merchant@example.com',
+            password='testpass123'
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        self.wallet.enable_hot_mode(4)
+
+    def test_credits_land_on_slots(self):
+        for _ in range(8):
+            txn = ledger.deposit(self.wallet, Decimal('10.00'))
+            self.assertEqual(txn.balance_after - txn.balance_before, Decimal('10.00'))
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('100.00'))
+        self.assertEqual(self.wallet.total_balance, Decimal('180.00'))
+        self.assertEqual(txn.balance_after, Decimal('180.00'))
+
+    def test_debit_consolidates_slots(self):
+        ledger.deposit(self.wallet, Decimal('50.00'))
+        txn = ledger.withdraw(self.wallet, Decimal('120.00'))
+        self.assertEqual(txn.balance_after, Decimal('30.00'))
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('30.00'))
+        self.assertFalse(WalletBalanceSlot.objects.filter(wallet=self.wallet).exclude(balance=0).exists())
+        with self.assertRaises(InsufficientBalance):
+            ledger.withdraw(self.wallet, Decimal('31.00'))
+
+    def test_transfer_into_hot_wallet(self):
+        user = User.objects.create_user(username='payer', email='payer@example.com', password='testpass123')
+        payer = Wallet.objects.create(user=user, balance=Decimal('20.00'))
+        debit, credit = ledger.transfer(payer, self.wallet, Decimal('15.00'))
+        self.assertEqual(debit.balance_after, Decimal('5.00'))
+        self.assertEqual(credit.balance_after, Decimal('115.00'))
+        self.assertEqual(self.wallet.total_balance, Decimal('115.00'))
+
+    def test_consolidate_and_disable(self):
+        ledger.deposit(self.wallet, Decimal('25.00'))
+        self.assertEqual(consolidate_hot_wallets(), "Consolidated balance slots of 1 hot wallets")
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('125.00'))
+
+        self.wallet.disable_hot_mode()
+        ledger.deposit(self.wallet, Decimal('5.00'))
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('130.00'))
+        self.assertEqual(self.wallet.total_balance, Decimal('130.00'))
+
+
+class HotWalletConcurrencyTest(TransactionTestCase):
+    """Concurrent credits and debits on a hot wallet must not lose updates"""
+
+    def test_concurrent_credits_and_debits(self):
+        user = User.objects.create_user(username='merchant', email='merchant@example.com', password='testpass123')
+        wallet = Wallet.objects.create(user=user, balance=Decimal('0.00'))
+        wallet.enable_hot_mode(4)
+        errors = []
+
+        def worker(debit):
+            try:
+                hot = Wallet.objects.get(pk=wallet.pk)
+                for _ in range(20):
+                    if debit:
+                        try:
+                            ledger.withdraw(hot, Decimal('1.00'))
+                        except InsufficientBalance:
+                            ledger.deposit(hot, Decimal('1.00'))
+                    else:
+                        ledger.deposit(hot, Decimal('2.00'))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n % 2 == 1,)) for n in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        wallet.refresh_from_db()
+        deposits = wallet.transactions.filter(transaction_type='DEPOSIT').aggregate(total=Sum('amount'))['total']
+        withdrawals = wallet.transactions.filter(transaction_type='WITHDRAWAL').aggregate(total=Sum('amount'))['total'] or 0
+        self.assertEqual(wallet.total_balance, deposits - withdrawals)
+        self.assertGreaterEqual(wallet.balance, Decimal('0.00'))
+
+
 class TransactionModelTest(TestCase):
     """Test cases for Transaction model"""
     
@@ -110,7 +428,29 @@ class TransactionModelTest(TestCase):
             balance_after=Decimal('80.00')
         )
         self.assertTrue(transaction.reference.startswith('TXN-'))
-        self.assertEqual(len(transaction.reference), 12)  # TXN- + 8 chars
+        self.assertEqual(len(transaction.reference), 30)  # TXN- + 26 chars
+        self.assertEqual(transaction.reference, Transaction.generate_reference(transaction.id))
+
+
+class IdsTest(TestCase):
+    """Test cases for time-ordered identifiers"""
+
+    def test_uuid7_is_monotonic(self):
+        generated = [ids.uuid7() for _ in range(10000)]
+        self.assertEqual(generated, sorted(generated, key=lambda value: value.int))
+        self.assertEqual(len(set(generated)), len(generated))
+        self.assertEqual(generated[0].version, 7)
+        self.assertEqual(generated[0].variant, RFC_4122)
+
+    def test_references_sort_like_ids(self):
+        first, second = ids.uuid7(), ids.uuid7()
+        self.assertLess(ids.encode_base32(first), ids.encode_base32(second))
+        self.assertEqual(len(ids.encode_base32(first)), 26)
+
+    @override_settings(ID_GENERATOR='uuid.uuid4')
+    def test_generator_is_pluggable(self):
+        user = User.objects.create_user(username='v4', email='v4@example.com', password='testpass123')
+        self.assertEqual(user.id.version, 4)
 
 
 class WalletAPITest(APITestCase):
@@ -260,6 +600,1808 @@ class WalletAPITest(APITestCase):
         self.assertEqual(response.data['first_name'], 'Updated')
 
 
+class TransactionPaginationTest(APITestCase):
+    """Test cases for keyset pagination of transaction history"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        Transaction.objects.bulk_create([
+            Transaction(
+                wallet=self.wallet,
+                transaction_type='DEPOSIT',
+                amount=Decimal('1.00'),
+                status='COMPLETED',
+                balance_before=Decimal('100.00'),
+                balance_after=Decimal('101.00'),
+            )
+            for _ in range(45)
+        ])
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('wallet:transaction_history')
+
+    def test_walk_all_pages(self):
+        expected = [str(pk) for pk in self.wallet.transactions.order_by('-created_at', '-id').values_list('id', flat=True)]
+        seen = []
+        pages = []
+        url = self.url + '?cursor='
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            pages.append(response.data)
+            seen.extend(str(row['id']) for row in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+        self.assertEqual([len(page['results']) for page in pages], [20, 20, 5])
+
+        previous = self.client.get(pages[2]['previous'])
+        self.assertEqual(previous.data['results'], pages[1]['results'])
+        self.assertIsNotNone(previous.data['next'])
+
+    def test_page_numbers_still_work(self):
+        response = self.client.get(self.url, {'page': 2})
+        self.assertEqual(response.data['count'], 45)
+        self.assertEqual(len(response.data['results']), 20)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_pages_use_index_range_scan(self):
+        newest = self.wallet.transactions.order_by('-created_at', '-id').first()
+        queryset = seek(self.wallet.transactions.all(), (newest.created_at, newest.id))[:21]
+        fill_transactions(20000)
+        plan = queryset.explain()
+        # The row comparison is an index condition, not a filter over the wallet's rows
+        self.assertRegex(plan, index_names('txn_wallet_history_idx'))
+        self.assertRegex(plan, r'Index Cond: .*\(ROW\(created_at, id\) < ROW\(')
+        self.assertNotIn('Sort  (', plan)
+
+
+class TransactionFilterTest(APITestCase):
+    """Test cases for transaction history filters and search"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        rows = [
+            ('DEPOSIT', 'COMPLETED', '10.00', 'Salary for March'),
+            ('WITHDRAWAL', 'COMPLETED', '25.50', 'Coffee beans'),
+            ('TRANSFER', 'FAILED', '99.99', 'Rent share'),
+            ('DEPOSIT', 'PENDING', '500.00', 'Salary bonus'),
+        ]
+        self.transactions = Transaction.objects.bulk_create([
+            Transaction(
+                wallet=self.wallet,
+                transaction_type=transaction_type,
+                status=txn_status,
+                amount=Decimal(amount),
+                description=description,
+                balance_before=Decimal('100.00'),
+                balance_after=Decimal('100.00'),
+            )
+            for transaction_type, txn_status, amount, description in rows
+        ])
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('wallet:transaction_history')
+
+    def _descriptions(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(row['description'] for row in response.data['results'])
+
+    def test_filters(self):
+        self.assertEqual(self._descriptions({'transaction_type': 'DEPOSIT'}), ['Salary bonus', 'Salary for March'])
+        self.assertEqual(self._descriptions({'status': 'FAILED'}), ['Rent share'])
+        self.assertEqual(self._descriptions({'min_amount': '20', 'max_amount': '100'}), ['Coffee beans', 'Rent share'])
+        self.assertEqual(self._descriptions({'currency': 'EUR'}), [])
+        self.assertEqual(self._descriptions({'created_after': '2000-01-01', 'status': 'PENDING'}), ['Salary bonus'])
+        self.assertEqual(self._descriptions({'created_before': '2000-01-01'}), [])
+
+    def test_search(self):
+        self.assertEqual(self._descriptions({'search': 'salary'}), ['Salary bonus', 'Salary for March'])
+        self.assertEqual(self._descriptions({'search': 'salary -bonus'}), ['Salary for March'])
+        reference = self.transactions[1].reference
+        self.assertEqual(self._descriptions({'search': reference}), ['Coffee beans'])
+
+    def test_invalid_filters(self):
+        response = self.client.get(self.url, {'min_amount': '5', 'max_amount': '1'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'status': 'UNKNOWN'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filters_use_indexes(self):
+        Transaction.objects.bulk_create([
+            Transaction(
+                wallet=self.wallet,
+                transaction_type='DEPOSIT',
+                status='COMPLETED',
+                amount=Decimal(n % 1000 + 1),
+                currency='EUR' if n % 2 else 'USD',
+                description=f'Payment {n}',
+                balance_before=Decimal('100.00'),
+                balance_after=Decimal('100.00'),
+            )
+            for n in range(2000)
+        ])
+        filler = fill_transactions(20000)
+        # Index and the column its Index Cond must cover; the page's order comes from the index
+        expected = {
+            'created_after=2000-01-01&created_before=2100-01-01': ('txn_wallet_history_idx', 'created_at'),
+            'transaction_type=TRANSFER': ('txn_wallet_type_idx', 'transaction_type'),
+            'status=FAILED': ('txn_wallet_status_idx', 'status'),
+            'status=COMPLETED': ('txn_wallet_status_idx', 'status'),
+            'min_amount=100&max_amount=900': ('txn_wallet_history_idx', 'amount'),
+            'currency=EUR': ('txn_wallet_currency_idx', 'currency'),
+        }
+        for params, (index, column) in expected.items():
+            queryset = filter_transactions(self.wallet.transactions.all(), QueryDict(params))
+            plan = queryset.order_by('-created_at', '-id')[:21].explain()
+            self.assertRegex(plan, rf'Index Scan (Backward )?using ({index_names(index)}) ', f"{params}:\n{plan}")
+            self.assertRegex(plan, rf'Index Cond: .*\b{column}\b', f"{params}:\n{plan}")
+            self.assertNotIn('Sort  (', plan, f"{params}:\n{plan}")
+
+        # Search goes through the GIN index once a wallet's rows outnumber the matches by far
+        plan = filter_transactions(filler.transactions.all(), QueryDict('search=rent'))[:21].explain()
+        self.assertRegex(plan, rf'Bitmap Index Scan on ({index_names("txn_search_idx")})', plan)
+
+
+class TransactionExportTest(APITestCase):
+    """Test cases for streaming transaction exports"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        for amount in ('1.00', '2.00', '3.00', '4.00', '5.00'):
+            ledger.deposit(self.wallet, Decimal(amount), description='Top-up, "card"')
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        ledger.deposit(Wallet.objects.create(user=other), Decimal('9.00'))
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('wallet:transaction_export')
+
+    def _body(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_ndjson(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self._body(response).splitlines()]
+        expected = FlatTransactionSerializer(self.wallet.transactions.order_by('created_at', 'id'), many=True).data
+        self.assertEqual(rows, json.loads(JSONRenderer().render(expected)))
+        self.assertEqual([row['amount'] for row in rows], ['1.00', '2.00', '3.00', '4.00', '5.00'])
+
+    def test_csv(self):
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(io.StringIO(self._body(response).decode())))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['description'], 'Top-up, "card"')
+        self.assertEqual(rows[0]['counterparty'], '')
+        self.assertTrue(rows[0]['created_at'].endswith('Z'))
+
+    def test_gzip_and_date_range(self):
+        newest = self.wallet.transactions.order_by('-created_at').first()
+        response = self.client.get(
+            self.url, {'created_before': newest.created_at.isoformat()}, HTTP_ACCEPT_ENCODING='gzip, deflate'
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(gzip.decompress(self._body(response)).splitlines()), 4)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_streams_in_chunks(self):
+        chunks = list(self.client.get(self.url).streaming_content)
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks], [1, 2, 2])
+
+    def test_invalid_filter_is_json(self):
+        response = self.client.get(self.url, {'format': 'csv', 'min_amount': 'lots'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('min_amount', response.json())
+
+
+class QueryBudgetTest(APITestCase):
+    """Per-endpoint query budgets for transaction reads and writes"""
+
+    def setUp(self):
+        user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        wallet = Wallet.objects.create(user=user, balance=Decimal('100.00'))
+        self.txn = ledger.deposit(wallet, Decimal('5.00'))
+        self._authenticate()
+
+    def _authenticate(self):
+        # A freshly loaded user, like the one authentication attaches to a request
+        self.client.force_authenticate(user=User.objects.get(email='test@example.com'))
+
+    def test_transaction_detail(self):
+        url = reverse('wallet:transaction_detail', args=[self.txn.id])
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        # The wallet and its owner are nested unless the flat mode is asked for
+        wallet = WalletSerializer(Wallet.objects.get(pk=self.txn.wallet_id)).data
+        self.assertEqual(response.data['wallet'], wallet)
+        self.assertEqual(response.data['wallet']['user']['email'], 'test@example.com')
+
+    def test_transaction_detail_flat(self):
+        url = reverse('wallet:transaction_detail', args=[self.txn.id])
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'mode': 'flat'})
+        self.assertEqual(response.data['wallet'], self.txn.wallet_id)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'mode': 'flat', 'expand': 'wallet,user'})
+        self.assertEqual(response.data['wallet']['id'], str(self.txn.wallet_id))
+        self.assertEqual(response.data['wallet']['user']['email'], 'test@example.com')
+
+        response = self.client.get(url, {'mode': 'flat', 'expand': 'wallet'})
+        self.assertEqual(response.data['wallet']['user'], self.txn.wallet.user_id)
+
+    def test_transaction_history(self):
+        # Row count and latest update for the ETag, archive segments, then the page (and its count)
+        url = reverse('wallet:transaction_history')
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        with self.assertNumQueries(3):
+            self.client.get(url, {'cursor': ''})
+        with self.assertNumQueries(1):
+            self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_topup_and_withdraw(self):
+        # Wallet lookup, savepoint, UPDATE ... RETURNING, INSERT, rollup mark, outbox event, release
+        with self.assertNumQueries(7):
+            response = self.client.post(reverse('wallet:topup_wallet'), {'amount': '1.00', 'currency': 'USD'}, format='json')
+        self.assertEqual(response.data['transaction']['wallet']['id'], str(self.txn.wallet_id))
+        self._authenticate()
+        with self.assertNumQueries(7):
+            response = self.client.post(
+                reverse('wallet:withdraw_wallet') + '?mode=flat', {'amount': '1.00'}, format='json'
+            )
+        self.assertEqual(response.data['transaction']['wallet'], self.txn.wallet_id)
+
+
+class BalanceCacheTest(APITestCase):
+    """Test cases for the read-through wallet balance cache"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('wallet:wallet_balance')
+        wallet_cache.clear_local()
+        wallet_cache.reset_stats()
+
+    def test_balance_served_from_cache(self):
+        if not wallet_cache.local_tier_ready(timeout=2):
+            self.skipTest('Redis is not available')
+        with self.assertNumQueries(2):
+            first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.data['balance'], '100.00')
+        self.assertEqual(second.data['user']['email'], 'test@example.com')
+        self.assertEqual(wallet_cache.stats()['hit_rate'], 0.5)
+
+    def test_balance_served_from_redis(self):
+        client = get_redis()
+        try:
+            client.ping()
+        except (AttributeError, redis.RedisError):
+            self.skipTest('Redis is not available')
+        self.client.get(self.url)
+        wallet_cache.clear_local()
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+        self.assertEqual(wallet_cache.stats()['redis_hits'], 2)
+
+    @override_settings(WALLET_CACHE_LOCAL_TTL=60)
+    def test_other_processes_drop_their_local_copy(self):
+        if not wallet_cache.local_tier_ready(timeout=2):
+            self.skipTest('Redis is not available')
+        self.client.get(self.url)
+        # Another process moves money: it writes, drops the Redis copy and publishes the invalidation
+        Wallet.objects.filter(pk=self.wallet.pk).update(balance=Decimal('70.00'))
+        key = wallet_cache._state_key(self.wallet.pk)
+        get_redis().pipeline().delete(key).publish(wallet_cache.INVALIDATIONS_CHANNEL, json.dumps([key])).execute()
+        deadline = time.monotonic() + 2
+        while self.client.get(self.url).data['balance'] != '70.00' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.client.get(self.url).data['balance'], '70.00')
+
+    def test_local_tier_unused_while_unsubscribed(self):
+        self.client.get(self.url)
+        # Without Redis to hear invalidations from, nothing is served from the local tier
+        with mock.patch('wallet.cache._invalidations.ready', return_value=False), \
+                mock.patch('wallet.cache.get_redis', return_value=None):
+            with self.assertNumQueries(2):
+                self.client.get(self.url)
+        self.assertEqual(wallet_cache.stats()['local_hits'], 0)
+
+    def test_writes_invalidate(self):
+        self.client.get(self.url)
+        self.client.post(reverse('wallet:topup_wallet'), {'amount': '25.00', 'currency': 'USD'}, format='json')
+        self.assertEqual(self.client.get(self.url).data['balance'], '125.00')
+
+        other = Wallet.objects.create(user=User.objects.create_user(username='other', email='other@example.com'))
+        ledger.transfer(self.wallet, other, Decimal('5.00'))
+        self.assertEqual(self.client.get(self.url).data['balance'], '120.00')
+
+    def test_invalidated_again_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Wallet.objects.credit(self.wallet, Decimal('1.00'))
+            # A reader caching the pre-commit balance before the commit
+            wallet_cache.wallet_state(self.wallet.pk, lambda: {'balance': '100.00'})
+        state = wallet_cache.wallet_state(self.wallet.pk, lambda: {'balance': '101.00'})
+        self.assertEqual(state['balance'], '101.00')
+
+    def test_concurrent_misses_load_once(self):
+        loads = []
+        barrier = threading.Barrier(8)
+
+        def load():
+            loads.append(1)
+            time.sleep(0.05)
+            return {'balance': '1.00'}
+
+        def read():
+            barrier.wait()
+            results.append(wallet_cache.wallet_state(key, load))
+
+        key, results = uuid4(), []
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(results, [{'balance': '1.00'}] * 8)
+
+    def test_works_without_redis(self):
+        with mock.patch('wallet.cache.get_redis', return_value=None):
+            self.assertEqual(self.client.get(self.url).data['balance'], '100.00')
+            self.client.post(reverse('wallet:withdraw_wallet'), {'amount': '40.00'}, format='json')
+            self.assertEqual(self.client.get(self.url).data['balance'], '60.00')
+
+    def test_new_wallet_replaces_cached_absence(self):
+        user = User.objects.create_user(username='new', email='new@example.com', password='testpass123')
+        self.client.force_authenticate(user=user)
+        self.assertIsNone(wallet_cache.wallet_id_for(user.pk, lambda: None))
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['id'], str(user.wallet.id))
+        self.assertEqual(self.client.get(self.url).data['id'], response.data['id'])
+
+
+class ConditionalGetTest(APITestCase):
+    """Test cases for ETag / Last-Modified on polled endpoints"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        ledger.deposit(self.wallet, Decimal('10.00'))
+        self.client.force_authenticate(user=self.user)
+        wallet_cache.clear_local()
+
+    def _revalidate(self, url, **headers):
+        first = self.client.get(url, **headers)
+        self.assertEqual(first['Cache-Control'], 'private, no-cache')
+        return first, self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'], **headers)
+
+    def test_balance(self):
+        url = reverse('wallet:wallet_balance')
+        first, second = self._revalidate(url)
+        self.assertEqual(second.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertFalse(first.has_header('Last-Modified'))
+
+        self.client.post(reverse('wallet:topup_wallet'), {'amount': '5.00', 'currency': 'USD'}, format='json')
+        third = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(third.status_code, status.HTTP_200_OK)
+        self.assertEqual(third.data['balance'], '115.00')
+
+    def test_history(self):
+        url = reverse('wallet:transaction_history')
+        first, second = self._revalidate(url)
+        self.assertEqual(second.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertNotEqual(self.client.get(url, {'transaction_type': 'DEPOSIT'})['ETag'], first['ETag'])
+        self.assertNotEqual(self.client.get(url, HTTP_ACCEPT='application/msgpack')['ETag'], first['ETag'])
+
+        ledger.withdraw(self.wallet, Decimal('1.00'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, status.HTTP_200_OK)
+        self.assertFalse(first.has_header('Last-Modified'))
+
+        # Edits and removals of older rows change the version too
+        etag = self.client.get(url)['ETag']
+        txn = self.wallet.transactions.order_by('created_at').first()
+        txn.status = 'FAILED'
+        txn.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][-1]['status'], 'FAILED')
+
+        etag = response['ETag']
+        Transaction.objects.filter(pk=txn.pk).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+        # Hot-wallet credits bump a balance slot's version, not the wallet row's
+        self.wallet.enable_hot_mode(2)
+        etag = self.client.get(url)['ETag']
+        version = Wallet.objects.values_list('history_version', flat=True).get(pk=self.wallet.pk)
+        ledger.deposit(self.wallet, Decimal('3.00'))
+        self.assertEqual(Wallet.objects.values_list('history_version', flat=True).get(pk=self.wallet.pk), version)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+        etag = self.client.get(url)['ETag']
+        Wallet.objects.consolidate_balance_slots(self.wallet)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_profile_last_modified(self):
+        url = reverse('wallet:profile')
+        with self.assertNumQueries(0):
+            first = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.put(url, {'first_name': 'Updated'}, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['first_name'], 'Updated')
+
+
+class DailyRollupTest(APITestCase):
+    """Test cases for daily rollups and statements built from them"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        self.other = Wallet.objects.create(user=other, balance=Decimal('50.00'))
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('wallet:wallet_statement')
+
+    def _write_history(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        old = ledger.deposit(self.wallet, Decimal('20.00'))
+        Transaction.objects.filter(pk=old.pk).update(created_at=yesterday)
+        WalletDailyRollup.objects.rebuild()
+        ledger.deposit(self.wallet, Decimal('10.00'))
+        ledger.withdraw(self.wallet, Decimal('5.00'))
+        ledger.transfer(self.wallet, self.other, Decimal('15.00'))
+        ledger.transfer(self.other, self.wallet, Decimal('2.50'))
+
+    def _rows(self):
+        return list(WalletDailyRollup.objects.values_list(*WalletDailyRollup.objects.COLUMNS[:-1]).order_by('wallet_id', 'day'))
+
+    def test_refresh_matches_rebuild(self):
+        self._write_history()
+        self.assertEqual(WalletDailyRollup.objects.refresh(), 2)
+        self.assertEqual(WalletDailyRollup.objects.refresh(), 0)
+
+        today = self.wallet.daily_rollups.get(day=timezone.now().date())
+        self.assertEqual((today.deposits_total, today.deposits_count), (Decimal('10.00'), 1))
+        self.assertEqual((today.withdrawals_total, today.transfers_out_total), (Decimal('5.00'), Decimal('15.00')))
+        self.assertEqual(today.transfers_in_total, Decimal('2.50'))
+        self.assertEqual((today.net_change, today.transaction_count), (Decimal('-7.50'), 4))
+        self.assertEqual(today.closing_balance, Decimal('112.50'))
+
+        refreshed = self._rows()
+        WalletDailyRollup.objects.rebuild()
+        self.assertEqual(self._rows(), refreshed)
+
+    def test_statement(self):
+        self._write_history()
+        today = timezone.now().date()
+        response = self.client.get(self.url, {'start': today, 'end': today})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['opening_balance'], '120.00')
+        self.assertEqual(response.data['closing_balance'], '112.50')
+        self.assertEqual(response.data['deposits_total'], '10.00')
+        self.assertEqual(response.data['transaction_count'], 4)
+        self.assertEqual(len(response.data['days']), 1)
+
+        # A period without activity opens and closes on the previous day's balance
+        earlier = today - timedelta(days=30)
+        response = self.client.get(self.url, {'start': earlier, 'end': earlier})
+        self.assertEqual((response.data['opening_balance'], response.data['closing_balance']), ('100.00', '100.00'))
+
+    def test_invalid_period(self):
+        today = timezone.now().date()
+        response = self.client.get(self.url, {'start': today, 'end': today - timedelta(days=1)})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'start': today - timedelta(days=400), 'end': today})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_monthly_statement_task(self):
+        ledger.deposit(self.wallet, Decimal('10.00'))
+        today = timezone.now().date()
+        statement = generate_monthly_statement(self.user.id, today.year, today.month)
+        self.assertEqual(statement['total_deposits'], Decimal('10.00'))
+        self.assertEqual(statement['ending_balance'], Decimal('110.00'))
+
+    def test_statement_run(self):
+        from . import statements
+
+        self._write_history()
+        today = timezone.now().date()
+        run, bounds = statements.start_run(today.year, today.month, chunk_size=1)
+        self.assertEqual(len(bounds), 2)
+        for bound in bounds:
+            statements.process_chunk(run.id, *bound)
+        run = statements.finish_run(run.id)
+        self.assertEqual((run.status, run.processed_wallets, run.total_wallets), ('COMPLETED', 2, 2))
+
+        stored = run.statements.get(wallet=self.wallet)
+        built = statements.build_statement(self.wallet, run.period_start, run.period_end)
+        for name in ['opening_balance', 'closing_balance'] + statements.TOTALS:
+            self.assertEqual(getattr(stored, name), built[name], name)
+
+        # A restarted run only picks up wallets still without a statement
+        stored.delete()
+        StatementRun.objects.filter(id=run.id).update(status='PROCESSING')
+        run, bounds = statements.start_run(today.year, today.month, chunk_size=1)
+        self.assertEqual(len(bounds), 1)
+        self.assertEqual(statements.process_chunk(run.id, *bounds[0]), 1)
+        self.assertEqual(statements.finish_run(run.id).processed_wallets, 2)
+
+
+class PartitioningTest(APITestCase):
+    """Test cases for the monthly partitions of the transactions table"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        self.client.force_authenticate(user=self.user)
+        self.month = partitions.month_start(timezone.now())
+        # Start from the plain table the migration converts
+        if partitions.is_partitioned(connection):
+            partitions.convert(connection, partitioned=False)
+        self.old = ledger.deposit(self.wallet, Decimal('20.00'))
+        Transaction.objects.filter(pk=self.old.pk).update(
+            created_at=partitions.month_bound(partitions.add_months(self.month, -5))
+        )
+        self.recent = ledger.deposit(self.wallet, Decimal('10.00'))
+        partitions.convert(connection, ahead=1)
+
+    def _count(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {connection.ops.quote_name(table)}")
+            return cursor.fetchone()[0]
+
+    def test_convert_keeps_rows_and_prunes(self):
+        self.assertTrue(partitions.is_partitioned(connection))
+        months = partitions.month_partitions(connection)
+        self.assertEqual(sorted(months), [partitions.add_months(self.month, n) for n in range(-5, 2)])
+        self.assertEqual(self._count(months[self.month]), 1)
+
+        ledger.withdraw(self.wallet, Decimal('5.00'))
+        response = self.client.get(reverse('wallet:transaction_history'), {'page_size': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [str(row['id']) for row in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [str(row['id']) for row in response.data['results']]
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(ids[-1], str(self.old.pk))
+
+        since = partitions.month_bound(self.month)
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN SELECT * FROM transactions WHERE created_at >= %s", [since])
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.assertIn(months[self.month], plan)
+        self.assertNotIn(months[partitions.add_months(self.month, -5)], plan)
+
+    def test_maintenance_creates_ahead_and_expires(self):
+        later = partitions.add_months(self.month, 3)
+        stray = ledger.deposit(self.wallet, Decimal('1.00'))
+        Transaction.objects.filter(pk=stray.pk).update(created_at=partitions.month_bound(later))
+        self.assertEqual(self._count(partitions.DEFAULT_PARTITION), 1)
+
+        # Older than every partition, so stranded in the default one
+        ancient = partitions.add_months(self.month, -8)
+        failed = ledger.deposit(self.wallet, Decimal('2.00'))
+        Transaction.objects.filter(pk=failed.pk).update(status='FAILED', created_at=partitions.month_bound(ancient))
+        self.assertEqual(self._count(partitions.DEFAULT_PARTITION), 2)
+
+        version = Wallet.objects.history_version(self.user)
+        with override_settings(TRANSACTION_RETENTION_MONTHS=2, TRANSACTION_PARTITIONS_AHEAD=3):
+            maintain_transaction_partitions()
+        # The expired month's row left the wallet's history
+        self.assertEqual(Wallet.objects.history_version(self.user), version + 1)
+        months = partitions.month_partitions(connection)
+        # The month of the COMPLETED old deposit is kept until it is archived
+        self.assertEqual(
+            sorted(months), [partitions.add_months(self.month, n) for n in [-5] + list(range(-1, 4))]
+        )
+        self.assertTrue(Transaction.objects.filter(pk=self.old.pk).exists())
+        # The stray rows moved into their months' new partitions; the ancient one expired with its month
+        self.assertEqual(self._count(partitions.DEFAULT_PARTITION), 0)
+        self.assertEqual(self._count(months[later]), 1)
+        self.assertFalse(Transaction.objects.filter(pk=failed.pk).exists())
+        self.assertEqual(self._count(partitions.partition_name(ancient)), 1)
+
+        # As archiving would, take the COMPLETED row out of the table
+        Transaction.objects.filter(pk=self.old.pk).delete()
+        with override_settings(TRANSACTION_RETENTION_MONTHS=2):
+            maintain_transaction_partitions()
+        # Detached, not dropped: the old month is kept out of the table
+        self.assertNotIn(partitions.add_months(self.month, -5), partitions.month_partitions(connection))
+        self.assertEqual(self._count(partitions.partition_name(partitions.add_months(self.month, -5))), 0)
+        self.assertTrue(Transaction.objects.filter(pk=self.recent.pk).exists())
+
+        with override_settings(TRANSACTION_RETENTION_MONTHS=1, TRANSACTION_PARTITION_EXPIRY='drop'):
+            maintain_transaction_partitions()
+        name = partitions.partition_name(partitions.add_months(self.month, -1))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [name])
+            self.assertIsNone(cursor.fetchone()[0])
+
+
+class JWTAuthenticationTest(APITestCase):
+    """Test cases for JWT users resolved from cached snapshots"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        access = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        wallet_cache.clear_local()
+
+    def test_user_served_from_snapshot(self):
+        if not wallet_cache.local_tier_ready(timeout=2):
+            self.skipTest('Redis is not available')
+        url = reverse('wallet:wallet_balance')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.data['user']['email'], 'test@example.com')
+
+    def test_profile_update_invalidates_snapshot(self):
+        url = reverse('wallet:profile')
+        self.client.get(url)
+        self.client.put(url, {'first_name': 'Updated'}, format='json')
+        self.assertEqual(self.client.get(url).data['first_name'], 'Updated')
+        # Only the snapshot's fields are written back
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('testpass123'))
+
+    def test_deactivated_user_rejected(self):
+        url = reverse('wallet:profile')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(JWT_STATELESS_READS=True)
+    def test_stateless_reads_skip_users_table(self):
+        ledger.deposit(self.user.wallet, Decimal('1.00'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('wallet:transaction_history'))
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertFalse([query for query in queries if 'FROM "users"' in query['sql']])
+
+        # Writes still check the snapshot
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('wallet:transaction_history')).status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('wallet:topup_wallet'), {'amount': '1.00', 'currency': 'USD'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class TokenRevocationTest(APITestCase):
+    """Test cases for logout and Bloom filter backed token revocation"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        revocation.reset()
+
+    def _require_redis(self):
+        client = get_redis()
+        try:
+            client.ping()
+        except (AttributeError, redis.RedisError):
+            self.skipTest('Redis is not available')
+
+    def _login(self):
+        response = self.client.post(reverse('wallet:login'), {'email': 'test@example.com', 'password': 'testpass123'}, format='json')
+        return response.data['tokens']
+
+    def _get(self, tokens):
+        return self.client.get(reverse('wallet:profile'), HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+
+    def _post(self, name, tokens, data=None):
+        return self.client.post(reverse(f'wallet:{name}'), data or {}, format='json', HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+
+    def test_bloom_filter(self):
+        bloom = revocation.BloomFilter(1000, 0.01)
+        for n in range(1000):
+            bloom.add(f"jti:{n}")
+        self.assertTrue(all(f"jti:{n}" in bloom for n in range(1000)))
+        false_positives = sum(f"other:{n}" in bloom for n in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_logout_revokes_session(self):
+        self._require_redis()
+        first, second = self._login(), self._login()
+        self.assertEqual(self._get(first).status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self._post('logout', first, {'refresh': first['refresh']}).status_code, status.HTTP_200_OK)
+        self.assertEqual(self._get(first).status_code, status.HTTP_401_UNAUTHORIZED)
+        refreshed = self._post('refresh_token', second, {'refresh': first['refresh']})
+        self.assertEqual(refreshed.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        # Other sessions are untouched, and other processes pick the revocation up from Redis
+        self.assertEqual(self._get(second).status_code, status.HTTP_200_OK)
+        revocation.reset()
+        self.assertEqual(self._get(first).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self._get(second).status_code, status.HTTP_200_OK)
+
+    def test_logout_all(self):
+        self._require_redis()
+        first, second = self._login(), self._login()
+        self.assertEqual(self._post('logout_all', first).status_code, status.HTTP_200_OK)
+        self.assertEqual(self._get(first).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self._get(second).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self._get(self._login()).status_code, status.HTTP_200_OK)
+
+    def test_logout_without_redis(self):
+        tokens = self._login()
+        with mock.patch('wallet.revocation.get_redis', return_value=None):
+            response = self._post('logout', tokens)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class ThrottlingTest(APITestCase):
+    """Test cases for token bucket rate limits and load shedding"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        self.ip = f"10.{uuid4().int % 250}.{uuid4().int % 250}.{uuid4().int % 250}"
+        throttling.reset()
+        load_monitor.reset()
+
+    def tearDown(self):
+        load_monitor.reset()
+
+    def _throttle(self, rate):
+        throttle = type('TestThrottle', (throttling.AnonRateThrottle,), {'rate': rate})()
+        request = APIView().initialize_request(RequestFactory().get('/', REMOTE_ADDR=self.ip))
+        return lambda: throttle.allow_request(request, None), throttle
+
+    def _check_bucket(self):
+        allow, throttle = self._throttle('3/min')
+        self.assertEqual([allow() for _ in range(4)], [True, True, True, False])
+        self.assertGreater(throttle.wait(), 15)
+
+    def test_bucket(self):
+        self._check_bucket()
+
+    def test_bucket_without_redis(self):
+        with mock.patch('wallet.throttling.get_redis', return_value=None):
+            self._check_bucket()
+
+    def test_local_fast_path(self):
+        allow, _ = self._throttle('1000/min')
+        self.assertTrue(all(allow() for _ in range(200)))
+        decisions = throttling.stats()
+        if decisions['fallback']:
+            self.skipTest('Redis is not available')
+        # One round trip per 10% of the bucket
+        self.assertLessEqual(decisions['redis'], 3)
+        self.assertGreaterEqual(decisions['local'], 197)
+
+    def test_login_throttled(self):
+        url = reverse('wallet:login')
+        with mock.patch.dict(throttling.ScopedRateThrottle.THROTTLE_RATES, {'auth': '2/min'}):
+            codes = [
+                self.client.post(url, {'email': 'test@example.com', 'password': 'wrong'}, format='json', REMOTE_ADDR=self.ip).status_code
+                for _ in range(3)
+            ]
+        self.assertEqual(codes[-1], status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(LOAD_SHED_P99_MS=100, LOAD_SHED_MIN_SAMPLES=10)
+    def test_load_shedding(self):
+        self.client.force_authenticate(user=self.user)
+        for _ in range(20):
+            load_monitor.record(0.15)
+        response = self.client.get(reverse('wallet:transaction_history'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.client.get(reverse('wallet:profile')).status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('wallet:topup_wallet'), {'amount': '1.00', 'currency': 'USD'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(APITestCase):
+    """Test cases for reads from the replica database"""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        self.primary_txn = ledger.deposit(self.wallet, Decimal('5.00'), description='On the primary')
+        # The second database plays a replica that has not caught up yet
+        self.user.save(using='replica')
+        self.wallet.save(using='replica')
+        self.replica_txn = Transaction.objects.db_manager('replica').create(
+            wallet_id=self.wallet.pk, transaction_type='DEPOSIT', amount=Decimal('7.00'),
+            balance_before=Decimal('100.00'), balance_after=Decimal('107.00'), description='On the replica',
+        )
+        self.client.force_authenticate(user=self.user)
+        routing.reset()
+
+    def tearDown(self):
+        routing.reset()
+
+    def _history(self):
+        response = self.client.get(reverse('wallet:transaction_history'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [str(row['id']) for row in response.data['results']]
+
+    def test_read_endpoints_use_replica(self):
+        if routing.is_pinned(self.user.pk):
+            self.skipTest('Redis is not available')
+        self.assertEqual(self._history(), [str(self.replica_txn.pk)])
+        response = self.client.get(reverse('wallet:transaction_export'))
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [str(self.replica_txn.pk)])
+        with routing.replica_reads(self.user.pk):
+            self.assertEqual(router.db_for_read(Wallet), 'replica')
+            self.assertEqual(router.db_for_write(Wallet), 'default')
+        self.assertEqual(router.db_for_read(Wallet), 'default')
+
+    def test_admin_change_list_uses_replica(self):
+        if routing.is_pinned(self.user.pk):
+            self.skipTest('Redis is not available')
+        admin_user = User.objects.create_superuser(username='admin', email='admin@example.com', password='adminpass123')
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse('admin:wallet_transaction_changelist'))
+        self.assertContains(response, self.replica_txn.reference)
+        self.assertNotContains(response, self.primary_txn.reference)
+
+    def test_money_write_pins_user_to_primary(self):
+        response = self.client.post(reverse('wallet:topup_wallet'), {'amount': '3.00', 'currency': 'USD'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        history = self._history()
+        self.assertIn(str(self.primary_txn.pk), history)
+        self.assertIn(response.data['transaction']['id'], history)
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        with mock.patch('wallet.routing.replica_lag', return_value=30.0):
+            self.assertEqual(routing.read_alias(), 'default')
+        routing.reset()
+        with mock.patch('wallet.routing.replica_lag', side_effect=DatabaseError('down')):
+            self.assertEqual(routing.read_alias(), 'default')
+        routing.reset()
+        self.assertEqual(routing.replica_lag('replica'), 0)
+        self.assertEqual(routing.read_alias(), 'replica')
+
+
+@override_settings(SHARDS=['default', 'shard_1'])
+class ShardingTest(APITestCase):
+    """Test cases for wallets sharded across databases"""
+    databases = {'default', 'shard_1'}
+
+    def setUp(self):
+        sharding.reset()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.bucket = sharding.bucket_for(self.user.pk)
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        sharding.reset()
+
+    def _topup(self, amount='10.00'):
+        # A fresh user per request, as authentication gives, without a cached wallet
+        self.client.force_authenticate(user=User.objects.get(pk=self.user.pk))
+        response = self.client.post(reverse('wallet:topup_wallet'), {'amount': amount, 'currency': 'USD'})
+        # 201 when the top-up creates the wallet
+        self.assertIn(response.status_code, [status.HTTP_200_OK, status.HTTP_201_CREATED])
+        return response
+
+    def test_bucket_matches_sql(self):
+        user_ids = [self.user.pk, uuid4(), uuid4()]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {sharding.bucket_sql('id')} FROM unnest(%s::uuid[]) AS id", [user_ids]
+            )
+            self.assertEqual([row[0] for row in cursor.fetchall()], [sharding.bucket_for(i) for i in user_ids])
+
+    def test_wallet_lives_on_users_shard(self):
+        rebalance.move_bucket(self.bucket, 'shard_1', drain=0)
+        self.assertEqual(sharding.shard_for_user(self.user.pk), 'shard_1')
+        self._topup()
+        response = self.client.post(reverse('wallet:withdraw_wallet'), {'amount': '4.00'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertFalse(Wallet._base_manager.using('default').filter(user=self.user).exists())
+        wallet = Wallet._base_manager.using('shard_1').get(user_id=self.user.pk)
+        self.assertEqual(wallet.balance, Decimal('6.00'))
+        self.assertEqual(Transaction._base_manager.using('shard_1').filter(wallet=wallet).count(), 2)
+        # The shard's copy of the user has no password
+        self.assertFalse(User._base_manager.using('shard_1').get(pk=self.user.pk).has_usable_password())
+
+        history = self.client.get(reverse('wallet:transaction_history'))
+        self.assertEqual(len(history.data['results']), 2)
+        balance = self.client.get(reverse('wallet:wallet_balance'))
+        self.assertEqual(Decimal(balance.data['balance']), Decimal('6.00'))
+
+    def test_move_bucket_with_data(self):
+        self._topup()
+        wallet = Wallet.objects.get(user=self.user)
+        ledger.withdraw(wallet, Decimal('3.00'))
+        WalletDailyRollup.objects.refresh()
+
+        self.assertEqual(rebalance.move_bucket(self.bucket, 'shard_1', drain=0), 1)
+        self.assertEqual(ShardBucket.objects.get(bucket=self.bucket).shard, 'shard_1')
+        self.assertFalse(ShardFence.objects.using('default').filter(bucket=self.bucket).exists())
+        self.assertTrue(ShardFence.objects.using('shard_1').filter(bucket=self.bucket).exists())
+        self.assertFalse(Wallet._base_manager.using('default').filter(pk=wallet.pk).exists())
+        self.assertFalse(Transaction._base_manager.using('default').filter(wallet_id=wallet.pk).exists())
+        moved = Wallet._base_manager.using('shard_1').get(pk=wallet.pk)
+        self.assertEqual(moved.balance, Decimal('7.00'))
+        self.assertEqual(Transaction._base_manager.using('shard_1').filter(wallet_id=wallet.pk).count(), 2)
+        rollup = WalletDailyRollup.objects.using('shard_1').get(wallet_id=wallet.pk)
+        self.assertEqual((rollup.deposits_total, rollup.withdrawals_total), (Decimal('10.00'), Decimal('3.00')))
+
+        self._topup('1.00')
+        self.assertEqual(len(self.client.get(reverse('wallet:transaction_history')).data['results']), 3)
+
+        # Idempotency keys are stored on the user's shard and move with the bucket
+        from .models import IdempotencyKey
+
+        url, data = reverse('wallet:topup_wallet'), {'amount': '2.00', 'currency': 'USD'}
+        first = self.client.post(url, data, HTTP_IDEMPOTENCY_KEY='sharded')
+        self.assertTrue(IdempotencyKey.objects.using('shard_1').filter(key='sharded').exists())
+        self.assertEqual(rebalance.move_bucket(self.bucket, 'default', drain=0), 1)
+        self.assertFalse(IdempotencyKey.objects.using('shard_1').exists())
+        self.assertTrue(IdempotencyKey.objects.using('default').filter(key='sharded', status_code=200).exists())
+        replay = self.client.post(url, data, HTTP_IDEMPOTENCY_KEY='sharded')
+        self.assertEqual((replay['Idempotent-Replayed'], replay.json()), ('true', first.json()))
+
+        # And back: the shard keeps nothing of the bucket
+        self.assertEqual(Wallet.objects.get(pk=wallet.pk).balance, Decimal('10.00'))
+        self.assertFalse(User._base_manager.using('shard_1').filter(pk=self.user.pk).exists())
+
+    def test_write_with_stale_map_retries_on_new_shard(self):
+        self._topup()
+        stale = list(sharding.shard_map())
+        rebalance.move_bucket(self.bucket, 'shard_1', drain=0)
+        # Another process that has not reloaded the map since the move
+        sharding._map['buckets'] = stale
+        self.assertEqual(sharding.shard_for_user(self.user.pk), 'default')
+
+        self._topup('5.00')
+        self.assertEqual(sharding.shard_for_user(self.user.pk), 'shard_1')
+        self.assertEqual(Wallet._base_manager.using('shard_1').get(user_id=self.user.pk).balance, Decimal('15.00'))
+
+    def test_background_writers_leave_moved_wallets(self):
+        from . import archive, outbox
+
+        self._topup()
+        wallet = Wallet.objects.get(user=self.user)
+        wallet.enable_hot_mode(2)
+        ledger.deposit(wallet, Decimal('5.00'))
+        # A move has copied the bucket and taken its fence, but not yet dropped its rows here
+        ShardFence.objects.using('default').filter(bucket=self.bucket).delete()
+
+        self.assertEqual(consolidate_hot_wallets(), 'Consolidated balance slots of 0 hot wallets')
+        self.assertEqual(WalletBalanceSlot.objects.filter(wallet=wallet).aggregate(total=Sum('balance'))['total'],
+                         Decimal('5.00'))
+        WalletDailyRollup.objects.refresh()
+        self.assertFalse(WalletDailyRollup.objects.filter(wallet=wallet).exists())
+        delivered = []
+        outbox.relay('default', delivered.append)
+        self.assertEqual(delivered, [])
+        self.assertEqual(archive.archive_wallets('default', [wallet.pk], timezone.now() + timedelta(days=1)), (0, 0))
+        self.assertEqual(Transaction.objects.filter(wallet=wallet).count(), 2)
+
+    def test_transfer_across_shards_rejected(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        Wallet.objects.create(user=other, balance=Decimal('0.00'))
+        if sharding.shard_for_user(other.pk) == 'default' and self.bucket != sharding.bucket_for(other.pk):
+            rebalance.move_bucket(self.bucket, 'shard_1', drain=0)
+        self._topup()
+        response = self.client.post(
+            reverse('wallet:transfer'), {'recipient_email': other.email, 'amount': '1.00'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('another shard', response.data['error'])
+
+    def test_fan_out_and_admin_across_shards(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        if self.bucket == sharding.bucket_for(other.pk):
+            self.skipTest('Both users share a bucket')
+        rebalance.move_bucket(self.bucket, 'shard_1', drain=0)
+        self._topup()
+        Wallet.objects.create(user=other, balance=Decimal('2.00'))
+
+        totals = rebalance.report(workers=1)
+        self.assertEqual((totals['default']['wallets'], totals['default']['balance']), (1, Decimal('2.00')))
+        self.assertEqual((totals['shard_1']['wallets'], totals['shard_1']['balance']), (1, Decimal('10.00')))
+        self.assertEqual(totals['shard_1']['buckets'], 1)
+
+        refresh_daily_rollups()
+        self.assertTrue(WalletDailyRollup.objects.using('shard_1').filter(wallet__user_id=self.user.pk).exists())
+
+        admin_user = User.objects.create_superuser(username='admin', email='admin@example.com', password='adminpass123')
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse('admin:wallet_wallet_changelist'), {'shard': 'shard_1'})
+        self.assertContains(response, self.user.email)
+        self.assertNotContains(response, other.email)
+        wallet = Wallet._base_manager.using('shard_1').get(user_id=self.user.pk)
+        response = self.client.get(reverse('admin:wallet_wallet_change', args=[wallet.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_payout_credits_every_shard_once(self):
+        from . import payouts
+        from .tasks import process_payout_chunk
+
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        if self.bucket == sharding.bucket_for(other.pk):
+            self.skipTest('Both users share a bucket')
+        rebalance.move_bucket(self.bucket, 'shard_1', drain=0)
+        self._topup()
+        sharded = Wallet._base_manager.using('shard_1').get(user_id=self.user.pk)
+        local = Wallet.objects.create(user=other, balance=Decimal('0.00'))
+
+        admin_user = User.objects.create_superuser(username='admin', email='admin@example.com', password='adminpass123')
+        job = payouts.create_job(admin_user, [
+            {'wallet': str(sharded.pk), 'amount': '5.00'},
+            {'wallet': str(local.pk), 'amount': '7.00'},
+        ])
+        PayoutJob.objects.filter(id=job.id).update(status='PROCESSING')
+        # A retry after the shard_1 credit committed does not credit it again
+        job.refresh_from_db()
+        payouts.credit_shard(job, list(job.items.all()), 'shard_1')
+        for first, last in payouts.chunk_bounds(job.id, 10):
+            process_payout_chunk(job.id, first, last)
+
+        job.refresh_from_db()
+        self.assertEqual((job.succeeded_items, job.failed_items), (2, 0))
+        self.assertEqual(Wallet._base_manager.using('shard_1').get(pk=sharded.pk).balance, Decimal('15.00'))
+        self.assertEqual(Wallet.objects.get(pk=local.pk).balance, Decimal('7.00'))
+
+
+@override_settings(SHARDS=['default', 'shard_1'])
+class RebalanceConcurrencyTest(TransactionTestCase):
+    """A bucket moved while it is written to must arrive with every committed write"""
+    databases = {'default', 'shard_1'}
+
+    def setUp(self):
+        sharding.reset()
+
+    def tearDown(self):
+        sharding.reset()
+
+    def test_move_waits_for_write_in_flight(self):
+        user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        bucket = sharding.bucket_for(user.pk)
+        wallet = Wallet.objects.create(user=user, balance=Decimal('10.00'))
+        claimed, release = threading.Event(), threading.Event()
+
+        def write():
+            try:
+                with sharding.atomic(user.pk):
+                    ledger.deposit(Wallet.objects.get(pk=wallet.pk), Decimal('5.00'))
+                    claimed.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        def move():
+            try:
+                rebalance.move_bucket(bucket, 'shard_1', drain=0)
+            finally:
+                connections.close_all()
+
+        writer, mover = threading.Thread(target=write), threading.Thread(target=move)
+        writer.start()
+        self.assertTrue(claimed.wait(5))
+        mover.start()
+        # The move is waiting for the fence the deposit holds
+        time.sleep(0.5)
+        release.set()
+        writer.join()
+        mover.join()
+
+        moved = Wallet._base_manager.using('shard_1').get(pk=wallet.pk)
+        self.assertEqual(moved.balance, Decimal('15.00'))
+        self.assertEqual(Transaction._base_manager.using('shard_1').filter(wallet_id=wallet.pk).count(), 1)
+        self.assertFalse(ShardFence.objects.using('default').filter(bucket=bucket).exists())
+
+
+class MetricsTest(APITestCase):
+    """Test cases for pooled connections and the metrics endpoint"""
+
+    def setUp(self):
+        self.url = reverse('wallet:metrics')
+
+    def test_connections_are_pooled(self):
+        Wallet.objects.count()
+        self.assertIsNotNone(connection.pool)
+        self.assertTrue(connection.settings_dict['CONN_HEALTH_CHECKS'])
+        self.assertGreaterEqual(connection.pool.get_stats()['requests_num'], 1)
+
+    def test_disabled_without_token(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_requires_token(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_metrics_of_every_worker(self):
+        other = {'worker': 'other-host:7', 'at': time.time(),
+                 'pools': {'default': {'requests_num': 12, 'requests_wait_ms': 1500}}}
+        client = mock.Mock()
+        client.scan_iter.return_value = [b'metrics:worker:other-host:7']
+        client.mget.return_value = [json.dumps(other).encode()]
+        with mock.patch('wallet.metrics.get_redis', return_value=client):
+            response = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer scrape-secret')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('# TYPE wallet_db_pool_checkouts_total counter', body)
+        self.assertIn('wallet_db_pool_checkouts_total{worker="other-host:7",database="default"} 12', body)
+        self.assertIn('wallet_db_pool_wait_seconds_total{worker="other-host:7",database="default"} 1.5', body)
+        self.assertIn(f'wallet_db_pool_checkouts_total{{worker="{metrics.worker_name()}",database="default"}}', body)
+
+
+class RenderingTest(APITestCase):
+    """Test cases for the orjson/MessagePack renderers and list projections"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        ledger.deposit(self.wallet, Decimal('12.50'), description='Café top-up')
+        ledger.withdraw(self.wallet, Decimal('0.05'))
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('wallet:transaction_history')
+
+    def test_projection_matches_serializer(self):
+        queryset = self.wallet.transactions.all()
+        rows = TRANSACTION_LIST_PROJECTION.map_rows(TRANSACTION_LIST_PROJECTION.queryset(queryset))
+        fast = ORJSONRenderer().render(rows)
+        slow = JSONRenderer().render(TransactionListSerializer(queryset, many=True).data)
+        self.assertEqual(json.loads(fast), json.loads(slow))
+        self.assertEqual(json.loads(fast)[0]['amount'], '0.05')
+
+    def test_unsupported_field(self):
+        class Unsupported(TransactionListSerializer):
+            user = serializers.SerializerMethodField()
+
+            class Meta(TransactionListSerializer.Meta):
+                fields = ['id', 'user']
+
+        with self.assertRaises(ImproperlyConfigured):
+            Projection(Unsupported)
+
+    def test_msgpack_negotiation(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), self.client.get(self.url).json())
+
+    def test_msgpack_request_body(self):
+        response = self.client.post(
+            reverse('wallet:topup_wallet'), msgpack.packb({'amount': '10.00', 'currency': 'USD'}),
+            content_type='application/msgpack'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['new_balance'], 122.45)
+
+
+class IdempotencyTest(APITestCase):
+    """Test cases for Idempotency-Key handling on money-moving endpoints"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        self.client.force_authenticate(user=self.user)
+
+    def _assert_replay(self):
+        url = reverse('wallet:topup_wallet')
+        data = {'amount': '50.00', 'currency': 'USD'}
+        first = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='topup-1')
+        replay = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='topup-1')
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(replay.status_code, status.HTTP_200_OK)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(replay.json(), first.json())
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('150.00'))
+        self.assertEqual(self.wallet.transactions.count(), 1)
+
+    def test_replay_with_redis_store(self):
+        self._assert_replay()
+
+    @override_settings(IDEMPOTENCY_STORE='db')
+    def test_replay_with_database_store(self):
+        self._assert_replay()
+
+    def test_replay_while_redis_goes_down_and_up(self):
+        client = get_redis()
+        try:
+            client.ping()
+        except (AttributeError, redis.RedisError):
+            self.skipTest('Redis is not available')
+        url = reverse('wallet:topup_wallet')
+        data = {'amount': '50.00', 'currency': 'USD'}
+        # Claimed and completed while Redis is down, replayed once it is back
+        with mock.patch('wallet.idempotency.get_redis', return_value=None):
+            first = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='topup-down')
+        replay = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='topup-down')
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(replay.json(), first.json())
+
+        # Completed with Redis up, replayed while it is down
+        first = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='topup-up')
+        with mock.patch('wallet.idempotency.get_redis', return_value=None):
+            replay = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='topup-up')
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(replay.json(), first.json())
+
+        # A replay served from Redis never reaches the database
+        with self.assertNumQueries(0):
+            replay = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='topup-up')
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('200.00'))
+        self.assertEqual(self.wallet.transactions.count(), 2)
+
+    @override_settings(IDEMPOTENCY_STORE='db')
+    def test_key_reused_with_different_payload(self):
+        url = reverse('wallet:withdraw_wallet')
+        self.client.post(url, {'amount': '10.00'}, format='json', HTTP_IDEMPOTENCY_KEY='withdraw-1')
+        response = self.client.post(url, {'amount': '20.00'}, format='json', HTTP_IDEMPOTENCY_KEY='withdraw-1')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(self.wallet.transactions.count(), 1)
+
+    def test_purge_expired_keys(self):
+        from django.utils import timezone
+        from datetime import timedelta
+        from .models import IdempotencyKey
+        from .tasks import purge_expired_idempotency_keys
+
+        IdempotencyKey.objects.create(
+            user=self.user, key='old', fingerprint='x',
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        IdempotencyKey.objects.create(
+            user=self.user, key='new', fingerprint='x',
+            expires_at=timezone.now() + timedelta(hours=1)
+        )
+        purge_expired_idempotency_keys()
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+
+
+class IdempotencyCrashTest(TransactionTestCase):
+    """A key must be stored exactly when its request's money movement commits"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        self.url = reverse('wallet:topup_wallet')
+        self.data = {'amount': '50.00', 'currency': 'USD'}
+
+    def _post(self, client=None):
+        if client is None:
+            client = APIClient()
+            client.force_authenticate(user=self.user)
+        return client.post(self.url, self.data, format='json', HTTP_IDEMPOTENCY_KEY='topup-crash')
+
+    def _assert_moved_once(self):
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('150.00'))
+        self.assertEqual(self.wallet.transactions.count(), 1)
+
+    def test_crash_before_commit_leaves_key_free(self):
+        from .idempotency import DatabaseIdempotencyStore
+        from .models import IdempotencyKey
+
+        with mock.patch.object(DatabaseIdempotencyStore, 'complete', side_effect=RuntimeError('worker died')):
+            with self.assertRaises(RuntimeError):
+                self._post()
+        # Rolled back with the top-up: the retry runs for real
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(Wallet.objects.get(pk=self.wallet.pk).balance, Decimal('100.00'))
+
+        self.assertEqual(self._post().status_code, status.HTTP_200_OK)
+        self._assert_moved_once()
+
+    def test_crash_after_commit_replays(self):
+        from django.db import transaction
+
+        deposit = ledger.deposit
+
+        def deposit_then_die_after_commit(*args, **kwargs):
+            def die():
+                raise RuntimeError('worker died')
+            transaction.on_commit(die)
+            return deposit(*args, **kwargs)
+
+        with mock.patch('wallet.views.ledger.deposit', side_effect=deposit_then_die_after_commit):
+            with self.assertRaises(RuntimeError):
+                self._post()
+        # However long the retry takes, the committed top-up is replayed, not run again
+        retry = self._post()
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self._assert_moved_once()
+
+    def test_concurrent_retries_move_money_once(self):
+        responses = []
+
+        def worker():
+            try:
+                responses.append(self._post())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_200_OK] * 4)
+        self.assertEqual(sum(response.has_header('Idempotent-Replayed') for response in responses), 3)
+        self._assert_moved_once()
+
+
+@override_settings(PURGE_BATCH_PAUSE=0)
+class PurgeTest(TestCase):
+    """Test cases for batched deletes of expired rows"""
+
+    def setUp(self):
+        user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        self.wallet = Wallet.objects.create(user=user, balance=Decimal('100.00'))
+        old = timezone.now() - timedelta(days=31)
+
+        def create(status, count, created_at):
+            rows = Transaction.objects.bulk_create([
+                Transaction(
+                    wallet=self.wallet, transaction_type='WITHDRAWAL', status=status, amount=Decimal('1.00'),
+                    balance_before=Decimal('100.00'), balance_after=Decimal('100.00'),
+                )
+                for _ in range(count)
+            ])
+            Transaction.objects.filter(pk__in=[row.pk for row in rows]).update(created_at=created_at)
+            return {row.pk for row in rows}
+
+        self.expired = create('FAILED', 5, old)
+        self.kept = create('FAILED', 1, timezone.now()) | create('COMPLETED', 1, old)
+
+    def test_purge_resumes_from_checkpoint(self):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        from . import purge
+        from .models import PurgeCheckpoint
+        from .tasks import cleanup_old_transactions
+
+        # Out of time after the first batch
+        result = purge.run(purge.FAILED_TRANSACTIONS, batch_size=2, max_seconds=0)
+        self.assertEqual((result.deleted, result.batches, result.finished), (2, 1, False))
+        checkpoint = PurgeCheckpoint.objects.get(name='failed-transactions:default')
+        self.assertEqual(checkpoint.deleted, 2)
+        self.assertEqual(checkpoint.position, str(sorted(self.expired)[1]))
+        self.assertEqual(Transaction.objects.filter(pk__in=self.expired).count(), 3)
+
+        out = StringIO()
+        call_command('run_purge', 'failed-transactions', '--batch-size', '2', stdout=out)
+        self.assertIn('default: deleted 3 rows in 2 batches', out.getvalue())
+        self.assertFalse(PurgeCheckpoint.objects.exists())
+        self.assertEqual(set(Transaction.objects.values_list('pk', flat=True)), self.kept)
+        # Both passes moved the wallet's history on, one batch at a time
+        self.assertEqual(Wallet.objects.history_version(self.wallet.user), 3)
+
+        self.assertIn('0 rows', cleanup_old_transactions())
+        self.assertFalse(PurgeCheckpoint.objects.exists())
+
+
+@override_settings(ARCHIVE_AFTER_DAYS=90)
+class ArchiveTest(APITestCase):
+    """Test cases for cold storage of old transactions"""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+
+        from django.conf import settings
+
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        storages = override_settings(STORAGES={
+            **settings.STORAGES,
+            'archive': {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': location}},
+        })
+        storages.enable()
+        self.addCleanup(storages.disable)
+
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        self.other = Wallet.objects.create(user=other, balance=Decimal('100.00'))
+        now = timezone.now()
+        self.old = now - timedelta(days=250)
+
+        def create(wallet, rows):
+            balance = Decimal('100.00')
+            transactions = []
+            for n, (days, transaction_type, status_) in enumerate(rows):
+                amount = Decimal(n + 1)
+                after = balance + amount if transaction_type == 'DEPOSIT' else balance - amount
+                transactions.append(Transaction(
+                    wallet=wallet, transaction_type=transaction_type, status=status_, amount=amount,
+                    description='coffee' if n % 4 == 1 else 'groceries', balance_before=balance, balance_after=after,
+                ))
+                balance = after if status_ == 'COMPLETED' else balance
+            Transaction.objects.bulk_create(transactions)
+            for n, ((days, _, _), txn) in enumerate(zip(rows, transactions)):
+                Transaction.objects.filter(pk=txn.pk).update(created_at=now - timedelta(days=days, minutes=n))
+
+        create(self.wallet, [
+            (250, 'DEPOSIT', 'COMPLETED'), (250, 'WITHDRAWAL', 'COMPLETED'), (240, 'DEPOSIT', 'FAILED'),
+            (240, 'DEPOSIT', 'COMPLETED'), (230, 'WITHDRAWAL', 'COMPLETED'), (150, 'DEPOSIT', 'COMPLETED'),
+            (150, 'DEPOSIT', 'COMPLETED'), (140, 'WITHDRAWAL', 'COMPLETED'), (2, 'DEPOSIT', 'COMPLETED'),
+            (1, 'WITHDRAWAL', 'COMPLETED'), (0, 'DEPOSIT', 'COMPLETED'),
+        ])
+        # The pending transaction holds back the other wallet's cutoff to its day
+        create(self.other, [(260, 'DEPOSIT', 'COMPLETED'), (250, 'DEPOSIT', 'PENDING'), (200, 'DEPOSIT', 'COMPLETED')])
+        WalletDailyRollup.objects.rebuild()
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('wallet:transaction_history')
+
+    def _reads(self):
+        """Everything the user can read of their history"""
+        from .pagination import KeysetPagination
+
+        reads = {}
+        for name, params in [
+            ('all', {}), ('search', {'search': 'coffee'}),
+            ('filtered', {'transaction_type': 'WITHDRAWAL', 'created_before': timezone.now() - timedelta(days=145)}),
+        ]:
+            response = self.client.get(self.url, params)
+            reads[name] = (response.data['count'], response.data['results'])
+
+        pages, url = [], self.url + '?cursor='
+        with mock.patch.object(KeysetPagination, 'page_size', 3):
+            while url:
+                response = self.client.get(url)
+                pages.append(response.data['results'])
+                url = response.data['next']
+            reads['previous'] = self.client.get(response.data['previous']).data['results']
+        reads['pages'] = pages
+
+        export = self.client.get(reverse('wallet:transaction_export'))
+        reads['export'] = b''.join(export.streaming_content)
+        reads['statement'] = generate_monthly_statement(self.user.id, self.old.year, self.old.month)
+        return reads
+
+    def test_archive_and_read_back(self):
+        from . import archive
+        from .models import ArchiveSegment
+        from .tasks import archive_transactions
+
+        before = self._reads()
+        self.assertEqual(before['all'][0], 11)
+        self.assertEqual(before['search'][0], 3)
+
+        version = Wallet.objects.history_version(self.user)
+        self.assertEqual(archive_transactions(), "Archived 8 transactions of 2 wallets into 1 files")
+        self.assertEqual(Wallet.objects.history_version(self.user), version + 1)
+        # Recent, failed and (for the other wallet) not yet settled transactions stay
+        self.assertEqual(self.wallet.transactions.count(), 4)
+        self.assertEqual(self.other.transactions.count(), 2)
+        segment = ArchiveSegment.objects.get(wallet=self.wallet)
+        self.assertEqual(segment.rows, 7)
+        pending = self.other.transactions.get(status='PENDING')
+        self.assertEqual(
+            ArchiveSegment.objects.get(wallet=self.other).cutoff,
+            pending.created_at.replace(hour=0, minute=0, second=0, microsecond=0),
+        )
+        with archive.storage().open(segment.path) as file:
+            self.assertEqual(len(gzip.decompress(file.read()).splitlines()), 8)
+
+        after = self._reads()
+        self.assertEqual(after, before)
+        self.assertEqual([len(page) for page in after['pages']], [3, 3, 3, 2])
+
+        # Archived days keep their rollups through a rebuild
+        WalletDailyRollup.objects.rebuild()
+        self.assertEqual(generate_monthly_statement(self.user.id, self.old.year, self.old.month), before['statement'])
+        self.assertEqual(archive.run('default').rows, 0)
+
+    def test_batches_are_bounded_by_rows(self):
+        from . import archive
+        from .models import ArchiveSegment
+
+        before = self._reads()
+        # One wallet a page, at most three rows a file: 7 rows of this wallet, then 1 of the other;
+        # a wallet's rows span several fetches of the cursor
+        with mock.patch.object(archive, '_FETCH_SIZE', 2):
+            result = archive.run('default', batch_size=1, batch_rows=3)
+        self.assertEqual((result.rows, result.wallets, result.files), (8, 2, 4))
+        segments = list(ArchiveSegment.objects.filter(wallet=self.wallet).order_by('first_created_at'))
+        self.assertEqual([segment.rows for segment in segments], [3, 3, 1])
+        self.assertEqual(len({segment.path for segment in segments}), 3)
+        for previous, segment in zip(segments, segments[1:]):
+            self.assertLessEqual(previous.last_created_at, segment.first_created_at)
+        self.assertEqual(self._reads(), before)
+        self.assertEqual(archive.run('default', batch_rows=3).rows, 0)
+
+    def test_page_numbers_seek_past_segments(self):
+        from . import archive
+        from .archive import ArchivedTransactions
+        from .models import ArchiveSegment
+        from .pagination import TransactionPagination
+
+        def pages(params):
+            results, page = [], 1
+            with mock.patch.object(TransactionPagination, 'page_size', 2):
+                while page:
+                    response = self.client.get(self.url, {**params, 'page': page})
+                    results.append([row['id'] for row in response.data['results']])
+                    page = page + 1 if response.data['next'] else None
+            return results
+
+        reads = [{}, {'transaction_type': 'WITHDRAWAL'}, {'search': 'groceries'}]
+        before = [pages(params) for params in reads]
+        # Two segments: the rows of 230 to 250 days ago, then those of 140 and 150 days ago
+        archive.run('default', cutoff=archive.archive_cutoff(days=200))
+        archive.run('default')
+        self.assertEqual(ArchiveSegment.objects.filter(wallet=self.wallet).count(), 2)
+        self.assertEqual([pages(params) for params in reads], before)
+
+        # The last page reads the oldest segment only
+        oldest = ArchiveSegment.objects.filter(wallet=self.wallet).earliest('first_created_at')
+        with mock.patch.object(ArchivedTransactions, '_rows', autospec=True,
+                               side_effect=ArchivedTransactions._rows) as read:
+            with mock.patch.object(TransactionPagination, 'page_size', 2):
+                response = self.client.get(self.url, {'page': len(before[0])})
+        self.assertEqual([row['id'] for row in response.data['results']], before[0][-1])
+        self.assertEqual({call.args[1].pk for call in read.call_args_list}, {oldest.pk})
+
+
+class OutboxTest(TestCase):
+    """Test cases for the transactional outbox and its relay"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        self.wallet = Wallet.objects.create(user=self.user, balance=Decimal('100.00'))
+        self.other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        self.recipient = Wallet.objects.create(user=self.other, balance=Decimal('0.00'))
+
+    def test_events_commit_with_their_transactions(self):
+        from django.db import transaction
+
+        from .models import OutboxEvent
+
+        deposit = ledger.deposit(self.wallet, Decimal('5.00'))
+        with self.assertRaises(InsufficientBalance):
+            ledger.withdraw(self.wallet, Decimal('500.00'))
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            ledger.deposit(self.wallet, Decimal('7.00'))
+            raise RuntimeError('rolled back')
+
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.event, event.wallet_id), (OutboxEvent.CREATED, self.wallet.id))
+        payload = json.loads(event.payload)
+        self.assertEqual(payload['id'], str(deposit.id))
+        self.assertEqual(payload['reference'], deposit.reference)
+        self.assertEqual((payload['amount'], payload['balance_after']), ('5.00', '105.00'))
+
+        deposit.status = 'CANCELLED'
+        deposit.save()
+        self.assertEqual(OutboxEvent.objects.latest('id').event, OutboxEvent.UPDATED)
+
+    def test_relay_delivers_batches_grouped_by_user(self):
+        from . import outbox
+        from .models import OutboxEvent
+
+        ledger.deposit(self.wallet, Decimal('5.00'))
+        debit, credit = ledger.transfer(self.wallet, self.recipient, Decimal('20.00'))
+        relayed = metrics.outbox_stats()['events']
+
+        def fail(groups):
+            raise RuntimeError('broker down')
+
+        # Undelivered batches stay queued
+        with self.assertRaises(RuntimeError):
+            outbox.relay('default', fail)
+        self.assertEqual(OutboxEvent.objects.count(), 3)
+
+        delivered = []
+        result = outbox.relay('default', delivered.append, batch_size=2)
+        self.assertEqual((result.events, result.batches), (3, 2))
+        self.assertFalse(OutboxEvent.objects.exists())
+        messages = {}
+        for groups in delivered:
+            for user_id, events in groups.items():
+                messages.setdefault(user_id, []).extend(events)
+        self.assertEqual(len(messages[str(self.user.id)]), 2)
+        [message] = messages[str(self.other.id)]
+        self.assertEqual(message['transaction']['id'], str(credit.id))
+        self.assertEqual(message['transaction']['balance_after'], '20.00')
+        self.assertEqual(metrics.outbox_stats()['events'], relayed + 3)
+
+        body = metrics.render([metrics.snapshot()], outbox.backlog())
+        self.assertIn(f'wallet_outbox_events_relayed_total{{worker="{metrics.worker_name()}"}}', body)
+        self.assertIn('# TYPE wallet_outbox_delivery_lag_seconds histogram', body)
+        self.assertIn('wallet_outbox_waiting_events{database="default"} 0', body)
+
+    def test_relay_task(self):
+        from .tasks import process_transaction_notification, relay_outbox
+
+        txn = ledger.deposit(self.wallet, Decimal('5.00'))
+        with mock.patch('wallet.tasks.group') as notifications:
+            self.assertEqual(relay_outbox(), 'Relayed 1 outbox events')
+        [signature] = list(notifications.call_args.args[0])
+        user_id, events = signature.args
+        self.assertEqual(user_id, str(self.user.id))
+        self.assertEqual(events[0]['transaction']['reference'], txn.reference)
+        self.assertIn('1 transactions', process_transaction_notification(user_id, events))
+
+
+class OutboxAtomicityTest(TransactionTestCase):
+    """Transactions written outside a transaction must not commit without their events"""
+
+    def test_write_without_its_event_rolls_back(self):
+        from .models import OutboxEvent
+
+        user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        wallet = Wallet.objects.create(user=user, balance=Decimal('100.00'))
+        with mock.patch.object(OutboxEvent.objects, 'record', side_effect=DatabaseError('outbox down')):
+            with self.assertRaises(DatabaseError):
+                Transaction.objects.create(
+                    wallet=wallet, transaction_type='DEPOSIT', amount=Decimal('1.00'), status='COMPLETED',
+                    balance_before=Decimal('100.00'), balance_after=Decimal('101.00'),
+                )
+            with self.assertRaises(DatabaseError):
+                Transaction.objects.bulk_create([Transaction(
+                    wallet=wallet, transaction_type='DEPOSIT', amount=Decimal('2.00'), status='COMPLETED',
+                    balance_before=Decimal('100.00'), balance_after=Decimal('102.00'),
+                )])
+        self.assertFalse(Transaction.objects.exists())
+
+
+class PayoutTest(APITestCase):
+    """Test cases for bulk payout jobs"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username='admin',
+            email='admin@example.com',
+            password='testpass123'
+        )
+        self.wallets = []
+        for n in range(3):
+            user = User.objects.create_user(username=f'payee{n}', email=f'payee{n}@example.com', password='testpass123')
+            self.wallets.append(Wallet.objects.create(user=user, balance=Decimal('10.00')))
+        self.client.force_authenticate(user=self.admin)
+
+    def _run_job(self, job_id):
+        from . import payouts
+        from .tasks import process_payout_chunk
+
+        PayoutJob.objects.filter(id=job_id).update(status='PROCESSING')
+        for first, last in payouts.chunk_bounds(job_id, 2):
+            process_payout_chunk(job_id, first, last)
+
+    def test_json_payout_job(self):
+        first, second, third = self.wallets
+        rows = [
+            {'wallet': str(first.id), 'amount': '5.00', 'reference': 'salary-1'},
+            {'wallet': str(second.id), 'amount': '7.50'},
+            {'wallet': str(first.id), 'amount': '1.25', 'reference': 'bonus-1'},
+            {'wallet': 'not-a-uuid', 'amount': '1.00'},
+            {'wallet': str(third.id), 'amount': '-3'},
+        ]
+        response = self.client.post(reverse('wallet:payout_create'), {'items': rows}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['failed_items'], 2)
+
+        job_id = response.data['id']
+        self._run_job(job_id)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.balance, Decimal('16.25'))
+        self.assertEqual(second.balance, Decimal('17.50'))
+        credits = list(first.transactions.order_by('balance_after'))
+        self.assertEqual([t.balance_after for t in credits], [Decimal('15.00'), Decimal('16.25')])
+
+        progress = self.client.get(reverse('wallet:payout_detail', args=[job_id]))
+        self.assertEqual(progress.data['status'], 'COMPLETED')
+        self.assertEqual(progress.data['succeeded_items'], 3)
+        self.assertEqual(progress.data['progress'], 100.0)
+
+        failures = self.client.get(reverse('wallet:payout_failures', args=[job_id]))
+        self.assertEqual([row['row_number'] for row in failures.data['results']], [4, 5])
+
+    def test_csv_payout_job(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        content = f"wallet,amount,reference\n{self.wallets[0].id},2.00,a\n{uuid4()},3.00,b\n"
+        upload = SimpleUploadedFile('payouts.csv', content.encode(), content_type='text/csv')
+        response = self.client.post(reverse('wallet:payout_create'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        self._run_job(response.data['id'])
+        job = PayoutJob.objects.get(id=response.data['id'])
+        self.assertEqual((job.succeeded_items, job.failed_items), (1, 1))
+        self.assertEqual(job.items.get(row_number=2).error, 'Wallet not found')
+
+    def test_payout_requires_admin(self):
+        self.client.force_authenticate(user=self.wallets[0].user)
+        response = self.client.post(reverse('wallet:payout_create'), [], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
 class SerializerTest(TestCase):
     """Test cases for serializers"""
     
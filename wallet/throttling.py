@@ -0,0 +1,175 @@
+"""
+Distributed rate limiting.
+
+Each throttle key (user, client IP or endpoint scope plus either) is a
+token bucket in Redis holding up to ``num_requests`` tokens and refilling
+at ``num_requests / duration`` per second, updated by one Lua script so
+concurrent workers cannot race.
+
+Processes skip the round trip for clients that are clearly under their
+limit: after a Redis reply a process remembers the bucket's level for
+THROTTLE_LOCAL_TTL seconds and lets requests through locally while that
+level, less what it has let through since, stays above
+THROTTLE_LOCAL_HEADROOM of the bucket. Requests let through locally are
+charged to the bucket on the next round trip, which happens at the
+latest after THROTTLE_LOCAL_BATCH of the bucket has been spent.
+
+Like the other Redis users this fails open to the process: without Redis
+each process enforces the limits on its own.
+"""
+import threading
+import time
+
+import redis
+from django.conf import settings
+from rest_framework import throttling
+
+from .cache import LocalLRU
+from .redis_client import get_redis, mark_redis_down
+
+# Refill, charge what was let through locally, then take one token if there is one
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local spent = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(state[1]) or capacity
+local at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - at) * rate) - spent
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class _Bucket:
+    """What this process knows about one bucket"""
+    __slots__ = ('tokens', 'at', 'pending')
+
+    def __init__(self, tokens, at):
+        self.tokens = tokens
+        self.at = at
+        self.pending = 0
+
+
+_known = LocalLRU(settings.THROTTLE_LOCAL_SIZE)
+_fallback = LocalLRU(settings.THROTTLE_LOCAL_SIZE)
+_lock = threading.Lock()
+_stats = dict.fromkeys(['local', 'redis', 'fallback', 'throttled'], 0)
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def stats():
+    """Decision counters of this process"""
+    with _lock:
+        return dict(_stats)
+
+
+def reset():
+    """Forget this process's bucket levels and counters"""
+    _known.clear()
+    _fallback.clear()
+    with _lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def _take_locally(key, capacity, rate):
+    """Token bucket kept by this process alone, used while Redis is unavailable"""
+    _count('fallback')
+    now = time.monotonic()
+    with _lock:
+        bucket = _fallback.get(key) or _Bucket(capacity, now)
+        bucket.tokens = min(capacity, bucket.tokens + (now - bucket.at) * rate)
+        bucket.at = now
+        allowed = bucket.tokens >= 1
+        if allowed:
+            bucket.tokens -= 1
+        _fallback.set(key, bucket, capacity / rate)
+        return allowed, bucket.tokens
+
+
+def take(key, capacity, duration):
+    """
+    Take one token from bucket ``key``. Returns ``(allowed, retry_after)``
+    where ``retry_after`` is the seconds until a token is available.
+    """
+    rate = capacity / duration
+    with _lock:
+        bucket = _known.get(key)
+        spent = 0
+        if bucket is not None:
+            batch = max(1, int(capacity * settings.THROTTLE_LOCAL_BATCH))
+            if bucket.pending < batch and bucket.tokens - bucket.pending - 1 >= capacity * settings.THROTTLE_LOCAL_HEADROOM:
+                bucket.pending += 1
+                _stats['local'] += 1
+                return True, None
+            spent, bucket.pending = bucket.pending, 0
+
+    client = get_redis()
+    tokens = None
+    if client is not None:
+        try:
+            allowed, tokens = client.register_script(_TAKE_SCRIPT)(
+                keys=[f"throttle:{key}"], args=[capacity, rate, spent]
+            )
+            allowed, tokens = bool(allowed), float(tokens)
+            _count('redis')
+            _known.set(key, _Bucket(tokens, time.monotonic()), settings.THROTTLE_LOCAL_TTL)
+        except redis.RedisError as exc:
+            mark_redis_down(exc)
+            tokens = None
+    if tokens is None:
+        allowed, tokens = _take_locally(key, capacity, rate)
+
+    if allowed:
+        return True, None
+    _count('throttled')
+    return False, max(0.0, (1 - tokens) / rate)
+
+
+class TokenBucketThrottle(throttling.SimpleRateThrottle):
+    """SimpleRateThrottle with its request history replaced by a shared token bucket"""
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        allowed, self.retry_after = take(self.key, self.num_requests, self.duration)
+        return allowed
+
+    def wait(self):
+        return getattr(self, 'retry_after', None)
+
+
+class AnonRateThrottle(TokenBucketThrottle, throttling.AnonRateThrottle):
+    """Limits unauthenticated requests per client IP (``anon`` rate)"""
+
+
+class UserRateThrottle(TokenBucketThrottle, throttling.UserRateThrottle):
+    """Limits requests per user, or per IP when unauthenticated (``user`` rate)"""
+
+
+class ScopedRateThrottle(TokenBucketThrottle, throttling.ScopedRateThrottle):
+    """Limits views with a ``throttle_scope`` per user or IP at that scope's rate"""
+
+    def allow_request(self, request, view):
+        self.scope = getattr(view, self.scope_attr, None)
+        if not self.scope:
+            return True
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
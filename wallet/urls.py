@@ -6,11 +6,14 @@ app_name = 'wallet'
 urlpatterns = [
     # Health check
     path('health/', views.HealthCheckView.as_view(), name='health_check'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
     
     # Authentication endpoints
     path('auth/register/', views.UserRegistrationView.as_view(), name='register'),
     path('auth/login/', views.UserLoginView.as_view(), name='login'),
     path('auth/refresh/', views.refresh_token, name='refresh_token'),
+    path('auth/logout/', views.LogoutView.as_view(), name='logout'),
+    path('auth/logout/all/', views.LogoutAllView.as_view(), name='logout_all'),
     
     # User profile
     path('profile/', views.UserProfileView.as_view(), name='profile'),
@@ -19,8 +22,16 @@ urlpatterns = [
     path('wallet/balance/', views.WalletBalanceView.as_view(), name='wallet_balance'),
     path('wallet/topup/', views.TopUpWalletView.as_view(), name='topup_wallet'),
     path('wallet/withdraw/', views.WithdrawFromWalletView.as_view(), name='withdraw_wallet'),
+    path('wallet/transfer/', views.TransferView.as_view(), name='transfer'),
+    path('wallet/statement/', views.WalletStatementView.as_view(), name='wallet_statement'),
     
     # Transaction endpoints
     path('transactions/', views.TransactionHistoryView.as_view(), name='transaction_history'),
+    path('transactions/export/', views.TransactionExportView.as_view(), name='transaction_export'),
     path('transactions/<uuid:pk>/', views.TransactionDetailView.as_view(), name='transaction_detail'),
+
+    # Bulk payout endpoints
+    path('payouts/', views.PayoutJobCreateView.as_view(), name='payout_create'),
+    path('payouts/<uuid:pk>/', views.PayoutJobDetailView.as_view(), name='payout_detail'),
+    path('payouts/<uuid:pk>/failures/', views.PayoutFailureListView.as_view(), name='payout_failures'),
 ] 
\ No newline at end of file
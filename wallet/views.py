@@ -1,33 +1,109 @@
 from rest_framework import status, generics, permissions
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import AuthenticationFailed, NotFound
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import RefreshToken
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Subquery
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import ValidationError
-from decimal import Decimal
+from django.utils.crypto import constant_time_compare
 
-from .models import User, Wallet, Transaction
+from . import cache as wallet_cache, ledger, metrics, outbox, payouts, revocation, routing, sharding
+from .conditional import conditional
+from .archive import ArchivedTransactions
+from .exports import stream_transactions
+from .filters import filter_transactions, history_filters
+from .idempotency import idempotent
+from .middleware import CRITICAL, LOW
+from .pagination import TransactionPagination
+from .renderers import CSVRenderer, NDJSONRenderer, ORJSONRenderer, PrometheusRenderer
+from .statements import build_statement
+from .tasks import process_payout_job
+from .models import User, Wallet, Transaction, InsufficientBalance, PayoutJob, PayoutItem
 from .serializers import (
     UserRegistrationSerializer, UserLoginSerializer, UserSerializer,
-    WalletSerializer, TransactionSerializer, TopUpSerializer,
-    WithdrawalSerializer, TransactionListSerializer
+    WalletStateSerializer, TransactionSerializer, TopUpSerializer,
+    WithdrawalSerializer, TransferSerializer, TransactionListSerializer,
+    PayoutJobCreateSerializer, PayoutJobSerializer, PayoutItemSerializer,
+    StatementPeriodSerializer, StatementSerializer,
+    TRANSACTION_EXPORT_PROJECTION, TRANSACTION_LIST_PROJECTION
 )
 from drf_yasg.utils import swagger_auto_schema
 
 
+class ReplicaReadMixin:
+    """Reads of GET/HEAD requests go to a replica unless the user just moved money"""
+
+    def dispatch(self, request, *args, **kwargs):
+        self.read_token = None
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self.read_token is not None:
+                routing.end_reads(self.read_token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in permissions.SAFE_METHODS:
+            self.read_token = routing.begin_reads(routing.read_alias(request.user.pk))
+
+
+class UserShardMixin:
+    """Wallet queries of the request go to the shard holding the requesting user's wallet"""
+
+    def dispatch(self, request, *args, **kwargs):
+        self.shard_token = None
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self.shard_token is not None:
+                sharding.end_shard(self.shard_token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.shard_token = sharding.begin_shard(sharding.shard_for_user(request.user.pk))
+
+
 class HealthCheckView(APIView):
     """Health check endpoint"""
     permission_classes = [permissions.AllowAny]
+    shed_priority = CRITICAL
     
     def get(self, request):
         return Response({"status": "healthy", "message": "Wallet API is running"}, status=status.HTTP_200_OK)
 
 
+class MetricsView(APIView):
+    """Connection pool and outbox relay metrics of every worker for Prometheus, behind METRICS_TOKEN"""
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+    throttle_classes = []
+    shed_priority = CRITICAL
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request):
+        if not settings.METRICS_TOKEN:
+            raise NotFound('Metrics are disabled')
+        supplied = request.META.get('HTTP_AUTHORIZATION', '')
+        if not constant_time_compare(supplied, f'Bearer {settings.METRICS_TOKEN}'):
+            raise AuthenticationFailed('Invalid metrics token')
+        return Response(metrics.render(metrics.worker_snapshots(), outbox.backlog()))
+
+    def handle_exception(self, exc):
+        self.request.accepted_renderer = ORJSONRenderer()
+        self.request.accepted_media_type = ORJSONRenderer.media_type
+        return super().handle_exception(exc)
+
+
 class UserRegistrationView(APIView):
     """User registration endpoint"""
     permission_classes = [permissions.AllowAny]
+    throttle_scope = 'auth'
     serializer_class = UserRegistrationSerializer
 
     @swagger_auto_schema(request_body=UserRegistrationSerializer)
@@ -35,14 +111,10 @@ class UserRegistrationView(APIView):
         serializer = self.serializer_class(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
-            refresh = RefreshToken.for_user(user)
             return Response({
                 'message': 'User registered successfully',
                 'user': UserSerializer(user).data,
-                'tokens': {
-                    'access': str(refresh.access_token),
-                    'refresh': str(refresh),
-                }
+                'tokens': revocation.issue_tokens(user),
             }, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -50,6 +122,7 @@ class UserRegistrationView(APIView):
 class UserLoginView(APIView):
     """User login endpoint"""
     permission_classes = [permissions.AllowAny]
+    throttle_scope = 'auth'
     serializer_class = UserLoginSerializer
 
     @swagger_auto_schema(request_body=UserLoginSerializer)
@@ -57,22 +130,34 @@ class UserLoginView(APIView):
         serializer = self.serializer_class(data=request.data)
         if serializer.is_valid():
             user = serializer.validated_data['user']
-            refresh = RefreshToken.for_user(user)
             return Response({
                 'message': 'Login successful',
                 'user': UserSerializer(user).data,
-                'tokens': {
-                    'access': str(refresh.access_token),
-                    'refresh': str(refresh),
-                }
+                'tokens': revocation.issue_tokens(user),
             }, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def profile_version(view, request):
+    return [request.user.pk, request.user.updated_at], request.user.updated_at
+
+
+def balance_version(view, request):
+    # Hot-wallet credits do not touch wallets.updated_at, so no Last-Modified
+    return [view.get_state(request), request.user.pk, request.user.updated_at], None
+
+
+def history_version(view, request):
+    # Every write to a wallet's history, removals included, bumps its version in the same
+    # transaction; no timestamp covers a removal
+    return [Wallet.objects.history_version(request.user)], None
+
+
 class UserProfileView(APIView):
     """User profile endpoint"""
     permission_classes = [permissions.IsAuthenticated]
     
+    @conditional(profile_version)
     def get(self, request):
         serializer = UserSerializer(request.user)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -85,35 +170,75 @@ class UserProfileView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class WalletBalanceView(APIView):
+class WalletBalanceView(UserShardMixin, APIView):
     """Get wallet balance endpoint"""
     permission_classes = [permissions.IsAuthenticated]
     
+    state = None
+
+    @conditional(balance_version)
     def get(self, request):
-        try:
-            wallet = request.user.wallet
-            serializer = WalletSerializer(wallet)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except Wallet.DoesNotExist:
+        state = self.get_state(request)
+        data = {'id': state['id'], 'user': UserSerializer(request.user).data}
+        data.update((name, value) for name, value in state.items() if name != 'id')
+        return Response(data, status=status.HTTP_200_OK)
+
+    def get_state(self, request):
+        """Serialized wallet of the requesting user, read through the wallet cache"""
+        if self.state is not None:
+            return self.state
+        user = request.user
+        wallet_id = wallet_cache.wallet_id_for(
+            user.pk, lambda: Wallet.objects.filter(user=user).values_list('id', flat=True).first()
+        )
+        if wallet_id is not None:
+            self.state = wallet_cache.wallet_state(wallet_id, lambda: self.load_state(wallet_id))
+        if self.state is None:
             # Create wallet if it doesn't exist
-            wallet = Wallet.objects.create(user=request.user)
-            serializer = WalletSerializer(wallet)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            with sharding.atomic(user.pk):
+                wallet, _ = Wallet.objects.get_or_create(user=user)
+            self.state = WalletStateSerializer(wallet).data
+        return self.state
+
+    @staticmethod
+    def load_state(wallet_id):
+        wallet = Wallet.objects.filter(pk=wallet_id).first()
+        return dict(WalletStateSerializer(wallet).data) if wallet else None
+
+
+class WalletStatementView(UserShardMixin, APIView):
+    """Wallet statement endpoint, built from daily rollups"""
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'exports'
+    shed_priority = LOW
+    stateless_authentication = True
+
+    def get(self, request):
+        period = StatementPeriodSerializer(data=request.query_params)
+        period.is_valid(raise_exception=True)
+        wallet = get_object_or_404(Wallet, user=request.user)
+        statement = build_statement(wallet, period.validated_data['start'], period.validated_data['end'])
+        return Response(StatementSerializer(statement).data, status=status.HTTP_200_OK)
 
 
 class TopUpWalletView(APIView):
     """Top up wallet endpoint"""
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'money'
+    shed_priority = CRITICAL
     
-    @transaction.atomic
+    @idempotent
     def post(self, request):
+        # Before writing, so no read can reach a replica that lacks the write
+        routing.pin_to_primary(request.user.pk)
         serializer = TopUpSerializer(data=request.data)
         if serializer.is_valid():
+            amount = serializer.validated_data['amount']
+            currency = serializer.validated_data['currency']
+            description = serializer.validated_data.get('description', 'Wallet top-up')
+
             try:
                 wallet = request.user.wallet
-                amount = serializer.validated_data['amount']
-                currency = serializer.validated_data['currency']
-                description = serializer.validated_data.get('description', 'Wallet top-up')
                 
                 # Check if currency matches wallet currency
                 if wallet.currency != currency:
@@ -121,51 +246,23 @@ class TopUpWalletView(APIView):
                         'error': f'Currency mismatch. Wallet currency is {wallet.currency}'
                     }, status=status.HTTP_400_BAD_REQUEST)
                 
-                # Record balance before transaction
-                balance_before = wallet.balance
-                
-                # Perform deposit
-                wallet.deposit(amount)
-                
-                # Create transaction record
-                transaction_obj = Transaction.objects.create(
-                    wallet=wallet,
-                    transaction_type='DEPOSIT',
-                    amount=amount,
-                    currency=currency,
-                    status='COMPLETED',
-                    description=description,
-                    balance_before=balance_before,
-                    balance_after=wallet.balance
-                )
+                transaction_obj = ledger.deposit(wallet, amount, description=description)
                 
                 return Response({
                     'message': 'Wallet topped up successfully',
-                    'transaction': TransactionSerializer(transaction_obj).data,
-                    'new_balance': wallet.balance
+                    'transaction': TransactionSerializer(transaction_obj, context={'request': request}).data,
+                    'new_balance': transaction_obj.balance_after
                 }, status=status.HTTP_200_OK)
                 
             except Wallet.DoesNotExist:
                 # Create wallet if it doesn't exist
                 wallet = Wallet.objects.create(user=request.user, currency=currency)
-                balance_before = Decimal('0.00')
-                wallet.deposit(amount)
-                
-                transaction_obj = Transaction.objects.create(
-                    wallet=wallet,
-                    transaction_type='DEPOSIT',
-                    amount=amount,
-                    currency=currency,
-                    status='COMPLETED',
-                    description=description,
-                    balance_before=balance_before,
-                    balance_after=wallet.balance
-                )
+                transaction_obj = ledger.deposit(wallet, amount, description=description)
                 
                 return Response({
                     'message': 'Wallet created and topped up successfully',
-                    'transaction': TransactionSerializer(transaction_obj).data,
-                    'new_balance': wallet.balance
+                    'transaction': TransactionSerializer(transaction_obj, context={'request': request}).data,
+                    'new_balance': transaction_obj.balance_after
                 }, status=status.HTTP_201_CREATED)
                 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -174,9 +271,12 @@ class TopUpWalletView(APIView):
 class WithdrawFromWalletView(APIView):
     """Withdraw from wallet endpoint"""
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'money'
+    shed_priority = CRITICAL
     
-    @transaction.atomic
+    @idempotent
     def post(self, request):
+        routing.pin_to_primary(request.user.pk)
         serializer = WithdrawalSerializer(data=request.data)
         if serializer.is_valid():
             try:
@@ -184,38 +284,22 @@ class WithdrawFromWalletView(APIView):
                 amount = serializer.validated_data['amount']
                 description = serializer.validated_data.get('description', 'Wallet withdrawal')
                 
-                # Check if wallet has sufficient balance
-                if not wallet.can_withdraw(amount):
-                    return Response({
-                        'error': 'Insufficient balance',
-                        'current_balance': wallet.balance,
-                        'requested_amount': amount
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                
-                # Record balance before transaction
-                balance_before = wallet.balance
-                
-                # Perform withdrawal
-                wallet.withdraw(amount)
-                
-                # Create transaction record
-                transaction_obj = Transaction.objects.create(
-                    wallet=wallet,
-                    transaction_type='WITHDRAWAL',
-                    amount=amount,
-                    currency=wallet.currency,
-                    status='COMPLETED',
-                    description=description,
-                    balance_before=balance_before,
-                    balance_after=wallet.balance
-                )
+                # The balance check and the debit happen in one conditional UPDATE
+                transaction_obj = ledger.withdraw(wallet, amount, description=description)
                 
                 return Response({
                     'message': 'Withdrawal successful',
-                    'transaction': TransactionSerializer(transaction_obj).data,
-                    'new_balance': wallet.balance
+                    'transaction': TransactionSerializer(transaction_obj, context={'request': request}).data,
+                    'new_balance': transaction_obj.balance_after
                 }, status=status.HTTP_200_OK)
                 
+            except InsufficientBalance:
+                return Response({
+                    'error': 'Insufficient balance',
+                    'current_balance': wallet.total_balance,
+                    'requested_amount': amount
+                }, status=status.HTTP_400_BAD_REQUEST)
+                
             except Wallet.DoesNotExist:
                 return Response({
                     'error': 'Wallet not found'
@@ -224,30 +308,176 @@ class WithdrawFromWalletView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class TransactionHistoryView(generics.ListAPIView):
+class TransferView(APIView):
+    """Wallet-to-wallet transfer endpoint"""
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'money'
+    shed_priority = CRITICAL
+
+    @swagger_auto_schema(request_body=TransferSerializer)
+    @idempotent
+    def post(self, request):
+        routing.pin_to_primary(request.user.pk)
+        serializer = TransferSerializer(data=request.data)
+        if serializer.is_valid():
+            amount = serializer.validated_data['amount']
+            description = serializer.validated_data.get('description', 'Wallet transfer')
+
+            try:
+                wallet = request.user.wallet
+            except Wallet.DoesNotExist:
+                return Response({
+                    'error': 'Wallet not found'
+                }, status=status.HTTP_404_NOT_FOUND)
+
+            recipient_email = serializer.validated_data['recipient_email']
+            recipient = Wallet.objects.filter(user__email=recipient_email).first()
+            if recipient is None and sharding.enabled() and User.objects.filter(email=recipient_email).exists():
+                return Response({
+                    'error': 'Transfers to wallets on another shard are not supported'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if recipient is None:
+                return Response({
+                    'error': 'Recipient wallet not found'
+                }, status=status.HTTP_404_NOT_FOUND)
+            sharding.claim(recipient._state.db, recipient.user_id)
+
+            try:
+                debit, credit = ledger.transfer(wallet, recipient, amount, description=description)
+            except InsufficientBalance:
+                return Response({
+                    'error': 'Insufficient balance',
+                    'current_balance': wallet.total_balance,
+                    'requested_amount': amount
+                }, status=status.HTTP_400_BAD_REQUEST)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            return Response({
+                'message': 'Transfer successful',
+                'transaction': TransactionSerializer(debit, context={'request': request}).data,
+                'new_balance': debit.balance_after
+            }, status=status.HTTP_200_OK)
+
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+def own_transactions(user):
+    """Transactions of the user's wallet, with the wallet looked up inside the same query"""
+    wallet_id = Wallet.objects.filter(user=user).values('id')
+    return Transaction.objects.filter(wallet_id=Subquery(wallet_id))
+
+
+class TransactionHistoryView(ReplicaReadMixin, UserShardMixin, generics.ListAPIView):
     """List transaction history endpoint"""
     permission_classes = [permissions.IsAuthenticated]
+    shed_priority = LOW
+    stateless_authentication = True
     serializer_class = TransactionListSerializer
-    
+    pagination_class = TransactionPagination
+    # Rows in cold storage, merged into pages by the paginator
+    archived = None
+
+    @conditional(history_version)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
-        try:
-            wallet = self.request.user.wallet
-            return Transaction.objects.filter(wallet=wallet)
-        except Wallet.DoesNotExist:
-            return Transaction.objects.none()
+        queryset = filter_transactions(own_transactions(self.request.user), self.request.query_params)
+        return TRANSACTION_LIST_PROJECTION.queryset(queryset)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        self.archived = ArchivedTransactions.for_user(
+            request.user, history_filters(request.query_params), TRANSACTION_LIST_PROJECTION.columns
+        )
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(TRANSACTION_LIST_PROJECTION.map_rows(page))
+
+
+class TransactionExportView(ReplicaReadMixin, UserShardMixin, APIView):
+    """Stream the full transaction history as NDJSON (default) or CSV"""
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'exports'
+    shed_priority = LOW
+    stateless_authentication = True
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+
+    def get(self, request):
+        queryset = filter_transactions(own_transactions(request.user), request.query_params)
+        # Rows are read after the view returns, outside the routing context
+        queryset = queryset.using(queryset.db)
+        archived = ArchivedTransactions.for_user(
+            request.user, history_filters(request.query_params), TRANSACTION_EXPORT_PROJECTION.columns
+        )
+        gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        renderer = request.accepted_renderer
+        media_type = f'{renderer.media_type}; charset={renderer.charset}' if renderer.charset else renderer.media_type
+        return stream_transactions(queryset, renderer.format, media_type, gzip=gzip, archived=archived)
+
+    def handle_exception(self, exc):
+        # Errors are JSON whichever export format was asked for
+        self.request.accepted_renderer = ORJSONRenderer()
+        self.request.accepted_media_type = ORJSONRenderer.media_type
+        return super().handle_exception(exc)
 
 
-class TransactionDetailView(generics.RetrieveAPIView):
+class TransactionDetailView(ReplicaReadMixin, UserShardMixin, generics.RetrieveAPIView):
     """Get transaction detail endpoint"""
     permission_classes = [permissions.IsAuthenticated]
+    shed_priority = LOW
+    stateless_authentication = True
     serializer_class = TransactionSerializer
     
     def get_queryset(self):
+        return TransactionSerializer.setup_eager_loading(own_transactions(self.request.user), self.get_serializer_context())
+
+
+class PayoutJobCreateView(APIView):
+    """Create bulk payout job endpoint"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request):
+        # Rows come from an uploaded CSV file, a bare JSON array or an 'items' list
+        upload = request.FILES.get('file')
+        options = request.data if not isinstance(request.data, list) else {}
+        serializer = PayoutJobCreateSerializer(data={
+            key: options[key] for key in ('description', 'currency') if key in options
+        })
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
         try:
-            wallet = self.request.user.wallet
-            return Transaction.objects.filter(wallet=wallet)
-        except Wallet.DoesNotExist:
-            return Transaction.objects.none()
+            if upload is not None:
+                rows = payouts.read_csv_rows(upload)
+            elif isinstance(request.data, list):
+                rows = request.data
+            else:
+                rows = request.data.get('items')
+            job = payouts.create_job(request.user, rows, **serializer.validated_data)
+        except payouts.PayoutFormatError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if job.status == 'PENDING':
+            transaction.on_commit(lambda: process_payout_job.delay(str(job.id)))
+
+        return Response(PayoutJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class PayoutJobDetailView(generics.RetrieveAPIView):
+    """Bulk payout job progress endpoint"""
+    permission_classes = [permissions.IsAdminUser]
+    serializer_class = PayoutJobSerializer
+    queryset = PayoutJob.objects.all()
+
+
+class PayoutFailureListView(generics.ListAPIView):
+    """List failed rows of a bulk payout job endpoint"""
+    permission_classes = [permissions.IsAdminUser]
+    serializer_class = PayoutItemSerializer
+
+    def get_queryset(self):
+        return PayoutItem.objects.filter(job_id=self.kwargs['pk'], status='FAILED')
 
 
 @api_view(['POST'])
@@ -260,9 +490,46 @@ def refresh_token(request):
             return Response({'error': 'Refresh token is required'}, status=status.HTTP_400_BAD_REQUEST)
         
         refresh = RefreshToken(refresh_token)
+        if revocation.is_revoked(refresh):
+            return Response({'error': 'Refresh token has been revoked'}, status=status.HTTP_401_UNAUTHORIZED)
         return Response({
             'access': str(refresh.access_token),
             'refresh': str(refresh),
         }, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({'error': 'Invalid refresh token'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class LogoutView(APIView):
+    """End the current session, and the session of ``refresh`` if given"""
+    permission_classes = [permissions.IsAuthenticated]
+    shed_priority = CRITICAL
+
+    def post(self, request):
+        try:
+            refresh = RefreshToken(request.data['refresh']) if request.data.get('refresh') else None
+        except TokenError:
+            return Response({'error': 'Invalid refresh token'}, status=status.HTTP_400_BAD_REQUEST)
+        if refresh is not None and str(refresh[api_settings.USER_ID_CLAIM]) != str(request.user.pk):
+            return Response({'error': 'Invalid refresh token'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            for token in [request.auth, refresh]:
+                if token is not None:
+                    revocation.revoke_session(token)
+        except revocation.RevocationUnavailable as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({'message': 'Logged out successfully'}, status=status.HTTP_200_OK)
+
+
+class LogoutAllView(APIView):
+    """Revoke every session of the current user"""
+    permission_classes = [permissions.IsAuthenticated]
+    shed_priority = CRITICAL
+
+    def post(self, request):
+        try:
+            revocation.revoke_user(request.user.pk)
+        except revocation.RevocationUnavailable as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({'message': 'All sessions revoked'}, status=status.HTTP_200_OK)